@@ -25,6 +25,7 @@ from watcher.model import *
 from watcher.connection import get_db_url, redis_connection
 from watcher.remote import APIUser
 from watcher.lite_tasks import task_record_event, task_write_image
+from watcher.metrics import read_totals, read_window, prometheus_text
 
 from watcher import output, setup_logging, application_config
 
@@ -93,6 +94,15 @@ def create_app(db_url=None, db_options={}, testing=False) -> Flask:
 
         return {'number_of_observations': num_observations}
 
+    # task names and timings are only for API users, so a Prometheus scrape job logs in like the
+    # other clients, with basic_auth from an APIUser
+    @app.route("/metrics")
+    @auth.login_required
+    def metrics():
+        connection = redis_connection()
+        text = prometheus_text(read_totals(connection), read_window(connection))
+        return Response(text, mimetype='text/plain; version=0.0.4')
+
 
     @app.route("/batch", methods=['POST'])
     @auth.login_required
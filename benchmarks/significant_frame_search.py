@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# Compare exhaustive and coarse-to-fine significant frame search on real clips:
+# how much faster the coarse search is, and how often it picks a different frame.
+#
+#   python3 benchmarks/significant_frame_search.py data/video/*/capture/*.mp4 --step 5
+
+import sys
+import time
+import argparse
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from watcher.video import EventVideo
+
+def timed_search(video_file, search, step, candidates):
+    vid = EventVideo.from_file(video_file)
+    vid.search = search
+    vid.coarse_step = step
+    vid.coarse_candidates = candidates
+
+    start = time.perf_counter()
+    frame = vid.most_significant_frame()
+    return frame, time.perf_counter() - start, vid.frame_rate
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark coarse-to-fine significant frame search')
+    parser.add_argument('video_files', nargs='+', type=Path)
+    parser.add_argument('--step', type=int, default=5)
+    parser.add_argument('--candidates', type=int, default=2)
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='frames apart that still count as the same choice')
+    args = parser.parse_args()
+
+    exhaustive_total = coarse_total = 0
+    different = 0
+
+    for video_file in args.video_files:
+        exhaustive_frame, exhaustive_time, frame_rate = timed_search(video_file, 'exhaustive', args.step, args.candidates)
+        coarse_frame, coarse_time, _ = timed_search(video_file, 'coarse', args.step, args.candidates)
+
+        exhaustive_total += exhaustive_time
+        coarse_total += coarse_time
+        if abs(coarse_frame - exhaustive_frame) > args.tolerance:
+            different += 1
+
+        print(f"{video_file.name}: exhaustive f{exhaustive_frame} {exhaustive_time:.2f}s, "
+              f"coarse f{coarse_frame} {coarse_time:.2f}s ({exhaustive_time/coarse_time:.1f}x), "
+              f"{abs(coarse_frame - exhaustive_frame) / float(frame_rate):.2f}s apart")
+
+    count = len(args.video_files)
+    print(f"{count} clips, step {args.step}, {args.candidates} candidates")
+    print(f"speedup: {exhaustive_total/coarse_total:.1f}x ({exhaustive_total:.1f}s -> {coarse_total:.1f}s)")
+    print(f"different frame chosen: {different}/{count} ({different/count:.0%}) at tolerance {args.tolerance}")
+
+if __name__ == "__main__":
+    main()
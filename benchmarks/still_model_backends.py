@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Compare the fastai and onnx prediction backends on the same stills: startup time,
+# latency per image alone and in batches, peak RSS, and how closely their outputs agree.
+# Each backend runs in its own process so startup and memory are measured from scratch.
+#
+#   python3 watchutil.py export-model
+#   python3 benchmarks/still_model_backends.py data/video/*/*/*/*/*_f*.jpg --batch 8
+
+import sys
+import json
+import time
+import resource
+import argparse
+import statistics
+import subprocess
+
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+def measure(backend, image_files, batch_size, repeat):
+    start = time.perf_counter()
+    from watcher.predict_still import still_model_file
+    from watcher.still_model import load_still_model
+    model = load_still_model(still_model_file(backend), backend)
+    model.probabilities(image_files[:1])
+    startup = time.perf_counter() - start
+
+    single = []
+    for _ in range(repeat):
+        for f in image_files:
+            t = time.perf_counter()
+            model.probabilities([f])
+            single.append(time.perf_counter() - t)
+
+    batched = []
+    for _ in range(repeat):
+        for i in range(0, len(image_files), batch_size):
+            batch = image_files[i:i + batch_size]
+            t = time.perf_counter()
+            model.probabilities(batch)
+            batched.append((time.perf_counter() - t) / len(batch))
+
+    return {
+        'startup': startup,
+        'single_ms': 1000 * statistics.median(single),
+        'batched_ms': 1000 * statistics.median(batched),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'thresh': model.thresh,
+        'probabilities': model.probabilities(image_files).tolist(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark still classifier backends')
+    parser.add_argument('image_files', nargs='+')
+    parser.add_argument('--backends', nargs='+', default=['fastai', 'onnx'])
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.image_files, args.batch, args.repeat)))
+        return
+
+    results = {}
+    for backend in args.backends:
+        out = subprocess.run([sys.executable, __file__, '--child', backend, '--batch', str(args.batch),
+                              '--repeat', str(args.repeat)] + args.image_files,
+                             capture_output=True, text=True, check=True)
+        results[backend] = json.loads(out.stdout.strip().splitlines()[-1])
+
+        r = results[backend]
+        print(f"{backend}: startup {r['startup']:.2f}s, {r['single_ms']:.1f}ms/image alone, "
+              f"{r['batched_ms']:.1f}ms/image in batches of {args.batch}, peak RSS {r['max_rss_mb']:.0f}MB")
+
+    reference, *others = args.backends
+    ref = np.array(results[reference]['probabilities'])
+    for backend in others:
+        probs = np.array(results[backend]['probabilities'])
+        same_masks = ((probs > results[backend]['thresh']) == (ref > results[reference]['thresh'])).all(axis=1)
+        print(f"{backend} vs {reference}: max probability difference {np.abs(probs - ref).max():.4f}, "
+              f"same labels for {same_masks.sum()}/{len(same_masks)} images")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# Compare the per-frame threshold_video against the batched MotionMaskEngine
+# on synthetic stacks of frame distances.
+#
+#   python3 benchmarks/threshold_video.py --frames 50 --width 1920 --height 1080
+
+import sys
+import time
+import argparse
+
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from watcher.image_functions import rescale, threshold_video, MotionMaskEngine
+
+def synthetic_norms(num_frames, height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    norms = rng.normal(8, 3, size=(num_frames, height, width)).astype(np.float32)
+
+    # a few bright moving blobs so the threshold has something to find
+    for i in range(num_frames):
+        y = (i * 7) % (height - 40)
+        x = (i * 13) % (width - 60)
+        norms[i, y:y+40, x:x+60] += 200
+
+    return norms
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark threshold_video against MotionMaskEngine')
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    norms = synthetic_norms(args.frames, args.height, args.width)
+    engine = MotionMaskEngine()
+
+    reference_time, reference = best_of(lambda: threshold_video(rescale(norms)), args.repeat)
+    batched_time, batched = best_of(lambda: engine.mask(norms), args.repeat)
+
+    print(f"{args.frames} frames of {args.width}x{args.height}, best of {args.repeat}")
+    print(f"rescale + threshold_video: {reference_time*1000:8.1f} ms  ({reference_time/args.frames*1000:.2f} ms/frame)")
+    print(f"MotionMaskEngine.mask:     {batched_time*1000:8.1f} ms  ({batched_time/args.frames*1000:.2f} ms/frame)")
+    print(f"speedup: {reference_time/batched_time:.1f}x, identical: {np.array_equal(reference, batched)}")
+
+if __name__ == "__main__":
+    main()
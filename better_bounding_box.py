@@ -7,6 +7,8 @@ import json
 import argparse
 
 from watcher import *
+from watcher.background import SceneBackground
+from watcher.bounding_box import find_boxes
 
 NUM_FRAMES_FOR_BG = 6
 BOX_MARGIN = 5
@@ -29,48 +31,6 @@ def find_bg(cap, num_frames = NUM_FRAMES_FOR_BG):
 
 	return np.median(buf, axis=0).astype(dtype=np.uint8), i
 
-def is_overlap(b1, b2):
-	if b1 is None or b2 is None: return False
-
-	x1, y1, w1, h1 = b1
-	x2, y2, w2, h2 = b2
-
-	return ( x1 <= x2 <= x1+w1 
-		and ( y1 <= y2 <= y1+h1 
-			or y1 <= y2+h2 <= y1+h2 
-			or y2 <= y1 <= y2+h2
-			or y2 <= y1+h1 <= y2+h2))
-
-def merge_overlapping(b1, b2):
-	x1, y1, w1, h1 = b1
-	x2, y2, w2, h2 = b2
-
-	xr = min(x1, x2)
-	yr = min(y1, y2)
-
-	wr = max(x1+w1, x2+w2) - xr
-	hr = max(y1+h1, y2+h2) - yr
-
-def merge_boxes(boxes):
-	if len(boxes) <= 1:
-		return boxes
-
-	boxes = sorted(boxes, key=lambda b: b[0])
-
-	merged = []
-	while len(boxes) > 0:
-		b = boxes.pop(0)
-		i = 0
-		while i < len(boxes):
-			b2 = boxes[i]
-			if is_overlap(b, b2):
-				b = merge_overlapping(b, b2)
-				i = 0
-			else:
-				i+=1
-		merged.append(b)
-	return merged
-
 def draw_boxes(base_image, boxes=[], color=(0,255,0)):
 	for b in boxes:
 		if b is None: continue
@@ -79,11 +39,26 @@ def draw_boxes(base_image, boxes=[], color=(0,255,0)):
 		
 	return base_image
 
-def find_moving_objects(video_source,show_work=False):
+def load_scene_bg(cap, scene_name):
+	width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
+	height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+
+	scene_bg = SceneBackground.load(scene_name, width, height, 'rgb24')
+	if not scene_bg or scene_bg.is_stale:
+		return None
+
+	return cv.cvtColor(scene_bg.image.astype(np.uint8), cv.COLOR_RGB2BGR)
+
+def find_moving_objects(video_source,show_work=False,scene_name=None):
 
 	cap = cv.VideoCapture(video_source)
 
-	bg, frames_since_start = find_bg(cap, NUM_FRAMES_FOR_BG)
+	# a stored scene background lets us start looking at frame 0, instead of after warming up
+	bg = load_scene_bg(cap, scene_name) if scene_name else None
+	if bg is not None:
+		frames_since_start = 0
+	else:
+		bg, frames_since_start = find_bg(cap, NUM_FRAMES_FOR_BG)
 
 	motion_in_progress = False
 	ring_buf = []
@@ -106,19 +81,8 @@ def find_moving_objects(video_source,show_work=False):
 
 		_, thresh = cv.threshold(blurred, 128, 255, cv.THRESH_BINARY)
 
-		# conturs, _ = cv.findContours(thresh, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-		conturs, _ = cv.findContours(thresh, cv.RETR_LIST, cv.CHAIN_APPROX_NONE)
-
-		num_valid = 0
-		boxes = []
-		for c in conturs:
-			x,y,w,h = cv.boundingRect(c)
-			if w*h < 120: continue
-			if y < 20: continue
-
-			boxes.append([x,y,w,h])
-
-		boxes = merge_boxes(boxes)
+		boxes, _ = find_boxes(thresh)
+		boxes = boxes.tolist()
 		resulting_boxes[frames_since_start] = boxes
 		motion_in_progress = len(boxes) > 0
 
@@ -146,9 +110,10 @@ if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="find bounding boxes for motion")
 	parser.add_argument('video_url')
 	parser.add_argument('-S', '--silent', action='store_true')
+	parser.add_argument('-s', '--scene', help='use the stored background for this scene')
 
 	args = parser.parse_args()
 
-	result = find_moving_objects(video_source=args.video_url,show_work=not args.silent)
+	result = find_moving_objects(video_source=args.video_url,show_work=not args.silent,scene_name=args.scene)
 	print(json.dumps(result, sort_keys=True))
 
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 from api import db, create_app
 
 from base64 import b64encode
@@ -41,6 +42,19 @@ class TestAPI(unittest.TestCase):
         self.assertIn('number_of_observations', response.json)
         self.assertEqual(response.json['number_of_observations'], 0)
 
+    @mock.patch('api.read_window', return_value={'task_write_image|run_seconds|2': 1.0, 'task_write_image|outcome|ok': 1.0})
+    @mock.patch('api.read_totals', return_value={'task_write_image|run_seconds|2': 3.0, 'task_write_image|outcome|ok': 3.0})
+    def test_metrics(self, *_):
+        response = self.app.get('/metrics', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('watcher_task_run_seconds_count{task="task_write_image"} 3', response.data.decode())
+        self.assertIn('watcher_task_outcomes_recent{task="task_write_image",outcome="ok"} 1', response.data.decode())
+
+        headers = self.headers.copy()
+        headers.pop('Authorization')
+        self.assertEqual(self.app.get('/metrics', headers=headers).status_code, 401)
+
     def test_get_uncategorized(self):
         response = self.app.get('/uncategorized', headers=self.headers)
         self.assertEqual(response.status_code, 200)
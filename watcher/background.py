@@ -0,0 +1,90 @@
+import os
+import time
+
+from pathlib import Path
+
+import numpy as np
+
+from .connection import application_config, application_path_for
+
+__all__ = ['SceneBackground']
+
+DEFAULT_BACKGROUND_LEARNING_RATE = 0.2
+DEFAULT_BACKGROUND_MAX_AGE_MINUTES = 60
+
+class SceneBackground(object):
+    """Background image for a scene, kept between events and updated a little after each one.
+
+    Stored as float32 under the scene's data directory, one file per frame size and pixel format,
+    so full resolution colour and downscaled luma analysis each keep their own model.
+    """
+    scene_name = None
+    pix_fmt = 'rgb24'
+    image = None
+    updated_at = None
+
+    def __init__(self, scene_name, image, pix_fmt='rgb24', updated_at=None):
+        self.scene_name = scene_name
+        self.image = np.asarray(image, dtype=np.float32)
+        self.pix_fmt = pix_fmt
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return f"<SceneBackground {self.scene_name} {self.pix_fmt} {self.image.shape}>"
+
+    @staticmethod
+    def path_for(scene_name, width, height, pix_fmt='rgb24') -> Path:
+        return application_path_for(Path(scene_name) / 'background' / f"{width}x{height}_{pix_fmt}.npy")
+
+    @property
+    def path(self) -> Path:
+        height, width = self.image.shape[0:2]
+        return self.path_for(self.scene_name, width, height, self.pix_fmt)
+
+    @property
+    def is_stale(self):
+        if self.updated_at is None:
+            return True
+        max_age = float(application_config('video', 'BACKGROUND_MAX_AGE_MINUTES') or DEFAULT_BACKGROUND_MAX_AGE_MINUTES)
+        return time.time() - self.updated_at > max_age * 60
+
+    @classmethod
+    def load(cls, scene_name, width, height, pix_fmt='rgb24'):
+        path = cls.path_for(scene_name, width, height, pix_fmt)
+        try:
+            image = np.load(path)
+            updated_at = path.stat().st_mtime
+        except (OSError, ValueError):
+            return None
+
+        return cls(scene_name, image, pix_fmt, updated_at)
+
+    def update(self, observed, observed_pixels, learning_rate=None):
+        """Exponential average of observed into the model, only where observed_pixels is set.
+
+        A stale model is replaced outright wherever there is something observed.
+        """
+        if learning_rate is None:
+            learning_rate = float(application_config('video', 'BACKGROUND_LEARNING_RATE') or DEFAULT_BACKGROUND_LEARNING_RATE)
+        if self.is_stale:
+            learning_rate = 1.0
+
+        weight = learning_rate * np.asarray(observed_pixels, dtype=np.float32)
+        if weight.ndim < self.image.ndim:
+            weight = weight[..., np.newaxis]
+
+        self.image += weight * (observed - self.image)
+        return self
+
+    def save(self):
+        path = self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # write then rename, so other workers never load a partial file
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        with open(tmp, 'wb') as f:
+            np.save(f, self.image)
+        os.replace(tmp, path)
+
+        self.updated_at = time.time()
+        return self
@@ -0,0 +1,142 @@
+import functools
+
+from datetime import datetime
+
+import sqlalchemy
+
+from rq import Queue
+from sqlalchemy import select
+
+from .connection import application_config
+from .model import IntermediateResult
+from .priority import queues_by_priority, LOW_SUFFIX
+from .dedup import event_claim_owner, release_event
+from . import setup_logging
+
+__all__ = ['Admission', 'admit_event', 'queue_depths', 'backfill_events', 'SHEDDING_STEP', 'SHEDDING_MODES']
+
+logger = setup_logging()
+
+SHEDDING_STEP = 'load_shedding'
+SHEDDING_MODES = ['coarse', 'skip_prediction', 'defer']
+
+# queued jobs, across a stage's priority tiers, at which each mode starts. 0 turns a mode off.
+DEFAULT_HIGH_WATER = {
+    'coarse': 50,
+    'skip_prediction': 200,
+    'defer': 500,
+}
+
+# which stage's backlog each mode watches, and whether it applies to every event or only low priority ones
+MODE_STAGES = {
+    'coarse': ('event_video', False),
+    'skip_prediction': ('prediction', True),
+    'defer': ('event_video', True),
+}
+
+def high_water(mode):
+    return int(application_config('system', f"HIGH_WATER_{mode.upper()}") or DEFAULT_HIGH_WATER[mode])
+
+def queue_depths(connection, stages):
+    """Jobs waiting in each stage, counting all its priority tiers."""
+    depths = {}
+    for stage in stages:
+        depths[stage] = sum(Queue(name, connection=connection).count for name in queues_by_priority(stage))
+    return depths
+
+class Admission(object):
+    """How an event is to be processed given the backlog when it came up: in full, or with some
+    of SHEDDING_MODES. Any shedding is recorded against the event, so that it can be backfilled.
+    """
+    modes = []
+    depths = None
+
+    def __init__(self, modes=None, depths=None):
+        self.modes = modes or []
+        self.depths = depths or {}
+
+    def __bool__(self):
+        return bool(self.modes)
+
+    @property
+    def coarse(self):
+        return 'coarse' in self.modes
+
+    @property
+    def skip_prediction(self):
+        return 'skip_prediction' in self.modes
+
+    @property
+    def defer(self):
+        return 'defer' in self.modes
+
+    def result(self, event):
+        return IntermediateResult(
+            computed_at = datetime.now(),
+            step = SHEDDING_STEP,
+            info = {'modes': self.modes, 'queue_depths': self.depths},
+            event = event,
+        )
+
+def admit_event(connection, low_priority):
+    """The Admission for an event, from the depths of the video and prediction queues against
+    their [system] HIGH_WATER_<MODE> marks. low_priority is only called if it matters.
+    """
+    depths = queue_depths(connection, sorted(set(stage for stage, _ in MODE_STAGES.values())))
+    low_priority = functools.cache(low_priority)
+
+    modes = []
+    for mode in SHEDDING_MODES:
+        stage, low_priority_only = MODE_STAGES[mode]
+        mark = high_water(mode)
+        if mark > 0 and depths[stage] >= mark and (not low_priority_only or low_priority()):
+            modes.append(mode)
+
+    if modes:
+        logger.info(f"backlog {depths}, shedding {modes}")
+    return Admission(modes, depths)
+
+def backfill_events(session, connection, limit=None):
+    """Queue the work that shedding left out, at low priority, returning (event name, stage) for each.
+
+    Each event is queued once, from the earliest stage it still needs, however many times it
+    was shed. Deferred events get their video analysis, which goes on to predict, unless
+    something has analysed them since. Events whose prediction was skipped get it from their
+    stored stills, unless they have been labeled since. Coarse scans are kept as they are.
+    """
+    stmt = (select(IntermediateResult)
+            .where(IntermediateResult.step == SHEDDING_STEP)
+            .order_by(IntermediateResult.computed_at)
+            .options(sqlalchemy.orm.joinedload(IntermediateResult.event)))
+
+    shed_by_event = {}
+    for shed in session.execute(stmt).unique().scalars():
+        shed_by_event.setdefault(shed.event.event_name, []).append(shed)
+
+    queued = []
+    for name, sheds in shed_by_event.items():
+        if limit and len(queued) >= limit:
+            break
+
+        event = sheds[0].event
+        stills = sorted((r for r in event.results if r.step == 'task_save_significant_frame'), key=lambda r: r.computed_at)
+        analysed_at = stills[-1].computed_at if stills else None
+
+        if any('defer' in shed.info.get('modes', []) and (analysed_at is None or analysed_at < shed.computed_at)
+               for shed in sheds):
+            # the deferring job kept its claim on the video stage
+            owner = event_claim_owner(connection, 'video', name)
+            if owner:
+                release_event(connection, 'video', name, owner)
+            Queue('event_video' + LOW_SUFFIX, connection=connection).enqueue(
+                'watcher.video.task_save_significant_frame', name)
+            queued.append((name, 'event_video'))
+
+        elif any('skip_prediction' in shed.info.get('modes', []) for shed in sheds) and stills and not event.labelings:
+            still = stills[-1]
+            Queue('prediction' + LOW_SUFFIX, connection=connection).enqueue(
+                'watcher.predict_still.task_predict_still', still.file, name,
+                crops=[c['file'] for c in still.info.get('crops', [])], ensemble=still.info.get('ensemble'))
+            queued.append((name, 'prediction'))
+
+    return queued
@@ -0,0 +1,139 @@
+import numpy as np
+import cv2 as cv
+
+__all__ = ['find_boxes', 'merge_boxes', 'crop_regions', 'MIN_BOX_AREA', 'MIN_BOX_Y']
+
+# boxes smaller than this, or starting above this row (the camera's timestamp overlay), are ignored
+MIN_BOX_AREA = 120
+MIN_BOX_Y = 20
+
+# crops are grown by this fraction of the box on each side, and never made smaller than
+# the classifier's input so small animals aren't blown up past what the camera resolved
+CROP_MARGIN = 0.25
+MIN_CROP_SIZE = 224
+
+def _touching_pairs(corners):
+    """(i, j) indices of the touching or overlapping (x0, y0, x1, y1) boxes.
+
+    Sweeps the boxes in order of x0, pairing each only with those that start before it ends,
+    so a frame of many small scattered boxes makes about as many pairs as boxes.
+    """
+    order = np.argsort(corners[:, 0], kind='stable')
+    x0, y0, x1, y1 = corners[order].T
+
+    ends = np.searchsorted(x0, x1, side='right')
+    counts = ends - np.arange(len(x0)) - 1
+    left = np.repeat(np.arange(len(x0)), counts)
+    right = left + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    touching = (y0[left] <= y1[right]) & (y0[right] <= y1[left])
+    return order[left[touching]], order[right[touching]]
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def _components(count, left, right):
+    """Group of each of count nodes joined by the left, right edges, numbered in order of each
+    group's first node, by union-find.
+    """
+    parent = list(range(count))
+    for a, b in zip(left.tolist(), right.tolist()):
+        a, b = _find(parent, a), _find(parent, b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    _, group = np.unique([_find(parent, i) for i in range(count)], return_inverse=True)
+    return group.reshape(-1)
+
+def _merge_corners(corners):
+    """Repeatedly join touching or overlapping (x0, y0, x1, y1) boxes until none touch."""
+    while len(corners) > 1:
+        group = _components(len(corners), *_touching_pairs(corners))
+        num_groups = group.max() + 1
+        if num_groups == len(corners):
+            break
+
+        merged = np.empty((num_groups, 4), corners.dtype)
+        merged[:, :2] = np.iinfo(corners.dtype).max
+        merged[:, 2:] = np.iinfo(corners.dtype).min
+        np.minimum.at(merged[:, :2], group, corners[:, :2])
+        np.maximum.at(merged[:, 2:], group, corners[:, 2:])
+        corners = merged
+
+    return corners
+
+def merge_boxes(boxes, frames=None):
+    """Merge overlapping (x, y, w, h) boxes. 
+
+    If frames is given, it holds the frame of each box in ascending order, and only boxes 
+    in the same frame are merged. Returns the merged boxes and their frames.
+    """
+    boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+    frames = np.zeros(len(boxes), np.int32) if frames is None else np.asarray(frames, np.int32)
+
+    corners = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+    frame_ids, starts = np.unique(frames, return_index=True)
+    groups = [_merge_corners(c) for c in np.split(corners, starts[1:])] if len(boxes) else []
+
+    merged = np.concatenate(groups) if groups else np.zeros((0, 4), np.int32)
+    merged[:, 2:] -= merged[:, :2]
+    return merged, np.repeat(frame_ids, [len(g) for g in groups]).astype(np.int32)
+
+def find_boxes(masks, frame_height=None, min_area=MIN_BOX_AREA, min_y=MIN_BOX_Y):
+    """Merged bounding boxes of the motion in a mask or a stack of masks.
+
+    masks is (H, W) or (N, R, W), where rows from frame_height to R are zero spacer rows, as 
+    MotionMaskEngine leaves them, so that one labelling pass covers every frame without 
+    objects joining across frames. Returns (x, y, w, h) boxes and the frame of each.
+    """
+    masks = np.asarray(masks)
+    if masks.ndim == 2:
+        masks = masks[np.newaxis]
+    num_frames, rows, width = masks.shape
+    frame_height = frame_height or rows
+
+    if num_frames > 1 and rows == frame_height:
+        masks = np.pad(masks, ((0, 0), (0, 1), (0, 0)))
+        rows += 1
+
+    # block based labelling measured about three times faster than the default on tall motion masks
+    _, _, stats, _ = cv.connectedComponentsWithStatsWithAlgorithm(np.ascontiguousarray(masks).reshape(-1, width), 
+                                                                  8, cv.CV_32S, cv.CCL_GRANA)
+    stats = stats[1:]
+
+    frames, top = np.divmod(stats[:, cv.CC_STAT_TOP], rows)
+    boxes = np.column_stack([stats[:, cv.CC_STAT_LEFT], top, stats[:, cv.CC_STAT_WIDTH], stats[:, cv.CC_STAT_HEIGHT]])
+
+    keep = (boxes[:, 2] * boxes[:, 3] >= min_area) & (top >= min_y)
+    return merge_boxes(boxes[keep], frames[keep])
+
+def crop_regions(boxes, width, height, max_crops=2, min_size=MIN_CROP_SIZE, margin=CROP_MARGIN):
+    """Square (x, y, w, h) regions of a width x height frame around the largest boxes.
+
+    Each region is centred on its box, grown by margin, at least min_size and shifted to 
+    lie inside the frame. Boxes already inside an earlier region don't get one of their own.
+    """
+    boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+    boxes = boxes[np.argsort(-boxes[:, 2] * boxes[:, 3], kind='stable')]
+
+    sizes = np.ceil(boxes[:, 2:].max(axis=1) * (1 + 2 * margin)).astype(np.int32)
+    sizes = np.clip(sizes, min(min_size, width, height), min(width, height))
+    x0 = np.clip(boxes[:, 0] + boxes[:, 2] // 2 - sizes // 2, 0, width - sizes)
+    y0 = np.clip(boxes[:, 1] + boxes[:, 3] // 2 - sizes // 2, 0, height - sizes)
+    regions = np.column_stack([x0, y0, sizes, sizes])
+
+    chosen = []
+    for box, region in zip(boxes, regions):
+        if len(chosen) >= max_crops:
+            break
+        if not any(_contains(c, box) for c in chosen):
+            chosen.append(region)
+
+    return np.array(chosen, np.int32).reshape(-1, 4)
+
+def _contains(outer, inner):
+    return (outer[0] <= inner[0] and outer[1] <= inner[1] and
+            inner[0] + inner[2] <= outer[0] + outer[2] and inner[1] + inner[3] <= outer[1] + outer[3])
@@ -15,7 +15,7 @@ def in_docker() -> bool:
     return os.path.isfile('/.dockerenv') 
 
 
-__all__ = ['TunneledConnection','application_config','redis_connection','in_docker', 'application_path_for']
+__all__ = ['TunneledConnection','application_config','application_flag','redis_connection','in_docker', 'application_path_for']
 
 def redis_connection():
     redis_host = os.environ.get('REDIS_HOST') or application_config('system','REDIS_HOST')
@@ -54,6 +54,12 @@ def application_config(section_name: str='', config_variable: str='') -> str:
 
     return cfg 
 
+def application_flag(section_name: str, config_variable: str, default: bool=False) -> bool:
+    configval = application_config(section_name, config_variable)
+    if not configval:
+        return default
+    return configval.strip().lower() in ['1', 'true', 'yes', 'on']
+
 def application_path_for(file) -> Path:
     return Path(application_config('system','LOCAL_DATA_DIR')) / file
 
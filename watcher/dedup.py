@@ -0,0 +1,95 @@
+import os
+import socket
+
+from contextlib import contextmanager
+
+from rq import get_current_job
+
+from .connection import application_config, application_flag, redis_connection
+from . import setup_logging
+
+__all__ = ['claim_event', 'release_event', 'event_claim_owner', 'claim_for_job', 'event_claim', 'record_duplicate', 'STAGES']
+
+logger = setup_logging()
+
+DEFAULT_CLAIM_TTL = 6 * 60 * 60
+KEY_PREFIX = 'claim'
+STAGES = ['video', 'prediction']
+
+# delete the claim only if it is still ours, so a late release can't drop someone else's
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def claim_key(stage, event_name):
+    return f"{KEY_PREFIX}:{stage}:{event_name}"
+
+def current_owner():
+    """The rq job running this, or this process when run by hand as with singlevideo."""
+    job = get_current_job()
+    return job.id if job else f"{socket.gethostname()}:{os.getpid()}"
+
+def claim_event(connection, stage, event_name, owner, ttl=DEFAULT_CLAIM_TTL):
+    """Claim a stage of an event for owner, true if it is now theirs.
+
+    The claim is kept for ttl seconds, so copies of the job queued meanwhile see it. The same
+    owner can claim again, as when rq retries a job under its own id.
+    """
+    key = claim_key(stage, event_name)
+    if connection.set(key, owner, nx=True, ex=ttl):
+        return True
+    return event_claim_owner(connection, stage, event_name) == owner
+
+def release_event(connection, stage, event_name, owner):
+    """Give up owner's claim, so the stage can be run again, as after it failed."""
+    return bool(connection.eval(RELEASE_SCRIPT, 1, claim_key(stage, event_name), owner))
+
+def event_claim_owner(connection, stage, event_name):
+    owner = connection.get(claim_key(stage, event_name))
+    return owner.decode() if owner else None
+
+def record_duplicate(job, stage, event_name, owner):
+    """Note on a duplicate job why it did nothing."""
+    reason = f"{stage} of {event_name} already claimed by {owner}"
+    logger.info(f"skipping duplicate: {reason}")
+    if job is not None:
+        job.meta['duplicate'] = {'stage': stage, 'event_name': event_name, 'claimed_by': owner}
+        job.save_meta()
+    return reason
+
+def claim_for_job(connection, stage, event_name, owner, job=None):
+    """claim_event with the configured expiry, recording the reason on job if it lost.
+    Always true when [system] DEDUP is off.
+    """
+    if not application_flag('system', 'DEDUP', default=True):
+        return True
+
+    ttl = int(application_config('system', 'CLAIM_TTL') or DEFAULT_CLAIM_TTL)
+    if claim_event(connection, stage, event_name, owner, ttl):
+        return True
+
+    record_duplicate(job, stage, event_name, event_claim_owner(connection, stage, event_name))
+    return False
+
+@contextmanager
+def event_claim(stage, event_name):
+    """Yield whether the running job, or this process, won the stage of the event.
+
+    The claim is released if the body raises, so a retry or a later run can have it, and
+    otherwise kept until it expires.
+    """
+    connection = redis_connection()
+    owner = current_owner()
+
+    if not claim_for_job(connection, stage, event_name, owner, get_current_job()):
+        yield False
+        return
+
+    try:
+        yield True
+    except BaseException:
+        release_event(connection, stage, event_name, owner)
+        raise
@@ -0,0 +1,39 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from .still_model import RESIZE
+from . import setup_logging
+
+__all__ = ['put_frames', 'get_frames', 'handoff_image']
+
+logger = setup_logging()
+
+DEFAULT_HANDOFF_TTL = 600
+KEY_PREFIX = 'frame_handoff'
+
+def handoff_image(img, size=RESIZE):
+    """img scaled down so its short side is the classifier's first resize, as nothing finer is used."""
+    scale = size / min(img.size)
+    if scale >= 1:
+        return img
+    return img.resize((round(img.width * scale), round(img.height * scale)), Image.BILINEAR)
+
+def put_frames(connection, event_name, images, ttl=DEFAULT_HANDOFF_TTL):
+    """Store images for the predictor as raw arrays that expire after ttl seconds, returning their keys."""
+    keys = [f"{KEY_PREFIX}:{event_name}:{i}" for i in range(len(images))]
+    with connection.pipeline(transaction=False) as pipe:
+        for key, img in zip(keys, images):
+            buf = io.BytesIO()
+            np.save(buf, np.asarray(handoff_image(img)), allow_pickle=False)
+            pipe.set(key, buf.getvalue(), ex=ttl)
+        pipe.execute()
+    return keys
+
+def get_frames(connection, keys):
+    """The images stored under keys, or None if any has expired."""
+    blobs = connection.mget(keys) if keys else []
+    if any(b is None for b in blobs):
+        return None
+    return [Image.fromarray(np.load(io.BytesIO(b), allow_pickle=False)) for b in blobs]
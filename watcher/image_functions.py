@@ -1,26 +1,29 @@
+import io
 import os
+import base64
+import heapq
 
 import ffmpeg
 import numpy as np
 import cv2 as cv
 
-__all__ = ['motion_from_initial_average', 'rescale', 'threshold_video', 'apply_mask', 'fetch_video_from_file']
+from .probe import probe_video
+from .bounding_box import find_boxes, MIN_BOX_AREA, MIN_BOX_Y
+from .tracking import Tracker
 
-def fetch_video_from_file(video_file):
-    info = None
-    try:
-        info = ffmpeg.probe(video_file)
-    except Exception as e:
-        print(dir(e))
-        print(f"STDERR: {e.stderr}")
-        print(f"STDOUT: {e.stdout}")
+__all__ = ['motion_from_initial_average', 'rescale', 'threshold_video', 'apply_mask', 'fetch_video_from_file',
+           'stream_video_from_file', 'fetch_frame_from_file', 'fetch_frames_from_file', 'read_frame_chunks', 'motion_scores', 'MotionMaskEngine', 'MotionScan',
+           'top_peaks', 'encode_scores', 'decode_scores']
 
-        raise e
+PIXEL_FORMAT_CHANNELS = {
+    'rgb24': 3,
+    'bgr24': 3,
+    'gray': 1,
+}
 
-    video_info = next(stream for stream in info['streams'] if stream['codec_type'] == 'video')
-    width = int(video_info['width'])
-    height = int (video_info['height'])
-    num_frames = int(video_info['nb_frames'])
+def fetch_video_from_file(video_file, info=None):
+    info = info or probe_video(video_file)
+    width, height = info.width, info.height
 
     out, err = (
         ffmpeg
@@ -36,6 +39,99 @@ def fetch_video_from_file(video_file):
 
     return video
 
+def read_frame_chunks(stream, width, height, channels=3, chunk_size=50):
+    """Yield arrays of up to chunk_size frames read from a rawvideo byte stream."""
+    frame_bytes = width * height * channels
+    shape = [height, width, channels] if channels > 1 else [height, width]
+
+    while True:
+        buf = stream.read(frame_bytes * chunk_size)
+        num_frames = len(buf) // frame_bytes if buf else 0
+        if num_frames == 0:
+            return
+
+        yield (
+            np
+            .frombuffer(buf, np.uint8, count=num_frames * frame_bytes)
+            .reshape([num_frames] + shape)
+        )
+
+def stream_video_from_file(video_file, width, height, chunk_size=50, pix_fmt='rgb24', filters=None,
+                           start=None, frames=None, step=1):
+    """Decode video_file with ffmpeg, yielding chunks of frames instead of holding the whole clip.
+
+    Memory use is bounded by chunk_size rather than by the length of the clip. width and height
+    are the size of the decoded frames, so they must match any scaling done by filters.
+    start (seconds) and frames limit decoding to a window of the clip. With step, only every
+    step-th frame is converted and returned; frames then counts returned frames.
+    """
+    input_args = {}
+    if start:
+        input_args['ss'] = start
+
+    filters = list(filters or [])
+    output_args = {}
+    if step > 1:
+        filters.insert(0, f"select=not(mod(n\\,{step}))")
+        output_args['vsync'] = 'passthrough'
+    if filters:
+        output_args['vf'] = ','.join(filters)
+    if frames:
+        output_args['vframes'] = frames
+
+    process = (
+        ffmpeg
+        .input(video_file, **input_args)
+        .output('pipe:', format='rawvideo', pix_fmt=pix_fmt, **output_args)
+        .global_args('-hide_banner', '-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+
+    finished = False
+    try:
+        yield from read_frame_chunks(process.stdout, width, height, PIXEL_FORMAT_CHANNELS[pix_fmt], chunk_size)
+        finished = True
+    finally:
+        process.stdout.close()
+        if not finished:
+            process.kill()
+        if process.wait() != 0 and finished:
+            raise ffmpeg.Error('ffmpeg', None, b'')
+
+def fetch_frame_from_file(video_file, index, width, height, pix_fmt='rgb24'):
+    """Decode the single frame at index, without converting or piping any of the others."""
+    out, err = (
+        ffmpeg
+        .input(video_file)
+        .output('pipe:', format='rawvideo', pix_fmt=pix_fmt, vf=f"select=eq(n\\,{index})", vframes=1)
+        .run(capture_stdout=True, quiet=True)
+    )
+
+    frames = list(read_frame_chunks(io.BytesIO(out), width, height, PIXEL_FORMAT_CHANNELS[pix_fmt], 1))
+    if not frames:
+        raise IndexError(f"frame {index} not found in {video_file}")
+
+    return frames[0][0]
+
+def fetch_frames_from_file(video_file, indices, width, height, pix_fmt='rgb24'):
+    """Decode the frames at indices in one pass of ffmpeg, returned in the order of indices."""
+    wanted = sorted(set(int(i) for i in indices))
+    select = '+'.join(f"eq(n\\,{i})" for i in wanted)
+    out, err = (
+        ffmpeg
+        .input(video_file)
+        .output('pipe:', format='rawvideo', pix_fmt=pix_fmt, vf=f"select={select}", vsync='passthrough',
+                vframes=len(wanted))
+        .run(capture_stdout=True, quiet=True)
+    )
+
+    chunks = list(read_frame_chunks(io.BytesIO(out), width, height, PIXEL_FORMAT_CHANNELS[pix_fmt], len(wanted)))
+    frames = np.concatenate(chunks) if chunks else []
+    if len(frames) < len(wanted):
+        raise IndexError(f"only {len(frames)} of frames {wanted} found in {video_file}")
+
+    found = dict(zip(wanted, frames))
+    return np.stack([found[int(i)] for i in indices])
 
 def motion_from_initial_average(video, window_size=5):
     working = (video[window_size:,:,:,:])
@@ -59,9 +155,303 @@ def threshold_video(grey_frames, kern = np.ones((7,7), np.uint8)):
         
     return thresh
 
+class MotionMaskEngine(object):
+    """Batched equivalent of rescale() followed by threshold_video().
+
+    Frames of a chunk are stacked into one tall image, separated by spacer rows at least
+    as tall as the kernel, so a single cv.threshold/dilate/erode call covers the whole
+    chunk while giving the same result as closing each frame on its own. Buffers are
+    allocated once and reused for every chunk of the same frame size.
+    """
+    kern = None
+    level = 128
+
+    def __init__(self, kern=np.ones((7,7), np.uint8), level=128):
+        self.kern = kern
+        self.level = level
+        self.spacer = kern.shape[0]
+
+        self._capacity = 0
+        self._frame_shape = None
+        self._stacked = None
+        self._dilated = None
+        self.masks = None
+
+    def _buffers(self, num_frames, height, width):
+        if num_frames > self._capacity or self._frame_shape != (height, width):
+            self._capacity = max(num_frames, self._capacity if self._frame_shape == (height, width) else 0)
+            self._frame_shape = (height, width)
+            self._stacked = np.zeros((self._capacity, height + self.spacer, width), np.uint8)
+            self._dilated = np.empty_like(self._stacked)
+
+        return self._stacked[:num_frames], self._dilated[:num_frames]
+
+    def cutoff(self, lo, hi):
+        """Smallest distance that rescale() would map above level, or inf if nothing would.
+
+        rescale() is monotonic, so comparing distances against this one value gives exactly
+        the same pixels as rescaling and thresholding, without touching every pixel three times.
+        """
+        lo, hi = np.float32(lo), np.float32(hi)
+        span = hi - lo
+        if not span > 0:
+            return np.float32(np.inf)
+
+        def above(x):
+            return np.uint8((x - lo) / span * np.float32(255)) > self.level
+
+        if not above(hi):
+            return np.float32(np.inf)
+
+        x = np.float32(lo + span * np.float32((self.level + 1) / 255))
+        while x > lo and above(np.nextafter(x, lo)):
+            x = np.nextafter(x, lo)
+        while not above(x):
+            x = np.nextafter(x, hi)
+        return x
+
+    def mask(self, norms):
+        """Threshold and close a (N,H,W) stack of float distances, as threshold_video(rescale(norms)) would."""
+        (num_frames, height, width) = norms.shape
+        stacked, dilated = self._buffers(num_frames, height, width)
+        if num_frames == 0:
+            return stacked[:, :height]
+
+        lo, hi, _, _ = cv.minMaxLoc(norms.reshape(-1, width))
+
+        frames = stacked[:, :height]
+        np.greater_equal(norms, self.cutoff(lo, hi), out=frames.view(np.bool_))
+
+        flat = stacked.reshape(-1, width)
+        cv.threshold(flat, 0, 255, cv.THRESH_BINARY, dst=flat)
+        cv.dilate(flat, self.kern, dst=dilated.reshape(-1, width))
+
+        dilated[:, height:] = 255
+        cv.erode(dilated.reshape(-1, width), self.kern, dst=flat)
+        stacked[:, height:] = 0
+
+        self.masks = frames
+        return frames
+
+    def stacked(self, num_frames):
+        """The last masks with their spacer rows, as (N, H + spacer, W)."""
+        return self._stacked[:num_frames]
+
+    def sums(self, num_frames):
+        """Per-frame sums of the last mask, spacer rows included since they are always zero."""
+        rows = self._stacked[:num_frames].reshape(num_frames, -1)
+        return cv.reduce(rows, 1, cv.REDUCE_SUM, dtype=cv.CV_64F).ravel()
+
+def motion_scores(frames, background, engine=None):
+    """Sum of the thresholded difference from background, one value per frame.
+
+    frames are either colour (N,H,W,C) or single channel (N,H,W).
+    """
+    if engine is None:
+        engine = MotionMaskEngine()
+
+    L1_dist = np.subtract(frames, background, dtype=np.float32)
+    np.abs(L1_dist, out=L1_dist)
+    norms = np.linalg.norm(L1_dist, axis=-1) if L1_dist.ndim == 4 else L1_dist
+
+    engine.mask(norms)
+
+    return engine.sums(len(norms))
+
+class MotionScan(object):
+    """Scores chunks of frames as they arrive, keeping only the most significant frame seen so far.
+
+    If no background is given, the mean of the first window_size frames is used. 
+    start_index is the position of the first scanned frame within the whole clip.
+
+    With collect_quiet, the pixels outside the motion mask of the quietest frame in each chunk
+    are summed, so a background model can be updated from them afterwards (see quiet_image).
+
+    With box_scale, bounding boxes of the motion in every frame are found too, multiplied by 
+    box_scale so they are in full resolution pixels when the frames were downscaled. Those of
+    the keep_boxes highest scoring frames are kept, or of every frame if it is None. With
+    track, the boxes are fed to a Tracker as each chunk is scanned.
+    """
+    background = None
+    window_size = 5
+    start_index = 0
+
+    num_frames = 0
+    best_index = None
+    best_score = -1
+    best_frame = None
+
+    quiet_sum = None
+    quiet_count = None
+
+    box_scale = None
+    keep_boxes = None
+    tracker = None
+
+    def __init__(self, background=None, window_size=5, start_index=0, collect_quiet=False, box_scale=None,
+                 keep_boxes=None, track=False):
+        self.background = background
+        self.window_size = window_size
+        self.start_index = start_index
+        self.collect_quiet = collect_quiet
+        self.box_scale = box_scale
+        self.keep_boxes = keep_boxes
+        self.tracker = Tracker() if track else None
+        self.engine = MotionMaskEngine()
+        self.timeline = []
+        # boxes by frame, and a heap of the (score, -frame) of the kept frames, lowest first
+        self.boxes = {}
+        self.kept = []
+
+    def update(self, chunk):
+        if self.background is None:
+            self.background = np.mean(chunk[0:self.window_size], axis=0, dtype=np.float32)
+
+        scores = motion_scores(chunk, self.background, self.engine)
+
+        i = int(np.argmax(scores))
+        if scores[i] > self.best_score:
+            self.best_score = scores[i]
+            self.best_index = self.start_index + self.num_frames + i
+            self.best_frame = chunk[i].copy()
+
+        # fraction of the frame in motion, comparable between frame sizes
+        self.timeline.append(scores / (255 * np.prod(self.engine.masks.shape[1:])))
+
+        if self.collect_quiet:
+            q = int(np.argmin(scores))
+            self.add_quiet(chunk[q], self.engine.masks[q] == 0)
+
+        if self.box_scale:
+            self.add_boxes(self.timeline[-1])
+
+        self.num_frames += len(chunk)
+        return scores
+
+    @property
+    def frame_scores(self):
+        """Motion area of every scanned frame, in order."""
+        return np.concatenate(self.timeline) if self.timeline else np.zeros(0, np.float32)
+
+    def add_boxes(self, scores):
+        scale = self.box_scale
+        first = self.start_index + self.num_frames
+        boxes, frames = find_boxes(self.engine.stacked(len(scores)), self.engine.masks.shape[1],
+                                   min_area=MIN_BOX_AREA / scale**2, min_y=MIN_BOX_Y / scale)
+        boxes, frames = boxes * scale, frames + first
+
+        if self.tracker is not None:
+            self.tracker.track(boxes, frames)
+
+        # ranked as top_peaks ranks frames, by score and then earliest first
+        for i, score in enumerate(scores.tolist()):
+            key = (score, -(first + i))
+            if self.keep_boxes is None:
+                pass
+            elif len(self.kept) < self.keep_boxes:
+                heapq.heappush(self.kept, key)
+            elif key > self.kept[0]:
+                _, dropped = heapq.heapreplace(self.kept, key)
+                self.boxes.pop(-dropped, None)
+            else:
+                continue
+
+            in_frame = frames == first + i
+            if in_frame.any():
+                self.boxes[first + i] = boxes[in_frame]
+
+    @property
+    def motion_boxes(self):
+        """(x, y, w, h) boxes of motion in the kept frames, and the frame index of each, in frame order."""
+        if not self.boxes:
+            return np.zeros((0, 4), np.int32), np.zeros(0, np.int32)
+        order = sorted(self.boxes)
+        return (np.concatenate([self.boxes[f] for f in order]),
+                np.repeat(order, [len(self.boxes[f]) for f in order]).astype(np.int32))
+
+    def boxes_in_frame(self, index):
+        boxes, frames = self.motion_boxes
+        return boxes[frames == index]
+
+    def add_quiet(self, frame, still_pixels):
+        if self.quiet_sum is None:
+            self.quiet_sum = np.zeros(frame.shape, np.float32)
+            self.quiet_count = np.zeros(still_pixels.shape, np.uint32)
+
+        self.quiet_sum += frame * (still_pixels[..., np.newaxis] if frame.ndim > still_pixels.ndim else still_pixels)
+        self.quiet_count += still_pixels
+
+    def quiet_image(self):
+        """Mean of the collected quiet pixels, and which pixels were seen at all."""
+        if self.quiet_sum is None:
+            return None, None
+
+        seen = self.quiet_count > 0
+        count = np.maximum(self.quiet_count, 1)
+        if self.quiet_sum.ndim > count.ndim:
+            count = count[..., np.newaxis]
+        return self.quiet_sum / count, seen
+
+    def scan(self, chunks):
+        for chunk in chunks:
+            self.update(chunk)
+        return self
+
+    @classmethod
+    def merge(cls, scans):
+        """Combine scans of consecutive segments of one clip, in order."""
+        merged = cls()
+        trackers = []
+        for scan in scans:
+            if merged.background is None:
+                merged.background = scan.background
+                merged.keep_boxes = scan.keep_boxes
+            if scan.quiet_sum is not None and merged.quiet_sum is None:
+                merged.quiet_sum = scan.quiet_sum.copy()
+                merged.quiet_count = scan.quiet_count.copy()
+            elif scan.quiet_sum is not None:
+                merged.quiet_sum += scan.quiet_sum
+                merged.quiet_count += scan.quiet_count
+            if scan.best_score > merged.best_score:
+                merged.best_score = scan.best_score
+                merged.best_index = scan.best_index
+                merged.best_frame = scan.best_frame
+            merged.num_frames += scan.num_frames
+            merged.timeline += scan.timeline
+            merged.boxes.update(scan.boxes)
+            merged.kept += scan.kept
+            if scan.tracker is not None:
+                trackers.append(scan.tracker)
+
+        if merged.keep_boxes is not None and len(merged.kept) > merged.keep_boxes:
+            merged.kept = heapq.nlargest(merged.keep_boxes, merged.kept)
+            kept_frames = set(-frame for _, frame in merged.kept)
+            merged.boxes = {f: b for f, b in merged.boxes.items() if f in kept_frames}
+        heapq.heapify(merged.kept)
+        if trackers:
+            merged.tracker = Tracker.merge(trackers)
+        return merged
+
+def top_peaks(scores, k=3, min_separation=15):
+    """Indices of up to k highest scores, each at least min_separation from the others."""
+    peaks = []
+    for i in np.argsort(-np.asarray(scores), kind='stable'):
+        if len(peaks) >= k or scores[i] <= 0:
+            break
+        if all(abs(int(i) - p) >= min_separation for p in peaks):
+            peaks.append(int(i))
+    return peaks
+
+def encode_scores(scores):
+    """Compact text form of a score timeline, as little-endian float16, for JSON payloads."""
+    return base64.b64encode(np.asarray(scores, dtype='<f2').tobytes()).decode('ascii')
+
+def decode_scores(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype='<f2').astype(np.float32)
+
 def apply_mask(color_vid, mask_vid):    
     masked = np.zeros_like(color_vid)
     for i in range(3):
         masked[:,:,:,i] = color_vid[:,:,:,i] * (mask_vid/255)
         
-    return masked
\ No newline at end of file
+    return masked
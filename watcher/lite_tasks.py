@@ -12,6 +12,7 @@ from rq import Worker
 
 from .connection import application_config, TunneledConnection, redis_connection
 from .model import *
+from .metrics import instrumented, set_outcome, count_bytes
 from . import setup_logging
 
 
@@ -22,6 +23,7 @@ connection = TunneledConnection()
 
 logger = setup_logging()
 
+@instrumented('task_write_image')
 def task_write_image(img, img_relpath):
     basedir = Path(application_config('system','LOCAL_DATA_DIR'))
     fullpath = basedir / img_relpath
@@ -29,15 +31,20 @@ def task_write_image(img, img_relpath):
     fullpath.parent.mkdir(parents=True, exist_ok=True)
 
     img.save(str(fullpath), quality=85)
+    count_bytes(fullpath.stat().st_size)
     logger.info(f"wrote {fullpath}")
 
+@instrumented('task_record_event')
 def task_record_event(event_class, input_json_str):
     global connection
 
+    count_bytes(len(input_json_str))
+
     allowed_classes = ['EventObservation', 'Computation']
 
     if event_class not in allowed_classes:
         logger.warning(f"unknown event_class {event_class}. ignoring.")
+        set_outcome('ignored')
         return
 
     input_dict = json.loads(input_json_str)
@@ -46,6 +53,7 @@ def task_record_event(event_class, input_json_str):
     filetype = input_dict.get('filetype')
     if filetype and int(filetype) != 8:
         logger.warning(f"video files must be mp4 and not debug ({input_dict.get('video_fullpath')}). ignoring.")
+        set_outcome('ignored')
         return
 
     eventClass = globals()[event_class]
@@ -65,6 +73,7 @@ def task_record_event(event_class, input_json_str):
 
         except sqlalchemy.exc.IntegrityError as ie:
             session.rollback()
+            set_outcome('duplicate')
 
             logger.warning(f"ignoring duplicate database entry: {ie._message} ({ie._sql_message}) - {ie.statement} {ie.params}")
             
@@ -0,0 +1,311 @@
+import json
+import time
+import queue
+import threading
+
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import cv2 as cv
+from rq import Queue, Retry
+
+from .connection import application_config, redis_connection
+from .bounding_box import find_boxes, MIN_BOX_AREA, MIN_BOX_Y
+from . import setup_logging
+
+__all__ = ['FrameRing', 'BackgroundRing', 'LiveMotionEngine', 'run_live_camera']
+
+logger = setup_logging()
+
+DEFAULT_FRAME_RATE = 15
+DEFAULT_DOWNSCALE = 4
+DEFAULT_DIFF_LEVEL = 128
+DEFAULT_BACKGROUND_FRAMES = 6
+DEFAULT_BACKGROUND_INTERVAL = 5
+DEFAULT_BACKGROUND_MAX_AGE = 45
+DEFAULT_MIN_MOTION_FRAMES = 3
+DEFAULT_PRE_CAPTURE = 10
+DEFAULT_EVENT_GAP = 5
+DEFAULT_MAX_QUEUED_FRAMES = 30
+DEFAULT_STATS_INTERVAL = 60
+RECONNECT_SECONDS = 5
+
+def live_config(key):
+    """[live] key, or '' when the config has no [live] section, so the DEFAULT_ values apply."""
+    try:
+        return application_config('live', key)
+    except KeyError:
+        return ''
+
+class FrameRing(object):
+    """The last `capacity` frames, in one preallocated array."""
+    def __init__(self, capacity, shape, dtype=np.uint8):
+        self.frames = np.zeros((capacity,) + tuple(shape), dtype)
+        self.capacity = capacity
+        self.count = 0
+        self.next = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, frame):
+        """Store frame over the oldest one, returning the slot it went into."""
+        slot = self.next
+        self.frames[slot] = frame
+        self.next = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return slot
+
+    def ordered(self):
+        """The stored frames, oldest first."""
+        start = (self.next - self.count) % self.capacity
+        for i in range(self.count):
+            yield self.frames[(start + i) % self.capacity]
+
+    def clear(self):
+        self.count = 0
+
+class BackgroundRing(FrameRing):
+    """Mean of the last few background samples, kept up to date by adding the newest sample
+    and taking away the one it replaces, rather than averaging the whole ring each time.
+    """
+    def __init__(self, capacity, shape):
+        super().__init__(capacity, shape, np.uint8)
+        self.total = np.zeros(tuple(shape), np.int32)
+        self.image = None
+        self.updated_at = None
+
+    def push(self, frame, at=None):
+        if self.count == self.capacity:
+            self.total -= self.frames[self.next]
+        slot = super().push(frame)
+        self.total += self.frames[slot]
+
+        self.image = (self.total // self.count).astype(np.uint8)
+        self.updated_at = time.time() if at is None else at
+        return slot
+
+class LiveMotionEngine(object):
+    """Watches a camera stream for motion without a display, writing a clip of each event.
+
+    Frames are read on a separate thread into a short queue. If analysis falls behind, the
+    oldest queued frames are dropped and counted rather than letting latency grow. Each frame
+    is compared in grey, downscaled, against a background kept in a BackgroundRing. When motion
+    starts, the event is queued for record_event, as motion's on_movie_start does, and when it
+    ends, the finished clip is queued for event_video.
+    """
+    source = None
+    scene_name = None
+
+    def __init__(self, source, scene_name):
+        self.source = source
+        self.scene_name = scene_name
+
+        self.frame_rate = float(live_config('FRAME_RATE') or DEFAULT_FRAME_RATE)
+        self.downscale = int(live_config('DOWNSCALE') or DEFAULT_DOWNSCALE)
+        self.diff_level = int(live_config('DIFF_LEVEL') or DEFAULT_DIFF_LEVEL)
+        self.background_frames = int(live_config('BACKGROUND_FRAMES') or DEFAULT_BACKGROUND_FRAMES)
+        self.background_interval = int(live_config('BACKGROUND_INTERVAL') or DEFAULT_BACKGROUND_INTERVAL)
+        self.background_max_age = float(live_config('BACKGROUND_MAX_AGE') or DEFAULT_BACKGROUND_MAX_AGE)
+        self.min_motion_frames = int(live_config('MIN_MOTION_FRAMES') or DEFAULT_MIN_MOTION_FRAMES)
+        self.pre_capture = int(live_config('PRE_CAPTURE') or DEFAULT_PRE_CAPTURE)
+        self.event_gap = float(live_config('EVENT_GAP') or DEFAULT_EVENT_GAP)
+        self.max_queued_frames = int(live_config('MAX_QUEUED_FRAMES') or DEFAULT_MAX_QUEUED_FRAMES)
+        self.stats_interval = float(live_config('STATS_INTERVAL') or DEFAULT_STATS_INTERVAL)
+
+        self.kern = np.ones((3, 3), np.uint8)
+        self.frames = queue.Queue(maxsize=self.max_queued_frames)
+        self.stopped = threading.Event()
+
+        self.background = None
+        self.recent = None
+        self.frame_count = 0
+        self.motion_frames = 0
+        self.last_motion_at = None
+
+        self.event_name = None
+        self.event_count = 0
+        self.writer = None
+
+        # read and dropped are counted on the reader thread and reset by report()
+        self.counts_lock = threading.Lock()
+        self.frames_read = 0
+        self.frames_analysed = 0
+        self.frames_dropped = 0
+        self.stats_at = time.time()
+
+    def read_frames(self):
+        cap = None
+        while not self.stopped.is_set():
+            if cap is None or not cap.isOpened():
+                cap = cv.VideoCapture(self.source)
+                if not cap.isOpened():
+                    logger.warning(f"could not open {self.source}, retrying in {RECONNECT_SECONDS}s")
+                    self.stopped.wait(RECONNECT_SECONDS)
+                    continue
+
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                # the camera may keep accepting connections without sending frames
+                logger.warning(f"no frame from {self.source}, reconnecting in {RECONNECT_SECONDS}s")
+                cap.release()
+                self.stopped.wait(RECONNECT_SECONDS)
+                continue
+
+            dropped = 0
+            try:
+                self.frames.put_nowait((time.time(), frame))
+            except queue.Full:
+                self.frames.get_nowait()
+                dropped = 1
+                self.frames.put_nowait((time.time(), frame))
+
+            with self.counts_lock:
+                self.frames_read += 1
+                self.frames_dropped += dropped
+
+        if cap is not None:
+            cap.release()
+
+    def analysis_image(self, frame):
+        height, width = frame.shape[0:2]
+        small = cv.resize(frame, (width // self.downscale, height // self.downscale), interpolation=cv.INTER_AREA)
+        return cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+
+    def detect(self, gray):
+        """Boxes of motion in a grey analysis image, in full resolution pixels."""
+        diff = cv.absdiff(gray, self.background.image)
+        closed = cv.morphologyEx(diff, cv.MORPH_CLOSE, self.kern)
+        _, mask = cv.threshold(closed, self.diff_level, 255, cv.THRESH_BINARY)
+
+        boxes, _ = find_boxes(mask, min_area=MIN_BOX_AREA / self.downscale**2, min_y=MIN_BOX_Y / self.downscale)
+        return boxes * self.downscale
+
+    def update_background(self, gray, in_motion, timestamp):
+        if (len(self.background) < self.background_frames
+                or timestamp - self.background.updated_at > self.background_max_age
+                or (not in_motion and self.frame_count % self.background_interval == 0)):
+            self.background.push(gray, timestamp)
+
+    def process(self, frame, timestamp):
+        """Analyse one frame, starting, extending or ending the current event."""
+        gray = self.analysis_image(frame)
+        if self.background is None:
+            self.background = BackgroundRing(self.background_frames, gray.shape)
+            self.recent = FrameRing(max(self.pre_capture, 1), frame.shape)
+
+        self.frame_count += 1
+        self.frames_analysed += 1
+        boxes = self.detect(gray) if len(self.background) >= self.background_frames else []
+        in_motion = len(boxes) > 0
+        self.update_background(gray, in_motion or self.event_name is not None, timestamp)
+
+        self.motion_frames = self.motion_frames + 1 if in_motion else 0
+        if in_motion:
+            self.last_motion_at = timestamp
+
+        if self.event_name is None and self.motion_frames >= self.min_motion_frames:
+            self.start_event(frame, timestamp)
+        elif self.event_name is not None:
+            self.writer.write(frame)
+            if timestamp - self.last_motion_at > self.event_gap:
+                self.end_event()
+
+        if self.event_name is None:
+            self.recent.push(frame)
+
+        return boxes
+
+    def clip_path(self, event_name, capture_time):
+        # laid out as motion's movie_filename %$/%Y/%m/%d/%C
+        return Path(self.scene_name) / capture_time.strftime('%Y/%m/%d') / f"{event_name}.mp4"
+
+    def open_clip(self, path, frame_size):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return cv.VideoWriter(str(path), cv.VideoWriter_fourcc(*'mp4v'), self.frame_rate, frame_size)
+
+    def start_event(self, frame, timestamp):
+        capture_time = datetime.fromtimestamp(timestamp)
+        self.event_count += 1
+        self.event_name = f"{capture_time.strftime('%Y%m%d_%H%M%S')}_{self.scene_name}_{self.event_count}"
+
+        data_dir = application_config('system', 'LOCAL_DATA_DIR')
+        self.clip_file = Path(data_dir) / self.clip_path(self.event_name, capture_time)
+
+        height, width = frame.shape[0:2]
+        self.writer = self.open_clip(self.clip_file, (width, height))
+        for earlier in self.recent.ordered():
+            self.writer.write(earlier)
+        self.writer.write(frame)
+        self.recent.clear()
+
+        logger.info(f"motion started: {self.event_name}")
+        self.publish_event_start({
+            'video_fullpath': str(self.clip_file),
+            'video_root': data_dir,
+            'capture_time': capture_time.isoformat(timespec='seconds'),
+            'scene_name': self.scene_name,
+            'filetype': 8,
+            'event_name': self.event_name,
+        })
+
+    def end_event(self):
+        self.writer.release()
+        self.writer = None
+
+        logger.info(f"motion ended: {self.event_name}")
+        self.publish_event_end(self.event_name)
+        self.event_name = None
+
+    def publish_event_start(self, event):
+        Queue('record_event', connection=redis_connection()).enqueue(
+            'watcher.lite_tasks.task_record_event', 'EventObservation', json.dumps(event),
+            retry=Retry(max=3, interval=5))
+
+    def publish_event_end(self, event_name):
+        Queue('event_video', connection=redis_connection()).enqueue(
+            'watcher.video.task_save_significant_frame', event_name,
+            retry=Retry(max=3, interval=10))
+
+    def report(self):
+        now = time.time()
+        if now - self.stats_at < self.stats_interval:
+            return
+
+        with self.counts_lock:
+            read, dropped = self.frames_read, self.frames_dropped
+            self.frames_read = self.frames_dropped = 0
+
+        elapsed = now - self.stats_at
+        logger.info(f"{self.scene_name}: read {read / elapsed:.1f} fps, "
+                    f"analysed {self.frames_analysed}, dropped {dropped} frames")
+        self.frames_analysed = 0
+        self.stats_at = now
+
+    def run(self):
+        reader = threading.Thread(target=self.read_frames, daemon=True)
+        reader.start()
+        logger.info(f"watching {self.scene_name} at {self.source}")
+
+        try:
+            while not self.stopped.is_set():
+                try:
+                    timestamp, frame = self.frames.get(timeout=1)
+                except queue.Empty:
+                    continue
+                self.process(frame, timestamp)
+                self.report()
+        finally:
+            self.stopped.set()
+            if self.event_name is not None:
+                self.end_event()
+            reader.join(timeout=RECONNECT_SECONDS)
+
+def run_live_camera(source=None, scene_name=None):
+    source = source or live_config('URL')
+    scene_name = scene_name or live_config('SCENE')
+    if not source or not scene_name:
+        raise ValueError("a camera URL and scene name are needed, from the command line or [live] URL and SCENE")
+
+    LiveMotionEngine(source, scene_name).run()
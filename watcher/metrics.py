@@ -0,0 +1,286 @@
+import time
+import bisect
+import functools
+import itertools
+import threading
+
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+import redis
+from rq import get_current_job
+
+from .connection import application_config, application_flag, redis_connection
+from . import setup_logging
+
+__all__ = ['instrumented', 'set_outcome', 'count_bytes', 'count_decode', 'decoding', 'timed_decode', 'measuring',
+           'TaskMetrics', 'record_metrics', 'read_totals', 'read_window', 'prometheus_text']
+
+logger = setup_logging()
+
+KEY_PREFIX = 'metrics'
+TOTAL_KEY = f"{KEY_PREFIX}:total"
+SLOT_SECONDS = 60
+DEFAULT_WINDOW = 60 * 60
+
+SECONDS_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900]
+BYTES_BUCKETS = [1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9]
+
+# histogram name: (bucket bounds, help)
+HISTOGRAMS = {
+    'queue_wait_seconds': (SECONDS_BUCKETS, "Time from enqueue until a worker started the job"),
+    'run_seconds': (SECONDS_BUCKETS, "Time the task ran, whatever its outcome"),
+    'decode_seconds': (SECONDS_BUCKETS, "Time the task spent decoding video frames or images"),
+    'bytes': (BYTES_BUCKETS, "Bytes of video, images or json the task took in or wrote"),
+}
+
+_local = threading.local()
+_outermost = None
+
+def current():
+    """The metrics of the task running in this thread, or of the process's task, for the
+    threads it starts, as for scanning video segments in parallel.
+    """
+    return getattr(_local, 'metrics', None) or _outermost
+
+class TaskMetrics(object):
+    """What one run of a task took, kept in memory and written to Redis in one pipeline at its end."""
+    task = None
+    outcome = 'ok'
+    queue_wait = None
+    run = None
+    decode = 0.0
+    bytes = 0
+
+    def __init__(self, task, job=None):
+        self.task = task
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        if job is not None and job.enqueued_at:
+            # workers that start jobs themselves, like the batch predictor, don't set started_at
+            started_at = job.started_at or datetime.now(timezone.utc)
+            if job.enqueued_at.tzinfo is None:
+                started_at = started_at.replace(tzinfo=None)
+            self.queue_wait = max((started_at - job.enqueued_at).total_seconds(), 0.0)
+
+    def add_decode(self, seconds):
+        with self.lock:
+            self.decode += seconds
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes += int(count)
+
+    def finish(self, outcome=None):
+        self.run = time.perf_counter() - self.started
+        if outcome:
+            self.outcome = outcome
+        return self
+
+    def observations(self):
+        """(histogram, value) pairs, leaving out what this run didn't have."""
+        observed = [('run_seconds', self.run)]
+        if self.queue_wait is not None:
+            observed.append(('queue_wait_seconds', self.queue_wait))
+        if self.decode:
+            observed.append(('decode_seconds', self.decode))
+        if self.bytes:
+            observed.append(('bytes', self.bytes))
+        return observed
+
+def slot_key(at):
+    return f"{KEY_PREFIX}:{int(at // SLOT_SECONDS) * SLOT_SECONDS}"
+
+def window_seconds():
+    return int(application_config('system', 'METRICS_WINDOW') or DEFAULT_WINDOW)
+
+def record_metrics(connection, metrics, at=None):
+    """Add finished TaskMetrics to the running totals, and to the current minute's hash, which
+    expires once it falls out of the window. Each observation only counts its own bucket,
+    prometheus_text adds them up.
+    """
+    at = time.time() if at is None else at
+    key = slot_key(at)
+
+    pipe = connection.pipeline(transaction=False)
+    for m in metrics:
+        fields = [(f"{m.task}|outcome|{m.outcome}", 1)]
+        for name, value in m.observations():
+            bounds, _ = HISTOGRAMS[name]
+            fields += [(f"{m.task}|{name}|{bisect.bisect_left(bounds, value)}", 1), (f"{m.task}|{name}|sum", float(value))]
+
+        for target in [TOTAL_KEY, key]:
+            for field, value in fields:
+                if isinstance(value, int):
+                    pipe.hincrby(target, field, value)
+                else:
+                    pipe.hincrbyfloat(target, field, value)
+    pipe.expire(key, window_seconds() + SLOT_SECONDS)
+    pipe.execute()
+
+def read_totals(connection):
+    """Everything recorded since the totals were started, as {field: total}."""
+    return {field.decode(): float(value) for field, value in connection.hgetall(TOTAL_KEY).items()}
+
+def instrumented(task):
+    """Decorate a task to record its queue wait, run time, decode time, bytes and outcome.
+
+    The outcome is 'ok', or 'error' if it raised, unless the task sets another with set_outcome.
+    Metrics are best effort and never fail the task. [system] METRICS turns them off.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global _outermost
+
+            if not application_flag('system', 'METRICS', default=True):
+                return func(*args, **kwargs)
+
+            # a task called from another in the same thread shares its job, but didn't wait for it
+            m = TaskMetrics(task, get_current_job() if current() is None else None)
+            outermost = _outermost is None
+            if outermost:
+                _outermost = m
+
+            outcome = None
+            try:
+                with measuring(m):
+                    return func(*args, **kwargs)
+            except BaseException:
+                outcome = 'error'
+                raise
+            finally:
+                if outermost:
+                    _outermost = None
+                try:
+                    record_metrics(redis_connection(), [m.finish(outcome)])
+                except redis.exceptions.RedisError as e:
+                    logger.warning(f"could not record metrics for {task}: {e}")
+        return wrapper
+    return decorate
+
+@contextmanager
+def measuring(metrics):
+    """Count what happens in the body against metrics, for work on several jobs in one thread."""
+    previous = getattr(_local, 'metrics', None)
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _local.metrics = previous
+
+def set_outcome(outcome):
+    """Record why the running task stopped early, as 'duplicate' or 'deferred'."""
+    m = current()
+    if m is not None:
+        m.outcome = outcome
+
+def count_bytes(count):
+    m = current()
+    if m is not None:
+        m.add_bytes(count)
+
+def count_decode(seconds):
+    m = current()
+    if m is not None:
+        m.add_decode(seconds)
+
+@contextmanager
+def decoding():
+    """Count the time in the body as the running task's decode time."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        count_decode(time.perf_counter() - start)
+
+def timed_decode(chunks):
+    """chunks, counting the time spent producing each as decode time."""
+    it = iter(chunks)
+    while True:
+        with decoding():
+            chunk = next(it, None)
+        if chunk is None:
+            return
+        yield chunk
+
+def read_window(connection, window=None, at=None):
+    """Everything recorded over the last window seconds, as {field: total}."""
+    window = window or window_seconds()
+    at = time.time() if at is None else at
+    first = int((at - window) // SLOT_SECONDS) + 1
+
+    pipe = connection.pipeline(transaction=False)
+    for slot in range(first, int(at // SLOT_SECONDS) + 1):
+        pipe.hgetall(slot_key(slot * SLOT_SECONDS))
+
+    totals = {}
+    for fields in pipe.execute():
+        for field, value in fields.items():
+            field = field.decode()
+            totals[field] = totals.get(field, 0) + float(value)
+    return totals
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def format_bound(bound):
+    return format_value(bound) if bound != float('inf') else '+Inf'
+
+def cumulative_counts(fields, task, name, bounds):
+    """Observations at or below each of bounds, and in all, as Prometheus buckets count them."""
+    return list(itertools.accumulate(fields.get(f"{task}|{name}|{i}", 0) for i in range(len(bounds) + 1)))
+
+def prometheus_text(totals, recent=None, window=None):
+    """totals from read_totals, and recent from read_window, in the Prometheus text format.
+
+    The totals only ever grow, so they are histograms and counters for rate() and
+    histogram_quantile(). The rolling window, for a look without a Prometheus server, is given
+    as gauges named _recent, as it goes down when old minutes expire.
+    """
+    recent = recent or {}
+    window = window or window_seconds()
+    lines = []
+
+    def tasks(fields, name):
+        return sorted(set(f.split('|')[0] for f in fields if f.split('|')[1] == name))
+
+    for name, (bounds, description) in HISTOGRAMS.items():
+        metric = f"watcher_task_{name}"
+        lines.append(f"# HELP {metric} {description}.")
+        lines.append(f"# TYPE {metric} histogram")
+        for task in tasks(totals, name):
+            counts = cumulative_counts(totals, task, name, bounds)
+            for bound, count in zip(bounds + [float('inf')], counts):
+                lines.append(f'{metric}_bucket{{task="{task}",le="{format_bound(bound)}"}} {format_value(count)}')
+            lines.append(f'{metric}_sum{{task="{task}"}} {format_value(totals.get(f"{task}|{name}|sum", 0))}')
+            lines.append(f'{metric}_count{{task="{task}"}} {format_value(counts[-1])}')
+
+    metric = "watcher_task_outcomes_total"
+    lines.append(f"# HELP {metric} Runs of each task by how they ended.")
+    lines.append(f"# TYPE {metric} counter")
+    for field in sorted(f for f in totals if f.split('|')[1] == 'outcome'):
+        task, _, outcome = field.split('|')
+        lines.append(f'{metric}{{task="{task}",outcome="{outcome}"}} {format_value(totals[field])}')
+
+    for name, (bounds, description) in HISTOGRAMS.items():
+        metric = f"watcher_task_{name}_recent"
+        lines.append(f"# HELP {metric} {description}: runs at or below le over the last {window}s.")
+        lines.append(f"# TYPE {metric} gauge")
+        for task in tasks(recent, name):
+            for bound, count in zip(bounds + [float('inf')], cumulative_counts(recent, task, name, bounds)):
+                lines.append(f'{metric}{{task="{task}",le="{format_bound(bound)}"}} {format_value(count)}')
+
+        lines.append(f"# HELP {metric}_sum {description}: total over the last {window}s.")
+        lines.append(f"# TYPE {metric}_sum gauge")
+        for task in tasks(recent, name):
+            lines.append(f'{metric}_sum{{task="{task}"}} {format_value(recent.get(f"{task}|{name}|sum", 0))}')
+
+    metric = "watcher_task_outcomes_recent"
+    lines.append(f"# HELP {metric} Runs of each task by how they ended, over the last {window}s.")
+    lines.append(f"# TYPE {metric} gauge")
+    for field in sorted(f for f in recent if f.split('|')[1] == 'outcome'):
+        task, _, outcome = field.split('|')
+        lines.append(f'{metric}{{task="{task}",outcome="{outcome}"}} {format_value(recent[field])}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,66 @@
+import numpy as np
+
+__all__ = ['noise_features', 'noise_confidence', 'NOISE_LABEL', 'NOISE_DECIDER']
+
+NOISE_LABEL = 'noise'
+NOISE_DECIDER = 'heuristic_noise'
+
+# how much each piece of evidence alone says the event is noise, when it is at full strength.
+# Each stays well below video's NOISE_CONFIDENCE, so no one feature can call an event noise: a
+# close-up animal changes much of the frame, and one walking steadily or sitting still looks
+# persistent or stationary.
+EVIDENCE_WEIGHTS = {
+    'no_motion': 0.8,          # nothing survived thresholding anywhere in the clip
+    'global_change': 0.5,      # a large part of the frame changed at once, as when lights switch
+    'persistent': 0.5,         # motion at the same level all through the clip, as with rain
+    'scattered': 0.6,          # many small boxes spread over the frame, as with leaves
+    'stationary': 0.5,         # nothing moved anywhere, small things only flickered in place
+    'sensor_noise': 0.3,       # motion's own noise estimate is high
+}
+
+MOTION_NOISE_LEVEL = 32
+
+def _ramp(value, low, high):
+    return float(np.clip((value - low) / (high - low), 0, 1))
+
+def noise_features(frame_scores, boxes, frame_size, tracks=None, noise_level=None):
+    """Evidence that an event is noise, each from 0 to 1, from what the video scan already found.
+
+    frame_scores is the motion area timeline, boxes the motion boxes of the chosen frame,
+    frame_size its (width, height), and tracks as made by Tracker.
+    """
+    scores = np.asarray(frame_scores, dtype=np.float32)
+    peak = float(scores.max()) if len(scores) else 0.0
+    width, height = frame_size
+    diagonal = np.hypot(width, height)
+
+    features = {
+        'no_motion': 1.0 if peak <= 0 else 0.0,
+        'global_change': _ramp(peak, 0.2, 0.5),
+        'persistent': _ramp(float(np.median(scores)) / peak, 0.3, 0.8) if peak > 0 and len(scores) >= 10 else 0.0,
+        'scattered': 0.0,
+        'stationary': 0.0,
+        'sensor_noise': _ramp(noise_level, MOTION_NOISE_LEVEL, 2 * MOTION_NOISE_LEVEL) if noise_level else 0.0,
+    }
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) >= 4:
+        hull = (boxes[:, 0] + boxes[:, 2]).max() - boxes[:, 0].min(), (boxes[:, 1] + boxes[:, 3]).max() - boxes[:, 1].min()
+        fill = (boxes[:, 2] * boxes[:, 3]).sum() / max(hull[0] * hull[1], 1)
+        features['scattered'] = _ramp(len(boxes), 3, 8) * (1 - _ramp(fill, 0.1, 0.4))
+
+    if tracks is not None and peak > 0:
+        # furthest any tracked object got from where it was first seen, and the largest one,
+        # since an animal sitting close to the camera is still but fills much of the frame
+        travel = [np.hypot(*(np.asarray(t['path'])[:, 1:] - t['path'][0][1:]).T).max() for t in tracks]
+        largest = max((t.get('peak_area', 0) for t in tracks), default=0) / (width * height)
+        features['stationary'] = (1 - _ramp(max(travel, default=0) / diagonal, 0.02, 0.1)) * (1 - _ramp(largest, 0.05, 0.2))
+
+    return features
+
+def noise_confidence(features):
+    """Confidence that an event is noise, combining the evidence as independent causes."""
+    not_noise = 1.0
+    for name, strength in features.items():
+        not_noise *= 1 - EVIDENCE_WEIGHTS.get(name, 0) * strength
+    return 1 - not_noise
@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy
+
+from .connection import TunneledConnection, application_config, application_flag
+from .video import analyse_event, queue_event_stages
+from .lite_tasks import task_write_image
+from .dedup import event_claim
+from .backpressure import Admission
+from .predict_still import lazy_load_model, predict_ensembles, ensemble_result, DEFAULT_ENSEMBLE_COMBINE
+from . import setup_logging
+
+__all__ = ['task_process_event', 'preload_model', 'prediction_groups']
+
+logger = setup_logging()
+
+def preload_model():
+    """Load the still model in the worker before it forks for jobs, so each job starts warm."""
+    try:
+        _, name = lazy_load_model()
+        logger.info(f"loaded {name} for the fused pipeline")
+    except (ImportError, OSError) as e:
+        logger.warning(f"could not load the still model, events will go through the queues: {e}")
+
+def prediction_groups(found, use_crops=True):
+    """One group of images for each frame of the event, as task_predict_still would classify them."""
+    def group(img, crops):
+        return [crop for _, crop, _ in crops] if use_crops and crops else [img]
+
+    return [group(found.img, found.crops)] + [group(other_img, other_crops) for _, _, other_img, other_crops in found.ensemble]
+
+def predict_event(session, found):
+    """Add the labeling of the event's frames to session, unless a prediction job already has the event."""
+    with event_claim('prediction', found.name) as claimed:
+        if not claimed:
+            return
+
+        combine = application_config('prediction', 'ENSEMBLE_COMBINE') or DEFAULT_ENSEMBLE_COMBINE
+        groups = prediction_groups(found, application_flag('prediction', 'USE_CROPS', default=True))
+        [(lbl, frame_probs)] = predict_ensembles([groups], combine)
+        logger.info(f"{found.name} is {lbl}")
+
+        lbl.event = found.vid.event
+        session.add(lbl)
+        if found.ensemble:
+            ir = ensemble_result(found.img_relpath, found.result['ensemble'], combine, frame_probs)
+            ir.event = found.vid.event
+            session.add(ir)
+
+def task_process_event(name, admission=None):
+    """Video analysis, still writes, prediction and their records for one event, in this process.
+
+    The stills are written on a thread while the model runs, and everything the event produces
+    goes into the database in one transaction. Where the model can't be loaded, as on a host
+    without the predictor's packages or model file, the event goes through the queues instead.
+    """
+    try:
+        lazy_load_model()
+    except (ImportError, OSError) as e:
+        logger.warning(f"can't predict on this host ({e}), queueing {name} for the other workers")
+        return queue_event_stages(name, admission)
+
+    with TunneledConnection() as tc:
+        session = sqlalchemy.orm.Session(tc)
+
+        admission = admission or Admission()
+        found = analyse_event(session, name, search='coarse' if admission.coarse else None)
+        session.add(found.intermediate_result())
+        if admission:
+            session.add(admission.result(found.vid.event))
+
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            writes = [writer.submit(task_write_image, image, str(relpath)) for relpath, image in found.images()]
+
+            if found.is_noise:
+                logger.info(f"{name} looks like noise ({found.noise:.2f}), skipping prediction")
+                session.add(found.noise_labeling())
+            elif admission.skip_prediction:
+                logger.info(f"skipping prediction of {name} until the backfill")
+            else:
+                predict_event(session, found)
+
+            # only record the event once its stills are on disk
+            for write in writes:
+                write.result()
+
+        try:
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            session.rollback()
+            logger.warning(f"ignoring duplicate results for {name}")
@@ -1,77 +1,502 @@
+import os
+import gc
+import time
+import signal
+
 from pathlib import Path
 from datetime import datetime
 
+import numpy as np
+import redis
 import sqlalchemy
-from rq import Worker
-
-from fastai.vision.learner import load_learner
+from rq import Worker, SimpleWorker, get_current_job
+from rq.executions import Execution
+from rq.worker import WorkerStatus
 
-from .connection import TunneledConnection, application_config, redis_connection, application_path_for 
-from.model import EventObservation, EventClassification, Labeling
+from .connection import TunneledConnection, application_config, application_flag, redis_connection, application_path_for 
+from.model import EventObservation, EventClassification, Labeling, IntermediateResult
+from .still_model import load_still_model, quantized_file, read_vocab
+from .prediction_cache import cached_probabilities
+from .frame_handoff import get_frames
+from .dedup import event_claim, claim_for_job
+from .priority import queues_by_priority
+from .metrics import instrumented, set_outcome, count_bytes, count_decode, decoding, measuring, TaskMetrics
 
 from . import setup_logging
 
-__all__ = ['task_predict_still']
+__all__ = ['task_predict_still', 'still_model_vocab', 'BatchPredictionWorker', 'PredictorPool']
 
 logger = setup_logging()
 model = None
-model_name = None
 
-def lazy_load_model():
+# labelings made ahead by a BatchPredictionWorker, by job id, for the jobs of its current batch
+batched = {}
+
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_BATCH_WAIT_MS = 200
+PREDICT_TASK = 'task_predict_still'
+PREDICT_FUNC = 'watcher.predict_still.task_predict_still'
+DEFAULT_WORKERS = 1
+RESPAWN_SECONDS = 5
+DEFAULT_ENSEMBLE_COMBINE = 'max'
+ENSEMBLE_COMBINE_METHODS = ['max', 'mean']
+DEFAULT_BACKEND = 'fastai'
+
+def onnx_model_file():
+    onnx_file = application_config('prediction', 'ONNX_MODEL_FILE')
+    if onnx_file:
+        return Path(__file__).parent.parent / onnx_file
+    return (Path(__file__).parent.parent / application_config('prediction','STILL_MODEL_FILE')).with_suffix('.onnx')
+
+def still_model_file(backend):
+    if backend == 'onnx':
+        # dynamic or static, for the int8 copy made by quantize_onnx
+        quantization = application_config('prediction', 'QUANTIZATION')
+        return quantized_file(onnx_model_file(), quantization) if quantization else onnx_model_file()
+    return Path(__file__).parent.parent / application_config('prediction','STILL_MODEL_FILE')
+
+def still_model_vocab():
+    """The still model's labels, from the sidecar of its ONNX export, for workers that don't load it."""
+    return read_vocab(onnx_model_file())
+
+def lazy_load_model(threads=None):
     global model
 
     if model:
-        return model, model_name
+        return model, model.name
 
-    model_file = Path(__file__).parent.parent / application_config('prediction','STILL_MODEL_FILE')
-    model = load_learner(model_file)
-    model_name = model_file.name
-    return model, model_name
+    # the fastai backend needs torch and fastai, the onnx one only onnxruntime
+    backend = application_config('prediction', 'BACKEND') or DEFAULT_BACKEND
+    # unset, onnxruntime gets one thread and torch keeps its default of every core
+    threads = threads or int(application_config('prediction', 'BACKEND_THREADS') or 0) or None
+    model = load_still_model(still_model_file(backend), backend, threads)
+    return model, model.name
 
 def predict_labeling(img_file: str):
-    model, decider = lazy_load_model()
+    return predict_batch([[img_file]])[0]
 
-    labels, mask, probs = model.predict(img_file)
-    
+def labeling_from_probabilities(model, decider, probs):
+    mask = probs > model.thresh
     return Labeling(
-        labels = labels.items,
+        labels = [label for label, m in zip(model.vocab, mask.tolist()) if m],
         decider = decider,
         decided_at = datetime.now(),
         mask = mask.tolist(),
         probabilities = probs.tolist(),
-        # vocabulary = model.dls.vocab
     )
 
-def task_predict_still(img_file, event_name):
-    img_file = application_path_for(img_file)
-    logger.debug(f"predicting {img_file} for {event_name}")
+def group_probabilities(file_groups):
+    """The model, its name, and the probabilities of each group of images from a single batched pass.
+
+    Within a group, such as the crops of one frame, each label takes its highest probability.
+    Images the model has already seen, by content, reuse their cached probabilities.
+    """
+    model, decider = lazy_load_model()
+
+    files = [f for group in file_groups for f in group]
+    probs = cached_probabilities(model, files)
+
+    grouped = []
+    start = 0
+    for group in file_groups:
+        grouped.append(probs[start:start + len(group)].max(axis=0))
+        start += len(group)
+    return model, decider, np.array(grouped)
+
+def predict_batch(file_groups):
+    """One labeling per group of image files, from a single batched pass through the model."""
+    model, decider, probs = group_probabilities(file_groups)
+    return [labeling_from_probabilities(model, decider, p) for p in probs]
+
+def predict_ensembles(ensembles, combine=DEFAULT_ENSEMBLE_COMBINE):
+    """One labeling per ensemble, a list of image groups with one for each of an event's frames,
+    combining the frames by the max or mean of each label. All the images of all the ensembles
+    go through the model as one batch. Returns (labeling, probabilities of each frame) pairs.
+    """
+    if combine not in ENSEMBLE_COMBINE_METHODS:
+        raise ValueError(f"unknown ensemble combine {combine}, expected one of {ENSEMBLE_COMBINE_METHODS}")
+
+    model, decider, probs = group_probabilities([group for ensemble in ensembles for group in ensemble])
 
+    results = []
+    start = 0
+    for ensemble in ensembles:
+        frame_probs = probs[start:start + len(ensemble)]
+        start += len(ensemble)
+        combined = frame_probs.max(axis=0) if combine == 'max' else frame_probs.mean(axis=0)
+        results.append((labeling_from_probabilities(model, decider, combined), frame_probs))
+    return results
+
+def predict_crops_labeling(crop_files):
+    """One labeling for several crops of a frame, each label taking its highest probability among them."""
+    return predict_batch([crop_files])[0]
+
+def prediction_inputs(img_file, crops=None, frames=None):
+    """The images to classify for a task_predict_still job: its crops if it has any, otherwise the frame.
+
+    frames are the handoff keys of the frame and its crops, read from Redis while they last so
+    prediction need not wait for the JPEGs to be written. Otherwise the files are used.
+    """
+    use_crops = application_flag('prediction', 'USE_CROPS', default=True)
+
+    if frames:
+        with decoding():
+            images = get_frames(redis_connection(), frames[1:] if use_crops and len(frames) > 1 else frames[0:1])
+        if images is not None:
+            count_bytes(sum(img.width * img.height * len(img.getbands()) for img in images))
+            return images
+        logger.info(f"handoff of {img_file} has expired, reading it from disk")
+
+    img_file = application_path_for(img_file)
     if not img_file.exists():
         raise FileNotFoundError(f"file {img_file} does not exist")
 
-    try:
-        # prediction, probability = predict_from_still(img_file)
-        lbl = predict_labeling(img_file)
-        logger.info(f"{event_name} is {lbl}")
+    crop_files = [application_path_for(c) for c in crops or []]
+    if not use_crops:
+        crop_files = []
+
+    files = crop_files or [img_file]
+    count_bytes(sum(f.stat().st_size for f in files if f.exists()))
+    return files
+
+def ensemble_inputs(img_file, crops=None, frames=None, ensemble=None):
+    """One group of images for each frame to classify, the chosen frame first and then the
+    other frames of the ensemble, as the video task describes them.
+    """
+    groups = [prediction_inputs(img_file, crops, frames)]
+    for member in ensemble or []:
+        groups.append(prediction_inputs(member['file'], member.get('crops'), member.get('frames')))
+    return groups
+
+def ensemble_result(img_file, ensemble, combine, frame_probs):
+    """What each frame of an ensemble contributed to its labeling."""
+    frames = [{'file': str(img_file)}] + [{'frame': m['frame'], 'file': m['file']} for m in ensemble]
+    return IntermediateResult(
+        step = 'task_predict_still',
+        file = str(img_file),
+        info = {
+            'combine': combine,
+            'frames': [dict(f, probabilities=[round(float(x), 4) for x in p]) for f, p in zip(frames, frame_probs)],
+        },
+    )
+
+def copy_labeling(lbl):
+    return Labeling(labels=lbl.labels, decider=lbl.decider, decided_at=lbl.decided_at, mask=lbl.mask, probabilities=lbl.probabilities)
+
+def add_labeling(session, event_name, img_file, lbl, ensemble, combine, frame_probs):
+    """Add the labeling of an event, and what each frame of its ensemble contributed, to session."""
+    event = EventObservation.by_name(session, event_name)
+    lbl.event = event
+    session.add(lbl)
+    if ensemble:
+        ir = ensemble_result(img_file, ensemble, combine, frame_probs)
+        ir.event = event
+        session.add(ir)
+
+    logger.debug(f"event id: {event.id}")
+
+def batched_prediction():
+    """What a BatchPredictionWorker made ahead for the running job, if anything."""
+    job = get_current_job()
+    found = batched.pop(job.id, None) if job is not None else None
+    if found is None:
+        return None
+
+    count_bytes(found['bytes'])
+    count_decode(found['decode'])
+    return found
+
+@instrumented(PREDICT_TASK)
+def task_predict_still(img_file, event_name, crops=None, frames=None, ensemble=None):
+    with event_claim('prediction', event_name) as claimed:
+        if not claimed:
+            set_outcome('duplicate')
+            return
 
-        with TunneledConnection() as tc:
-            session = sqlalchemy.orm.Session(tc)
+        logger.debug(f"predicting {img_file} for {event_name}")
+        combine = application_config('prediction', 'ENSEMBLE_COMBINE') or DEFAULT_ENSEMBLE_COMBINE
+        prepared = batched_prediction()
+        job = get_current_job()
+        if job is not None and job.meta.get('stored_with_batch'):
+            logger.info(f"{event_name} was labeled with its batch")
+            return
+        if prepared is None:
+            groups = ensemble_inputs(img_file, crops, frames, ensemble)
 
-            event = EventObservation.by_name(session, event_name)
-            lbl.event = event
-            session.add(lbl)
+        try:
+            # prediction, probability = predict_from_still(img_file)
+            if prepared:
+                lbl, frame_probs = prepared['labeling'], prepared['frame_probs']
+            else:
+                [(lbl, frame_probs)] = predict_ensembles([groups], combine)
+            logger.info(f"{event_name} is {lbl}")
 
-            logger.debug(f"event id: {event.id}")
+            with TunneledConnection() as tc:
+                session = sqlalchemy.orm.Session(tc)
+                add_labeling(session, event_name, img_file, lbl, ensemble, combine, frame_probs)
+                session.commit()
+        except sqlalchemy.exc.IntegrityError as ie:
+            logger.warning(f"ignoring duplicate prediction for {event_name}")
+            set_outcome('duplicate')
+        except Exception as e: 
+            logger.exception(f"error predicting {img_file}: {e}")
+            raise e
 
-            session.commit()
-    except sqlalchemy.exc.IntegrityError as ie:
-        logger.warning(f"ignoring duplicate prediction for {event_name}")
-    except Exception as e: 
-        logger.exception(f"error predicting {img_file}: {e}")
-        raise e
+class BatchPredictionWorker(SimpleWorker):
+    """An rq worker that, on taking a prediction job, takes up to batch_size - 1 more, waiting at
+    most wait_ms for them, classifies the images of all of them in one pass through the model
+    and stores their labelings in one transaction.
 
-def run_prediction_queue(queues = ['prediction']):
+    Each job is then run by rq as any other, with its status, registries, retries and dependents
+    kept by rq, and task_predict_still finds its labeling already made. The jobs taken ahead are
+    started, and in the StartedJobRegistry, while they wait their turn, so a worker that dies
+    leaves them to be failed as abandoned, and one that stops puts them back on their queue.
+    If the pass or the transaction fails, or a job's images can't be read, the jobs predict or
+    store on their own and fail or retry one by one.
+    """
+    batch_size = DEFAULT_BATCH_SIZE
+    wait_ms = DEFAULT_BATCH_WAIT_MS
+
+    def __init__(self, queues, *args, batch_size=DEFAULT_BATCH_SIZE, wait_ms=DEFAULT_BATCH_WAIT_MS, **kwargs):
+        super().__init__(queues, *args, **kwargs)
+        self.batch_size = batch_size
+        self.wait_ms = wait_ms
+        # executions of the jobs taken ahead, by job id, until rq runs them
+        self.held = {}
+
+    def hold(self, job):
+        """Start job's execution as rq does, for the time it can wait behind the rest of the batch."""
+        with self.connection.pipeline() as pipeline:
+            ttl = self.get_heartbeat_ttl(job) * self.batch_size
+            self.held[job.id] = Execution.create(job, ttl, pipeline=pipeline, worker_name=self.name)
+            job.prepare_for_execution(self.name, pipeline=pipeline)
+            pipeline.execute()
+
+    def prepare_execution(self, job):
+        execution = self.held.pop(job.id, None)
+        if execution is None:
+            return super().prepare_execution(job)
+
+        self.execution = execution
+        self.set_state(WorkerStatus.BUSY)
+        return execution
+
+    def release(self, batch):
+        """Put the jobs still held back at the front of their queues."""
+        for job, queue in reversed(batch):
+            execution = self.held.pop(job.id, None)
+            if execution is None:
+                continue
+            with self.connection.pipeline() as pipeline:
+                execution.delete(job=job, pipeline=pipeline)
+                pipeline.execute()
+            queue.enqueue_job(job, at_front=True)
+            logger.info(f"put {job.id} back on {queue.name}")
+
+    def collect(self, job, queue):
+        """job and whatever else arrives until the batch is full or wait_ms passes, all held."""
+        self.hold(job)
+        batch = [(job, queue)]
+        deadline = time.monotonic() + self.wait_ms / 1000
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue_class.dequeue_any(self._ordered_queues, None, connection=self.connection,
+                                                    job_class=self.job_class, serializer=self.serializer)
+            except redis.exceptions.RedisError as e:
+                logger.warning(f"stopped filling the batch: {e}")
+                break
+
+            if item is not None:
+                batch.append(item)
+                try:
+                    self.hold(item[0])
+                except redis.exceptions.RedisError as e:
+                    # it still runs, and starts as any job when its turn comes
+                    logger.warning(f"stopped filling the batch: {e}")
+                    break
+            elif time.monotonic() < deadline:
+                time.sleep(min(0.02, self.wait_ms / 1000))
+            else:
+                break
+        return batch
+
+    def predict_ahead(self, batch):
+        """Label the batch's prediction jobs in one pass, leaving the results in `batched` by job id."""
+        jobs = []
+        for job, _ in batch:
+            if job.func_name != PREDICT_FUNC or job.meta.get('stored_with_batch'):
+                continue
+            # claimed for the job as task_predict_still would, which then finds the claim its own
+            img_file, event_name = job.args[0:2]
+            if not claim_for_job(self.connection, 'prediction', event_name, job.id, job):
+                continue
+
+            m = TaskMetrics(PREDICT_TASK)
+            try:
+                with measuring(m):
+                    groups = ensemble_inputs(img_file, job.kwargs.get('crops'), job.kwargs.get('frames'), job.kwargs.get('ensemble'))
+            except Exception as e:
+                logger.warning(f"leaving {job.id} out of the batch: {e!r}")
+                continue
+            jobs.append((job, groups, m))
+
+        if not jobs:
+            return
+
+        # decoding in the one pass through the model is shared evenly by its jobs
+        shared = TaskMetrics(PREDICT_TASK)
+        combine = application_config('prediction', 'ENSEMBLE_COMBINE') or DEFAULT_ENSEMBLE_COMBINE
+        with measuring(shared):
+            predicted = predict_ensembles([groups for _, groups, _ in jobs], combine)
+
+        labeled = [(job, lbl, frame_probs) for (job, _, _), (lbl, frame_probs) in zip(jobs, predicted)]
+        stored = self.store(labeled, combine)
+        for (job, lbl, frame_probs), (_, _, m) in zip(labeled, jobs):
+            batched[job.id] = {
+                'labeling': lbl,
+                'frame_probs': frame_probs,
+                'bytes': m.bytes,
+                'decode': m.decode + shared.decode / len(jobs),
+            }
+        logger.info(f"predicted {len(jobs)} events in one batch, stored {len(stored)}")
+
+    def store(self, labeled, combine):
+        """Write the labelings of the batch in one transaction, returning the ids of the jobs stored.
+
+        Jobs whose event can't be found are left to fail on their own. If the transaction fails,
+        none are stored and each job writes its own. The stored are marked in their meta, so they
+        don't store again if they are run again, as after the worker stopped.
+        """
+        stored = set()
+        try:
+            with TunneledConnection() as tc, sqlalchemy.orm.Session(tc) as session:
+                for job, lbl, frame_probs in labeled:
+                    img_file, event_name = job.args[0:2]
+                    if EventObservation.by_name(session, event_name) is None:
+                        continue
+                    # a copy, so the job can still store its labeling if the transaction fails
+                    add_labeling(session, event_name, img_file, copy_labeling(lbl), job.kwargs.get('ensemble'), combine, frame_probs)
+                    stored.add(job.id)
+                session.commit()
+        except Exception as e:
+            logger.warning(f"could not store the batch in one transaction, storing its jobs one by one: {e!r}")
+            return set()
+
+        for job, _, _ in labeled:
+            if job.id in stored:
+                job.meta['stored_with_batch'] = True
+                job.save_meta()
+        return stored
+
+    def execute_job(self, job, queue):
+        batch = self.collect(job, queue)
+        try:
+            try:
+                self.predict_ahead(batch)
+            except Exception:
+                logger.exception(f"batch of {len(batch)} failed, predicting its jobs one at a time")
+
+            # on a warm stop, the job rq gave the worker is finished and the rest put back
+            for batch_job, batch_queue in batch:
+                if self._stop_requested and batch_job is not job:
+                    logger.info("stopping, putting the rest of the batch back")
+                    break
+                super().execute_job(batch_job, batch_queue)
+        finally:
+            self.release(batch)
+            batched.clear()
+
+class PredictorPool(object):
+    """Loads the model once, then forks `workers` children that each take prediction jobs.
+
+    The children share the parent's copy of the weights, copy-on-write, and predict in their
+    own process rather than forking a work-horse per job. The parent's objects are moved out of
+    the garbage collector's reach before forking, so collections in the children don't write to
+    their pages and copy them. A child that exits is replaced, unless the pool is in burst mode,
+    where the children quit once the queues are empty.
+    """
+    workers = DEFAULT_WORKERS
+    burst = False
+
+    def __init__(self, queues, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, wait_ms=DEFAULT_BATCH_WAIT_MS, burst=False):
+        self.queues = queues
+        self.workers = workers
+        self.batch_size = batch_size
+        self.wait_ms = wait_ms
+        self.burst = burst
+        self.children = set()
+        self.stopping = False
+
+    def child(self):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        # a connection of its own, never one made before the fork
+        connection = redis_connection()
+        if self.batch_size > 1:
+            worker = BatchPredictionWorker(self.queues, connection=connection, batch_size=self.batch_size, wait_ms=self.wait_ms)
+        else:
+            worker = SimpleWorker(self.queues, connection=connection)
+        worker.work(burst=self.burst, with_scheduler=not self.burst)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self.child()
+            except BaseException:
+                logger.exception(f"predictor {os.getpid()} failed")
+                status = 1
+            finally:
+                os._exit(status)
+
+        self.children.add(pid)
+        logger.info(f"started predictor {pid}")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGTERM)
+
+    def run(self):
+        # the thread pools of onnxruntime and torch don't survive a fork, so each child predicts
+        # on its own thread and the pool's parallelism comes from the number of children
+        _, name = lazy_load_model(threads=1)
+        logger.info(f"loaded {name}, forking {self.workers} predictors")
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self.children.discard(pid)
+
+            if not self.stopping and not self.burst:
+                logger.warning(f"predictor {pid} exited with status {os.waitstatus_to_exitcode(status)}, replacing it")
+                time.sleep(RESPAWN_SECONDS)
+                self.spawn()
+
+def run_prediction_queue(queues = None):
+    queues = queues or queues_by_priority('prediction')
     logger.info("running predictions with model " + application_config('prediction','STILL_MODEL_FILE'))
 
+    batch_size = int(application_config('prediction', 'BATCH_SIZE') or DEFAULT_BATCH_SIZE)
+    wait_ms = int(application_config('prediction', 'BATCH_WAIT_MS') or DEFAULT_BATCH_WAIT_MS)
+    workers = int(application_config('prediction', 'WORKERS') or DEFAULT_WORKERS)
+    if workers > 1:
+        PredictorPool(queues, workers, batch_size, wait_ms).run()
+        return
+
+    if batch_size > 1:
+        BatchPredictionWorker(queues, connection=redis_connection(), batch_size=batch_size, wait_ms=wait_ms).work(with_scheduler=True)
+        return
+
     worker = Worker(queues, connection=redis_connection())
     worker.work(with_scheduler=True)
@@ -0,0 +1,163 @@
+import time
+import hashlib
+
+import numpy as np
+import redis
+from PIL import Image
+
+from .connection import application_config, redis_connection
+from . import setup_logging
+
+__all__ = ['PredictionCache', 'content_digest', 'cache_name', 'prediction_cache', 'cached_probabilities']
+
+logger = setup_logging()
+
+DEFAULT_CACHE_SIZE = 10000
+KEY_PREFIX = 'prediction_cache'
+# the cache name in use for each model file name, so the one a new model replaces can be cleared
+CURRENT_KEY = f"{KEY_PREFIX}:current"
+
+# cache names this process has made current
+_current = set()
+
+def content_digest(img_file):
+    """sha256 of the image file's bytes, so a still re-written with the same content still matches.
+    An image handed over in memory is hashed by its pixels.
+    """
+    h = hashlib.sha256()
+    if isinstance(img_file, Image.Image):
+        h.update(f"{img_file.mode}{img_file.size}".encode())
+        h.update(img_file.tobytes())
+        return h.hexdigest()
+
+    with open(img_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class PredictionCache(object):
+    """Model probabilities for images already seen, in Redis, per model and bounded in size.
+
+    Each entry is its own key holding the float32 probabilities. A sorted set of digests by
+    last use gives the least recently used entries to evict once there are more than max_entries.
+    Hits and misses are counted in a hash, for stats().
+    """
+    model_name = None
+    max_entries = DEFAULT_CACHE_SIZE
+
+    def __init__(self, connection, model_name, max_entries=DEFAULT_CACHE_SIZE):
+        self.connection = connection
+        self.model_name = model_name
+        self.max_entries = max_entries
+
+    def key(self, digest):
+        return f"{KEY_PREFIX}:{self.model_name}:{digest}"
+
+    @property
+    def lru_key(self):
+        return f"{KEY_PREFIX}:{self.model_name}:lru"
+
+    @property
+    def stats_key(self):
+        return f"{KEY_PREFIX}:{self.model_name}:stats"
+
+    def get_many(self, digests):
+        """{digest: probabilities} for those of digests that are cached, marking them as just used."""
+        digests = list(dict.fromkeys(digests))
+        if not digests:
+            return {}
+
+        values = self.connection.mget([self.key(d) for d in digests])
+        found = {d: np.frombuffer(v, dtype=np.float32) for d, v in zip(digests, values) if v is not None}
+
+        pipe = self.connection.pipeline(transaction=False)
+        if found:
+            now = time.time()
+            pipe.zadd(self.lru_key, {d: now for d in found})
+        pipe.hincrby(self.stats_key, 'hits', len(found))
+        pipe.hincrby(self.stats_key, 'misses', len(digests) - len(found))
+        pipe.execute()
+        return found
+
+    def put_many(self, probabilities):
+        """Store {digest: probabilities}, then evict the least recently used entries beyond max_entries."""
+        if not probabilities:
+            return
+
+        now = time.time()
+        pipe = self.connection.pipeline(transaction=False)
+        for digest, probs in probabilities.items():
+            pipe.set(self.key(digest), np.asarray(probs, dtype=np.float32).tobytes())
+        pipe.zadd(self.lru_key, {d: now for d in probabilities})
+        pipe.zcard(self.lru_key)
+        size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            evicted = [d.decode() for d, _ in self.connection.zpopmin(self.lru_key, size - self.max_entries)]
+            self.connection.delete(*[self.key(d) for d in evicted])
+            logger.debug(f"evicted {len(evicted)} cached predictions for {self.model_name}")
+
+    def stats(self):
+        counts = self.connection.hgetall(self.stats_key)
+        hits, misses = int(counts.get(b'hits', 0)), int(counts.get(b'misses', 0))
+        return {
+            'model': self.model_name,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            'entries': self.connection.zcard(self.lru_key),
+            'max_entries': self.max_entries,
+        }
+
+    def clear(self):
+        """Forget this model's entries."""
+        digests = [d.decode() for d in self.connection.zrange(self.lru_key, 0, -1)]
+        self.connection.delete(self.lru_key, self.stats_key, *[self.key(d) for d in digests])
+
+def cache_name(model):
+    """The model's file name and the start of its file's digest, if it has one, so a model
+    retrained or re-exported under the same file name starts a new cache.
+    """
+    digest = getattr(model, 'digest', None)
+    return f"{model.name}@{digest[:16]}" if digest else model.name
+
+def make_current(cache, file_name):
+    """Note cache as the one in use for the model file_name, clearing the one it replaces."""
+    if cache.model_name in _current:
+        return
+
+    previous = cache.connection.getset(f"{CURRENT_KEY}:{file_name}", cache.model_name)
+    if previous and previous.decode() != cache.model_name:
+        logger.info(f"{file_name} has changed, clearing the predictions cached for {previous.decode()}")
+        PredictionCache(cache.connection, previous.decode()).clear()
+    _current.add(cache.model_name)
+
+def prediction_cache(model_name):
+    """The cache for model_name, or None when [prediction] CACHE_SIZE is 0."""
+    size = int(application_config('prediction', 'CACHE_SIZE') or DEFAULT_CACHE_SIZE)
+    return PredictionCache(redis_connection(), model_name, size) if size > 0 else None
+
+def cached_probabilities(model, img_files):
+    """model.probabilities(img_files), running the model only on images it has not seen before."""
+    cache = prediction_cache(cache_name(model))
+    if cache is None:
+        return model.probabilities(img_files)
+
+    digests = [content_digest(f) for f in img_files]
+    try:
+        make_current(cache, model.name)
+        found = cache.get_many(digests)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"prediction cache unavailable, predicting directly: {e}")
+        return model.probabilities(img_files)
+
+    missing = {d: f for d, f in zip(digests, img_files) if d not in found}
+    if missing:
+        computed = dict(zip(missing, model.probabilities(list(missing.values()))))
+        found.update(computed)
+        try:
+            cache.put_many(computed)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"could not cache predictions: {e}")
+
+    return np.stack([found[d] for d in digests])
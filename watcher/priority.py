@@ -0,0 +1,62 @@
+from rq import Queue, Retry
+
+from .connection import application_config, application_flag
+from . import setup_logging
+
+__all__ = ['queue_for', 'queues_by_priority', 'reroute_job', 'is_low_priority']
+
+logger = setup_logging()
+
+LOW_SUFFIX = '_low'
+DEFAULT_LOW_PRIORITY_LIGHTING = 'night'
+
+def priority_enabled():
+    return application_flag('system', 'PRIORITY_QUEUES', default=True)
+
+def is_low_priority(lighting_type):
+    low = application_config('system', 'LOW_PRIORITY_LIGHTING') or DEFAULT_LOW_PRIORITY_LIGHTING
+    return lighting_type in [l.strip() for l in low.split(',')]
+
+def queue_for(base, lighting_type):
+    """The queue for work on an event with lighting_type: base, or its low priority tier for night."""
+    if priority_enabled() and is_low_priority(lighting_type):
+        return base + LOW_SUFFIX
+    return base
+
+def queues_by_priority(*bases):
+    """Queue names for a worker, every high priority tier before any low one.
+
+    rq workers check their queues in order for each job, so low priority work is only taken
+    when there is no high priority work waiting.
+    """
+    names = list(bases)
+    if priority_enabled():
+        names += [base + LOW_SUFFIX for base in bases]
+    return names
+
+def reroute_job(job, connection, lighting_of):
+    """Move a job that arrived on a high priority queue to the low one if its event calls for it,
+    returning true if it was moved. lighting_of is called for the event's lighting only when needed.
+
+    Jobs enqueued from outside, as by motion's on_movie_end, arrive on the high priority queue
+    without knowing their event's lighting.
+    """
+    if job is None or not priority_enabled() or job.origin.endswith(LOW_SUFFIX):
+        return False
+
+    lighting_type = lighting_of()
+    target = queue_for(job.origin, lighting_type)
+    if target == job.origin:
+        return False
+
+    # the same job in all but its queue: what it waits on, how long it may run and its retries
+    retry = Retry(max=job.retries_left, interval=job.retry_intervals or 0) if job.retries_left else None
+    moved = Queue(target, connection=connection).enqueue(
+        job.func_name, args=job.args, kwargs=job.kwargs, retry=retry,
+        depends_on=job.dependency_ids or None, job_timeout=job.timeout,
+        result_ttl=job.result_ttl, failure_ttl=job.failure_ttl, description=job.description)
+
+    job.meta['rerouted'] = {'queue': target, 'job_id': moved.id, 'lighting_type': lighting_type}
+    job.save_meta()
+    logger.info(f"{lighting_type} job {job.id} moved to {target} as {moved.id}")
+    return True
@@ -0,0 +1,142 @@
+import os
+import time
+import struct
+
+from fractions import Fraction
+from functools import lru_cache
+from typing import NamedTuple
+
+import ffmpeg
+
+from .connection import application_flag
+
+__all__ = ['VideoInfo', 'FFMPEGError', 'probe_video', 'parse_mp4']
+
+PROBE_TRIES = 4
+PROBE_RETRY_SECONDS = 0.25
+
+class FFMPEGError(Exception):
+    pass 
+
+class VideoInfo(NamedTuple):
+    width: int
+    height: int
+    num_frames: int
+    duration: float
+    frame_rate: Fraction
+
+def probe_video(video_file) -> VideoInfo:
+    """Stream metadata for video_file, probed once per version of the file.
+
+    Results are remembered by path, modification time and size, so a file that is
+    rewritten is probed again.
+    """
+    st = os.stat(video_file)
+    return _probe_video(str(video_file), st.st_mtime_ns, st.st_size)
+
+@lru_cache(maxsize=256)
+def _probe_video(video_file, mtime_ns, size) -> VideoInfo:
+    if application_flag('video', 'PARSE_MP4'):
+        try:
+            return parse_mp4(video_file)
+        except (ValueError, struct.error):
+            pass
+
+    return ffprobe_video(video_file)
+
+def ffprobe_video(video_file) -> VideoInfo:
+    # motion may still be finishing the file, so give it a moment to show up complete
+    delay = PROBE_RETRY_SECONDS
+    for tries_remaining in reversed(range(PROBE_TRIES)):
+        try:
+            info = ffmpeg.probe(video_file)
+        except ffmpeg.Error as e:
+            if e.stderr and e.stderr.endswith(b'Invalid data found when processing input\n'):
+                raise FFMPEGError(f'Invalid data when probing {video_file}') from e
+            raise e
+
+        if 'streams' in info or not tries_remaining:
+            break
+        time.sleep(delay)
+        delay *= 2
+
+    video_info = next(stream for stream in info['streams'] if stream['codec_type'] == 'video')
+    return VideoInfo(
+        width = int(video_info['width']),
+        height = int(video_info['height']),
+        num_frames = int(video_info['nb_frames']),
+        duration = float(video_info['duration']),
+        frame_rate = Fraction(video_info.get('avg_frame_rate') or video_info['r_frame_rate']),
+    )
+
+def _boxes(f, start, end):
+    """(type, payload start, end) of each ISO BMFF box between start and end."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"malformed {kind} box at {pos}")
+
+        yield kind, pos + header, pos + size
+        pos += size
+
+def _find(f, start, end, *path):
+    for kind, payload, box_end in _boxes(f, start, end):
+        if kind == path[0]:
+            return (payload, box_end) if len(path) == 1 else _find(f, payload, box_end, *path[1:])
+    return None
+
+def _read_at(f, pos, fmt):
+    f.seek(pos)
+    return struct.unpack(fmt, f.read(struct.calcsize(fmt)))
+
+def _video_track(f, start, end):
+    mdia = _find(f, start, end, b'mdia')
+    hdlr = mdia and _find(f, *mdia, b'hdlr')
+    if not hdlr or _read_at(f, hdlr[0] + 8, '4s')[0] != b'vide':
+        return None
+
+    mdhd, _ = _find(f, *mdia, b'mdhd')
+    if _read_at(f, mdhd, 'B')[0] == 1:
+        timescale, duration = _read_at(f, mdhd + 20, '>IQ')
+    else:
+        timescale, duration = _read_at(f, mdhd + 12, '>II')
+
+    stbl = _find(f, *mdia, b'minf', b'stbl')
+    stsd, _ = _find(f, *stbl, b'stsd')
+    width, height = _read_at(f, stsd + 8 + 8 + 24, '>HH')
+    stsz, _ = _find(f, *stbl, b'stsz')
+    num_frames = _read_at(f, stsz + 8, '>I')[0]
+
+    if not (width and height and num_frames and timescale and duration):
+        raise ValueError("incomplete video track")
+
+    return VideoInfo(
+        width = width,
+        height = height,
+        num_frames = num_frames,
+        duration = duration / timescale,
+        frame_rate = Fraction(num_frames * timescale, duration),
+    )
+
+def parse_mp4(video_file) -> VideoInfo:
+    """Read video stream metadata from an MP4's moov box directly, without running ffprobe."""
+    with open(video_file, 'rb') as f:
+        moov = _find(f, 0, os.fstat(f.fileno()).st_size, b'moov')
+        if not moov:
+            raise ValueError(f"no moov box in {video_file}")
+
+        for kind, payload, box_end in _boxes(f, *moov):
+            if kind == b'trak':
+                info = _video_track(f, payload, box_end)
+                if info:
+                    return info
+
+    raise ValueError(f"no video track in {video_file}")
@@ -0,0 +1,255 @@
+import json
+
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .metrics import decoding
+from .prediction_cache import content_digest
+
+__all__ = ['FastaiStillModel', 'OnnxStillModel', 'load_still_model', 'export_onnx', 'quantize_onnx',
+           'quantized_file', 'read_vocab', 'accuracy_report', 'BACKENDS', 'QUANTIZATIONS']
+
+BACKENDS = ['fastai', 'onnx']
+QUANTIZATIONS = ['dynamic', 'static']
+DEFAULT_CALIBRATION_IMAGES = 64
+
+# the training notebook's pipeline: Resize(460) as a centre crop, then aug_transforms(size=224),
+# which for inference only scales down, then the imagenet Normalize added by vision_learner
+RESIZE = 460
+INPUT_SIZE = 224
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+DEFAULT_THRESH = 0.5
+
+class FastaiStillModel(object):
+    """The exported fastai learner, as trained. threads limits torch's CPU threads, which
+    otherwise uses every core.
+    """
+    def __init__(self, model_file, threads=None):
+        import torch
+        from fastai.vision.learner import load_learner
+
+        if threads:
+            torch.set_num_threads(threads)
+
+        self.learn = load_learner(model_file)
+        self.name = Path(model_file).name
+        self.digest = content_digest(model_file)
+        self.vocab = list(self.learn.dls.vocab)
+        self.thresh = getattr(self.learn.loss_func, 'thresh', DEFAULT_THRESH)
+
+    def probabilities(self, img_files):
+        """(N, len(vocab)) probabilities for the images, files or PIL images, in one batched pass."""
+        probs, _ = self.learn.get_preds(dl=self.learn.dls.test_dl(list(img_files)))
+        return probs.numpy()
+
+class OnnxStillModel(object):
+    """The same classifier exported by export_onnx, run with onnxruntime on the CPU.
+
+    Scaling to the input size, normalising and the sigmoid are part of the graph. Only the
+    centre crop and the first resize happen here, in PIL, as fastai's Resize does them.
+    """
+    def __init__(self, model_file, threads=1):
+        import onnxruntime as ort
+
+        model_file = Path(model_file)
+        with open(model_file.with_suffix('.json')) as f:
+            self.sidecar = json.load(f)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_file), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+        self.name = model_file.name
+        self.digest = content_digest(model_file)
+        self.vocab = self.sidecar['vocab']
+        self.thresh = self.sidecar.get('thresh', DEFAULT_THRESH)
+        self.resize = self.sidecar.get('resize', RESIZE)
+
+    def preprocess(self, img_file):
+        with decoding():
+            img = (img_file if isinstance(img_file, Image.Image) else Image.open(img_file)).convert('RGB')
+        width, height = img.size
+        side = min(width, height)
+        left, top = (width - side) // 2, (height - side) // 2
+        img = img.resize((self.resize, self.resize), Image.BILINEAR, box=(left, top, left + side, top + side))
+        return np.asarray(img, dtype=np.float32).transpose(2, 0, 1)
+
+    def probabilities(self, img_files):
+        batch = np.stack([self.preprocess(f) for f in img_files])
+        return self.session.run(None, {self.input_name: batch})[0]
+
+def load_still_model(model_file, backend='fastai', threads=None):
+    if backend == 'fastai':
+        return FastaiStillModel(model_file, threads)
+    if backend == 'onnx':
+        return OnnxStillModel(model_file, threads or 1)
+    raise ValueError(f"unknown prediction backend {backend}")
+
+def normalize_stats(learn):
+    for tfm in learn.dls.after_batch.fs:
+        if type(tfm).__name__ == 'Normalize':
+            return tfm.mean.flatten().tolist(), tfm.std.flatten().tolist()
+    return IMAGENET_MEAN, IMAGENET_STD
+
+def export_onnx(model_file, onnx_file=None, opset=17):
+    """Write the fastai model at model_file as ONNX, with a JSON sidecar of its vocabulary and preprocessing.
+
+    The graph takes (N, 3, 460, 460) RGB values from 0 to 255 and returns probabilities.
+    """
+    import torch
+    import torch.nn.functional as F
+    from fastai.vision.learner import load_learner
+
+    model_file = Path(model_file)
+    onnx_file = Path(onnx_file) if onnx_file else model_file.with_suffix('.onnx')
+
+    learn = load_learner(model_file)
+    mean, std = normalize_stats(learn)
+    thresh = getattr(learn.loss_func, 'thresh', DEFAULT_THRESH)
+
+    class Preprocessed(torch.nn.Module):
+        def __init__(self, body):
+            super().__init__()
+            self.body = body
+            self.register_buffer('mean', torch.tensor(mean).view(1, 3, 1, 1))
+            self.register_buffer('std', torch.tensor(std).view(1, 3, 1, 1))
+
+        def forward(self, x):
+            # fastai scales batches with grid_sample(align_corners=True)
+            x = F.interpolate(x / 255, size=(INPUT_SIZE, INPUT_SIZE), mode='bilinear', align_corners=True)
+            return torch.sigmoid(self.body((x - self.mean) / self.std))
+
+    net = Preprocessed(learn.model.cpu().eval()).eval()
+    with torch.no_grad():
+        torch.onnx.export(net, torch.zeros(1, 3, RESIZE, RESIZE), str(onnx_file),
+                          input_names=['image'], output_names=['probabilities'],
+                          dynamic_axes={'image': {0: 'batch'}, 'probabilities': {0: 'batch'}},
+                          opset_version=opset)
+
+    sidecar = {
+        'source': model_file.name,
+        'exported_at': datetime.now().isoformat(timespec='seconds'),
+        'vocab': list(learn.dls.vocab),
+        'thresh': thresh,
+        'resize': RESIZE,
+        'resize_method': 'centre crop to square, bilinear',
+        'input_size': INPUT_SIZE,
+        'mean': mean,
+        'std': std,
+        'activation': 'sigmoid',
+    }
+    with open(onnx_file.with_suffix('.json'), 'w') as f:
+        json.dump(sidecar, f, indent=2)
+
+    return onnx_file
+
+def read_vocab(onnx_file):
+    """The labels of an exported model, from its sidecar, without loading it. None if it has no sidecar."""
+    sidecar = Path(onnx_file).with_suffix('.json')
+    if not sidecar.exists():
+        return None
+    with open(sidecar) as f:
+        return json.load(f)['vocab']
+
+def quantized_file(onnx_file, mode):
+    """Where quantize_onnx writes the int8 variant of onnx_file, e.g. model.int8-dynamic.onnx"""
+    onnx_file = Path(onnx_file)
+    return onnx_file.with_name(f"{onnx_file.stem}.int8-{mode}.onnx")
+
+class StillCalibration(object):
+    """Feeds preprocessed stills to onnxruntime's static quantizer, one at a time."""
+    def __init__(self, model, img_files):
+        self.model = model
+        self.files = iter(img_files)
+
+    def get_next(self):
+        f = next(self.files, None)
+        return None if f is None else {self.model.input_name: self.model.preprocess(f)[np.newaxis]}
+
+def quantize_onnx(onnx_file, mode='dynamic', calibration_files=None, out_file=None):
+    """Write an int8 copy of the exported model, with its own sidecar.
+
+    dynamic quantizes the weights and works out activation ranges as it runs. static also
+    fixes the activation ranges ahead of time from calibration_files, a sample of stills
+    like the ones it will see, which is faster again but more sensitive to that sample.
+    """
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if mode not in QUANTIZATIONS:
+        raise ValueError(f"unknown quantization {mode}, expected one of {QUANTIZATIONS}")
+
+    onnx_file = Path(onnx_file)
+    out_file = Path(out_file) if out_file else quantized_file(onnx_file, mode)
+    prepared_file = out_file.with_suffix('.prep.onnx')
+
+    # shape inference and graph cleanup first, as onnxruntime recommends before quantizing. The
+    # exported graph's shapes are all fixed but the batch, so onnx's own inference is enough.
+    quant_pre_process(str(onnx_file), str(prepared_file), skip_symbolic_shape=True)
+    try:
+        if mode == 'dynamic':
+            quantize_dynamic(str(prepared_file), str(out_file), weight_type=QuantType.QInt8)
+        else:
+            if not calibration_files:
+                raise ValueError("static quantization needs calibration images")
+            reader = StillCalibration(OnnxStillModel(onnx_file), calibration_files[:DEFAULT_CALIBRATION_IMAGES])
+            quantize_static(str(prepared_file), str(out_file), reader, quant_format=QuantFormat.QDQ,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    finally:
+        prepared_file.unlink(missing_ok=True)
+
+    with open(onnx_file.with_suffix('.json')) as f:
+        sidecar = json.load(f)
+    sidecar['quantization'] = mode
+    sidecar['quantized_from'] = onnx_file.name
+    sidecar['quantized_at'] = datetime.now().isoformat(timespec='seconds')
+    with open(out_file.with_suffix('.json'), 'w') as f:
+        json.dump(sidecar, f, indent=2)
+
+    return out_file
+
+def accuracy_report(models, labeled, batch_size=32):
+    """Compare models against human labels, as (still file, 'label & label') pairs from get_labeled_data.
+
+    Returns a dict for each model of exact match rate, per label precision and recall, and how
+    often its labels agree with the first model's, which is usually the unquantized one.
+    """
+    labeled = [(Path(f), set(labels.split(' & ')) if labels else set()) for f, labels in labeled if Path(f).exists()]
+    files = [f for f, _ in labeled]
+
+    predicted = {}
+    for name, model in models.items():
+        masks = []
+        for i in range(0, len(files), batch_size):
+            masks.append(model.probabilities(files[i:i + batch_size]) > model.thresh)
+        masks = np.concatenate(masks) if masks else np.zeros((0, len(model.vocab)), bool)
+        predicted[name] = [set(np.asarray(model.vocab)[m]) for m in masks]
+
+    reference = next(iter(predicted.values()), [])
+    report = {}
+    for name, model in models.items():
+        labels = {}
+        for label in model.vocab:
+            tp = sum(label in p and label in t for p, (_, t) in zip(predicted[name], labeled))
+            fp = sum(label in p and label not in t for p, (_, t) in zip(predicted[name], labeled))
+            fn = sum(label not in p and label in t for p, (_, t) in zip(predicted[name], labeled))
+            labels[label] = {
+                'precision': tp / (tp + fp) if tp + fp else None,
+                'recall': tp / (tp + fn) if tp + fn else None,
+                'support': tp + fn,
+            }
+
+        report[name] = {
+            'images': len(labeled),
+            'exact_match': sum(p == t for p, (_, t) in zip(predicted[name], labeled)) / max(len(labeled), 1),
+            'agreement': sum(p == r for p, r in zip(predicted[name], reference)) / max(len(labeled), 1),
+            'labels': labels,
+        }
+
+    return report
@@ -0,0 +1,64 @@
+import os
+import time
+import tempfile
+import unittest
+
+import numpy as np
+
+from watcher.background import SceneBackground
+from watcher.image_functions import MotionScan
+
+class TestSceneBackground(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        os.environ['WATCHER_SYSTEM_LOCAL_DATA_DIR'] = self.data_dir.name
+
+    def tearDown(self):
+        os.environ.pop('WATCHER_SYSTEM_LOCAL_DATA_DIR')
+        self.data_dir.cleanup()
+
+    def test_missing(self):
+        self.assertIsNone(SceneBackground.load('scene1', 64, 48))
+
+    def test_save_and_load(self):
+        image = np.full((48, 64, 3), 100, np.float32)
+        SceneBackground('scene1', image).save()
+
+        loaded = SceneBackground.load('scene1', 64, 48)
+        np.testing.assert_array_equal(loaded.image, image)
+        self.assertFalse(loaded.is_stale)
+
+        self.assertIsNone(SceneBackground.load('scene1', 64, 48, 'gray'))
+        self.assertIsNone(SceneBackground.load('scene1', 32, 24))
+
+    def test_update_only_where_observed(self):
+        bg = SceneBackground('scene1', np.full((4, 4), 100, np.float32), 'gray', updated_at=time.time())
+        seen = np.zeros((4, 4), bool)
+        seen[0, :] = True
+
+        bg.update(np.full((4, 4), 200, np.float32), seen, learning_rate=0.25)
+        np.testing.assert_allclose(bg.image[0, :], 125)
+        np.testing.assert_allclose(bg.image[1:, :], 100)
+
+    def test_stale_model_is_replaced(self):
+        bg = SceneBackground('scene1', np.full((4, 4, 3), 100, np.float32), updated_at=time.time() - 24*60*60)
+        self.assertTrue(bg.is_stale)
+
+        bg.update(np.full((4, 4, 3), 200, np.float32), np.ones((4, 4), bool), learning_rate=0.25)
+        np.testing.assert_allclose(bg.image, 200)
+
+    def test_scan_collects_quiet_pixels(self):
+        video = np.full((10, 24, 32, 3), 90, np.uint8)
+        for i in range(10):
+            video[i, 2:8, 3*i:3*i+6, :] = 250
+
+        scan = MotionScan(background=np.full((24, 32, 3), 90, np.float32), collect_quiet=True)
+        scan.scan([video[0:5], video[5:10]])
+
+        observed, seen = scan.quiet_image()
+        self.assertEqual(observed.shape, (24, 32, 3))
+        self.assertTrue(seen[20:, :].all())
+        np.testing.assert_allclose(observed[seen], 90)
+
+if __name__ == '__main__':
+    unittest.main()
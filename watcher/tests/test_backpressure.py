@@ -0,0 +1,122 @@
+import os
+import unittest
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+from rq import Queue
+
+try:
+    import fakeredis
+    fakeredis.FakeRedis().eval('return 1', 0)
+except Exception:
+    fakeredis = None
+
+from watcher.model import WatcherBase, IntermediateResult, EventObservation, Labeling
+from watcher.backpressure import Admission, admit_event, backfill_events, SHEDDING_STEP
+from watcher.tests.utils import create_db_from_object_model
+
+HIGH_WATER = {
+    'WATCHER_SYSTEM_HIGH_WATER_COARSE': '3',
+    'WATCHER_SYSTEM_HIGH_WATER_SKIP_PREDICTION': '2',
+    'WATCHER_SYSTEM_HIGH_WATER_DEFER': '5',
+}
+
+def fill(connection, name, count):
+    for i in range(count):
+        Queue(name, connection=connection).enqueue('watcher.video.task_save_significant_frame', f"ev{i}")
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with lua")
+@mock.patch.dict(os.environ, HIGH_WATER)
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+
+    def test_no_backlog(self):
+        admission = admit_event(self.connection, lambda: True)
+        self.assertFalse(admission)
+        self.assertEqual(admission.depths, {'event_video': 0, 'prediction': 0})
+
+    def test_modes_by_depth_and_priority(self):
+        fill(self.connection, 'event_video', 2)
+        fill(self.connection, 'event_video_low', 2)
+        fill(self.connection, 'prediction_low', 2)
+
+        day = admit_event(self.connection, lambda: False)
+        self.assertEqual(day.modes, ['coarse'])
+        self.assertEqual(day.depths, {'event_video': 4, 'prediction': 2})
+
+        night = admit_event(self.connection, lambda: True)
+        self.assertEqual(night.modes, ['coarse', 'skip_prediction'])
+
+        fill(self.connection, 'event_video', 1)
+        self.assertTrue(admit_event(self.connection, lambda: True).defer)
+
+    def test_priority_only_looked_up_when_needed(self):
+        low_priority = mock.MagicMock(return_value=True)
+        admit_event(self.connection, low_priority)
+        low_priority.assert_not_called()
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with lua")
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.session = create_db_from_object_model(WatcherBase)
+        self.connection = fakeredis.FakeRedis()
+
+    def tearDown(self):
+        self.session.close()
+
+    def event(self, name):
+        evt = EventObservation(event_name=name, capture_time='2021-01-01T22:00:00', scene_name='scene1',
+                               storage_local=True, video_location='scene1', video_file=f"{name}.mp4")
+        self.session.add(evt)
+        return evt
+
+    def test_backfill(self):
+        then = datetime.now() - timedelta(hours=1)
+        deferred, skipped, since = self.event('deferred'), self.event('skipped'), self.event('since')
+
+        self.session.add(Admission(['defer']).result(deferred))
+        self.connection.set('claim:video:deferred', 'job-a')
+
+        self.session.add(Admission(['coarse', 'skip_prediction']).result(skipped))
+        self.session.add(IntermediateResult(step='task_save_significant_frame', file='scene1/skipped_f3.jpg', event=skipped,
+                                            info={'crops': [{'file': 'scene1/skipped_f3_c0.jpg', 'box': [0, 0, 224, 224]}]}))
+
+        self.session.add(IntermediateResult(step=SHEDDING_STEP, info={'modes': ['skip_prediction']}, event=since, computed_at=then))
+        self.session.add(IntermediateResult(step='task_save_significant_frame', file='scene1/since_f1.jpg', event=since, info={}))
+        self.session.add(Labeling(labels=['cat'], decider='model.pkl', event=since))
+        self.session.commit()
+
+        queued = backfill_events(self.session, self.connection)
+        self.assertEqual(sorted(queued), [('deferred', 'event_video'), ('skipped', 'prediction')])
+        self.assertIsNone(self.connection.get('claim:video:deferred'))
+
+        [video] = Queue('event_video_low', connection=self.connection).jobs
+        self.assertEqual(video.args, ('deferred',))
+        [predict] = Queue('prediction_low', connection=self.connection).jobs
+        self.assertEqual(predict.args, ('scene1/skipped_f3.jpg', 'skipped'))
+        self.assertEqual(predict.kwargs['crops'], ['scene1/skipped_f3_c0.jpg'])
+
+    def test_event_shed_at_several_stages_is_queued_once(self):
+        then = datetime.now() - timedelta(hours=2)
+        twice, predicted_twice = self.event('twice'), self.event('predicted_twice')
+
+        # deferred, then shed again: the video stage covers the prediction as well
+        self.session.add(IntermediateResult(step=SHEDDING_STEP, info={'modes': ['defer']}, event=twice, computed_at=then))
+        self.session.add(Admission(['coarse', 'skip_prediction']).result(twice))
+        self.session.add(Admission(['defer']).result(twice))
+
+        self.session.add(IntermediateResult(step=SHEDDING_STEP, info={'modes': ['skip_prediction']}, event=predicted_twice, computed_at=then))
+        self.session.add(IntermediateResult(step='task_save_significant_frame', file='scene1/predicted_twice_f2.jpg',
+                                            event=predicted_twice, info={}))
+        self.session.add(Admission(['coarse', 'skip_prediction']).result(predicted_twice))
+        self.session.commit()
+
+        queued = backfill_events(self.session, self.connection)
+        self.assertEqual(sorted(queued), [('predicted_twice', 'prediction'), ('twice', 'event_video')])
+        self.assertEqual(Queue('event_video_low', connection=self.connection).count, 1)
+        self.assertEqual(Queue('prediction_low', connection=self.connection).count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+import gc
+import os
+import signal
+import tempfile
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import sqlalchemy
+from PIL import Image
+from rq import Queue, Retry
+from rq.job import JobStatus
+
+try:
+    import fakeredis
+    fakeredis.FakeRedis().eval('return 1', 0)
+except Exception:
+    fakeredis = None
+
+from watcher.model import WatcherBase, EventObservation, Labeling
+from watcher.predict_still import BatchPredictionWorker, PredictorPool, batched
+from watcher.tests.utils import create_db_from_object_model
+
+class NamedModel(object):
+    name = 'named.onnx'
+    vocab = ['cat', 'person']
+    thresh = 0.5
+
+    def __init__(self):
+        self.batches = []
+
+    def probabilities(self, img_files):
+        self.batches.append([Path(f).name for f in img_files])
+        return np.array([[0.9, 0.1] if 'cat' in Path(f).name else [0.1, 0.8] for f in img_files], dtype=np.float32)
+
+class PredictionQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+        self.queue = Queue('prediction', connection=self.connection)
+        self.model = NamedModel()
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+        self.session = create_db_from_object_model(WatcherBase)
+        self.addCleanup(self.session.close)
+        engine = self.session.get_bind()
+        self.tunnels = tunnels = []
+
+        class Tunnel(object):
+            def __enter__(self):
+                tunnels.append(self)
+                return engine
+            def __exit__(self, *args):
+                pass
+
+        patches = [
+            mock.patch.dict(os.environ, {'WATCHER_SYSTEM_LOCAL_DATA_DIR': self.dir.name,
+                                         'WATCHER_PREDICTION_CACHE_SIZE': '0'}),
+            mock.patch('watcher.predict_still.lazy_load_model', return_value=(self.model, self.model.name)),
+            mock.patch('watcher.predict_still.redis_connection', return_value=self.connection),
+            mock.patch('watcher.predict_still.TunneledConnection', Tunnel),
+            mock.patch('watcher.dedup.redis_connection', return_value=self.connection),
+            mock.patch('watcher.metrics.redis_connection', return_value=self.connection),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def event(self, name):
+        self.session.add(EventObservation(event_name=name, capture_time='2021-01-01T12:00:00', scene_name='scene1',
+                                          storage_local=True, video_location='scene1', video_file=f"{name}.mp4"))
+        self.session.commit()
+        Image.new('RGB', (32, 24)).save(Path(self.dir.name) / f"{name}.jpg")
+
+    def predict(self, name, **kwargs):
+        return self.queue.enqueue('watcher.predict_still.task_predict_still', f"{name}.jpg", name, **kwargs)
+
+    def labeled(self):
+        return {lbl.event.event_name: lbl.labels for lbl in self.session.query(Labeling)}
+
+    def labeling_count(self):
+        self.session.expire_all()
+        return self.session.query(Labeling).count()
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with lua")
+class TestBatchPredictionWorker(PredictionQueueTestCase):
+    def work(self, batch_size=4):
+        worker = BatchPredictionWorker([self.queue], connection=self.connection, batch_size=batch_size, wait_ms=10)
+        worker.work(burst=True)
+        return worker
+
+    def test_one_pass_for_the_batch(self):
+        for name in ['cat1', 'cat2', 'person1']:
+            self.event(name)
+        jobs = [self.predict(name) for name in ['cat1', 'cat2', 'person1']]
+
+        self.work()
+        self.assertEqual(self.model.batches, [['cat1.jpg', 'cat2.jpg', 'person1.jpg']])
+        self.assertEqual([job.get_status() for job in jobs], [JobStatus.FINISHED] * 3)
+        self.assertEqual(self.labeled(), {'cat1': ['cat'], 'cat2': ['cat'], 'person1': ['person']})
+        self.assertEqual(batched, {})
+
+    def test_batch_is_stored_in_one_transaction(self):
+        for name in ['cat1', 'cat2', 'person1']:
+            self.event(name)
+            self.predict(name)
+
+        commit = sqlalchemy.orm.Session.commit
+        with mock.patch('sqlalchemy.orm.Session.commit', autospec=True, side_effect=commit) as commits:
+            self.work()
+        self.assertEqual(len(self.tunnels), 1)
+        self.assertEqual(commits.call_count, 1)
+        self.assertEqual(self.labeling_count(), 3)
+
+    def test_failed_transaction_stores_jobs_one_by_one(self):
+        for name in ['cat1', 'cat2']:
+            self.event(name)
+        jobs = [self.predict(name) for name in ['cat1', 'cat2']]
+
+        commit = sqlalchemy.orm.Session.commit
+        def lost_once(session):
+            if len(self.tunnels) == 1:
+                session.flush()
+                raise sqlalchemy.exc.OperationalError("COMMIT", {}, Exception("connection lost"))
+            return commit(session)
+
+        with mock.patch('sqlalchemy.orm.Session.commit', autospec=True, side_effect=lost_once):
+            self.work()
+        self.assertEqual(self.model.batches, [['cat1.jpg', 'cat2.jpg']])
+        self.assertEqual(len(self.tunnels), 3)
+        self.assertEqual([job.get_status() for job in jobs], [JobStatus.FINISHED] * 2)
+        self.assertEqual(self.labeled(), {'cat1': ['cat'], 'cat2': ['cat']})
+        self.assertEqual(self.labeling_count(), 2)
+
+    def test_held_jobs_are_started(self):
+        for name in ['cat1', 'cat2', 'cat3']:
+            self.event(name)
+        jobs = [self.predict(name) for name in ['cat1', 'cat2', 'cat3']]
+
+        seen = {}
+        predict_ahead = BatchPredictionWorker.predict_ahead
+        def look(worker, batch):
+            seen['started'] = set(self.queue.started_job_registry.get_job_ids())
+            seen['status'] = [job.get_status() for job in jobs]
+            return predict_ahead(worker, batch)
+
+        with mock.patch.object(BatchPredictionWorker, 'predict_ahead', autospec=True, side_effect=look):
+            self.work()
+        self.assertEqual(seen['started'], set(job.id for job in jobs))
+        self.assertEqual(seen['status'], [JobStatus.STARTED] * 3)
+        self.assertEqual(self.queue.started_job_registry.get_job_ids(), [])
+        self.assertEqual([job.get_status() for job in jobs], [JobStatus.FINISHED] * 3)
+
+    def test_stopping_puts_held_jobs_back(self):
+        for name in ['cat1', 'cat2', 'cat3']:
+            self.event(name)
+        jobs = [self.predict(name) for name in ['cat1', 'cat2', 'cat3']]
+
+        predict_ahead = BatchPredictionWorker.predict_ahead
+        def stop(worker, batch):
+            predict_ahead(worker, batch)
+            worker._stop_requested = True
+
+        with mock.patch.object(BatchPredictionWorker, 'predict_ahead', autospec=True, side_effect=stop):
+            self.work()
+        self.assertEqual(jobs[0].get_status(), JobStatus.FINISHED)
+        self.assertEqual([job.get_status() for job in jobs[1:]], [JobStatus.QUEUED] * 2)
+        self.assertEqual(self.queue.get_job_ids(), [job.id for job in jobs[1:]])
+        self.assertEqual(self.queue.started_job_registry.get_job_ids(), [])
+
+        # the batch stored all three, so the jobs put back finish without predicting or storing again
+        self.work()
+        self.assertEqual(self.model.batches, [['cat1.jpg', 'cat2.jpg', 'cat3.jpg']])
+        self.assertEqual([job.get_status() for job in jobs], [JobStatus.FINISHED] * 3)
+        self.assertEqual(self.labeling_count(), 3)
+
+    def test_batches_up_to_batch_size(self):
+        for name in ['cat1', 'cat2', 'cat3']:
+            self.event(name)
+            self.predict(name)
+
+        self.work(batch_size=2)
+        self.assertEqual(self.model.batches, [['cat1.jpg', 'cat2.jpg'], ['cat3.jpg']])
+
+    def test_failure_is_retried_then_failed(self):
+        self.event('cat1')
+        missing = self.predict('gone', retry=Retry(max=1))
+        good = self.predict('cat1')
+
+        self.work()
+        self.assertEqual(good.get_status(), JobStatus.FINISHED)
+        self.assertEqual(self.labeled(), {'cat1': ['cat']})
+
+        missing.refresh()
+        self.assertEqual(missing.get_status(), JobStatus.FAILED)
+        self.assertEqual(missing.retries_left, 0)
+        self.assertIn(missing.id, self.queue.failed_job_registry.get_job_ids())
+
+    def test_failed_pass_predicts_jobs_alone(self):
+        self.event('cat1')
+        job = self.predict('cat1')
+
+        with mock.patch('watcher.predict_still.predict_ensembles', side_effect=[RuntimeError("out of memory"),
+                                                                                [(Labeling(labels=['cat'], decider='x'), None)]]):
+            self.work()
+        self.assertEqual(job.get_status(), JobStatus.FINISHED)
+        self.assertEqual(self.labeled(), {'cat1': ['cat']})
+
+    def test_dependents_are_enqueued(self):
+        self.event('cat1')
+        job = self.predict('cat1')
+        dependent = self.queue.enqueue('os.path.basename', 'scene1/cat1.jpg', depends_on=job)
+        self.assertEqual(dependent.get_status(), JobStatus.DEFERRED)
+
+        self.work()
+        self.assertEqual(dependent.get_status(), JobStatus.FINISHED)
+        self.assertEqual(dependent.return_value(), 'cat1.jpg')
+
+    def test_claimed_events_stay_out_of_the_pass(self):
+        self.event('cat1')
+        self.event('cat2')
+        self.connection.set('claim:prediction:cat1', 'another-job')
+        skipped, job = self.predict('cat1'), self.predict('cat2')
+
+        self.work()
+        self.assertEqual(self.model.batches, [['cat2.jpg']])
+        self.assertEqual(skipped.get_meta()['duplicate']['claimed_by'], 'another-job')
+        self.assertEqual(self.labeled(), {'cat2': ['cat']})
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with lua")
+@unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+class TestPredictorPool(PredictionQueueTestCase):
+    def setUp(self):
+        super().setUp()
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        self.addCleanup(gc.unfreeze)
+
+    def run_pool(self, batch_size):
+        # the children take the jobs from their copy of the fake Redis and store labelings in the
+        # shared sqlite file, where they are seen here
+        for name in ['cat1', 'person1']:
+            self.event(name)
+            self.predict(name)
+
+        load = mock.patch('watcher.predict_still.lazy_load_model', return_value=(self.model, self.model.name))
+        with load as lazy_load_model:
+            PredictorPool(['prediction'], workers=1, batch_size=batch_size, wait_ms=10, burst=True).run()
+
+        lazy_load_model.assert_called_once_with(threads=1)
+        self.session.expire_all()
+        self.assertEqual(self.labeled(), {'cat1': ['cat'], 'person1': ['person']})
+
+    def test_child_predicts(self):
+        self.run_pool(batch_size=1)
+
+    def test_child_predicts_in_batches(self):
+        self.run_pool(batch_size=2)
+
+if __name__ == '__main__':
+    unittest.main()
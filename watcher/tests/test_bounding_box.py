@@ -0,0 +1,118 @@
+import unittest
+
+import numpy as np
+
+from watcher.bounding_box import find_boxes, merge_boxes, crop_regions
+from watcher.image_functions import MotionScan
+
+class TestBoundingBox(unittest.TestCase):
+    def test_merge_boxes(self):
+        boxes, frames = merge_boxes([[0, 0, 10, 10], [20, 0, 10, 10], [9, 0, 12, 3], [50, 50, 5, 5]])
+        np.testing.assert_array_equal(boxes, [[0, 0, 30, 10], [50, 50, 5, 5]])
+        np.testing.assert_array_equal(frames, [0, 0])
+
+    def test_merge_until_stable(self):
+        # the first three join in a chain, and only then does the result reach the last one
+        boxes, _ = merge_boxes([[0, 0, 5, 5], [4, 4, 5, 5], [8, 8, 5, 5], [0, 11, 3, 3]])
+        np.testing.assert_array_equal(boxes, [[0, 0, 13, 14]])
+
+    def test_merge_many_boxes(self):
+        # scattered noise, checked against joining every touching pair until none are left
+        rng = np.random.default_rng(3)
+        boxes = np.column_stack([rng.integers(0, 640, 600), rng.integers(0, 360, 600),
+                                 rng.integers(1, 20, 600), rng.integers(1, 20, 600)])
+
+        expected = [[x, y, x + w, y + h] for x, y, w, h in boxes.tolist()]
+        joined = True
+        while joined:
+            joined = False
+            for i in range(len(expected)):
+                for j in range(i + 1, len(expected)):
+                    a, b = expected[i], expected[j]
+                    if a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]:
+                        expected[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del expected[j]
+                        joined = True
+                        break
+                if joined:
+                    break
+
+        merged, _ = merge_boxes(boxes)
+        merged[:, 2:] += merged[:, :2]
+        self.assertEqual(sorted(merged.tolist()), sorted(expected))
+
+    def test_merge_within_frames(self):
+        boxes, frames = merge_boxes([[0, 0, 10, 10], [5, 5, 10, 10], [5, 5, 10, 10]], [0, 0, 1])
+        np.testing.assert_array_equal(boxes, [[0, 0, 15, 15], [5, 5, 10, 10]])
+        np.testing.assert_array_equal(frames, [0, 1])
+
+        boxes, frames = merge_boxes(np.zeros((0, 4)))
+        self.assertEqual(boxes.shape, (0, 4))
+
+    def test_find_boxes_in_stack(self):
+        masks = np.zeros((3, 60, 100), np.uint8)
+        masks[0, 30:40, 10:30] = 255
+        masks[0, 38:50, 28:40] = 255
+        masks[0, 30:35, 80:90] = 255  # too small
+        masks[1, 0:10, 0:50] = 255    # under the timestamp
+        masks[1, 50:60, 0:20] = 255
+        masks[2, 0:30, 0:20] = 255    # would join frame 1's box without separate labelling
+
+        boxes, frames = find_boxes(masks)
+        np.testing.assert_array_equal(boxes, [[10, 30, 30, 20], [0, 50, 20, 10]])
+        np.testing.assert_array_equal(frames, [0, 1])
+
+        boxes, frames = find_boxes(masks, min_y=0)
+        np.testing.assert_array_equal(boxes[2:], [[0, 50, 20, 10], [0, 0, 20, 30]])
+        np.testing.assert_array_equal(frames, [0, 1, 1, 2])
+
+    def test_crop_regions(self):
+        boxes = [[10, 30, 30, 20], [1000, 600, 400, 300], [1100, 650, 20, 20], [1800, 1000, 100, 60]]
+        crops = crop_regions(boxes, 1920, 1080, max_crops=3)
+
+        # largest first, grown and squared, the box inside it skipped, and the rest kept in frame
+        np.testing.assert_array_equal(crops, [[900, 450, 600, 600], [1696, 856, 224, 224], [0, 0, 224, 224]])
+        self.assertEqual(len(crop_regions(boxes, 1920, 1080, max_crops=1)), 1)
+        self.assertEqual(crop_regions([], 320, 240).shape, (0, 4))
+        np.testing.assert_array_equal(crop_regions([[0, 0, 500, 10]], 320, 240), [[80, 0, 240, 240]])
+
+    def test_scan_boxes(self):
+        video = np.full((12, 60, 80, 3), 100, np.uint8)
+        video[7, 30:50, 40:70, :] = 250
+        video[9, 25:45, 10:30, :] = 250
+
+        scan = MotionScan(box_scale=2).scan([video[0:6], video[6:12]])
+        self.assertEqual(scan.best_index, 7)
+        np.testing.assert_array_equal(scan.boxes_in_frame(7), [[80, 60, 60, 40]])
+        np.testing.assert_array_equal(scan.motion_boxes[1], [7, 9])
+
+        first, second = MotionScan(box_scale=2).scan([video[0:8]]), MotionScan(box_scale=2, start_index=8).scan([video[8:12]])
+        np.testing.assert_array_equal(MotionScan.merge([first, second]).motion_boxes[1], [7, 9])
+
+    def test_scan_keeps_boxes_of_top_frames(self):
+        video = np.full((40, 60, 80, 3), 100, np.uint8)
+        for f in range(5, 35):
+            # a square crossing the frame, largest in the middle
+            size = 20 - abs(f - 20) // 2
+            video[f, 30:30 + size, 2 * f:2 * f + size, :] = 250
+
+        background = video[0].astype(np.float32)
+        chunks = [video[i:i + 8] for i in range(0, 40, 8)]
+        full = MotionScan(background, box_scale=1).scan(chunks)
+        scan = MotionScan(background, box_scale=1, keep_boxes=4, track=True).scan(chunks)
+
+        # the boxes of the four highest scoring frames are kept, and the tracker saw them all
+        boxes, frames = scan.motion_boxes
+        np.testing.assert_array_equal(sorted(frames), sorted(np.argsort(-full.frame_scores, kind='stable')[:4]))
+        np.testing.assert_array_equal(scan.boxes_in_frame(scan.best_index), full.boxes_in_frame(scan.best_index))
+        [track] = scan.tracker.tracks()
+        self.assertEqual((track.start_frame, track.end_frame, track.num_frames), (5, 34, 30))
+
+        halves = [MotionScan(background, start_index=s, box_scale=1, keep_boxes=4, track=True).scan([video[s:s + 8], video[s + 8:s + 20]])
+                  for s in [0, 20]]
+        merged = MotionScan.merge(halves)
+        np.testing.assert_array_equal(sorted(merged.motion_boxes[1]), sorted(frames))
+        self.assertEqual([(t.start_frame, t.end_frame) for t in merged.tracker.tracks()], [(5, 34)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from unittest import mock
+
+try:
+    import fakeredis
+    fakeredis.FakeRedis().eval('return 1', 0)
+except Exception:
+    # releasing a claim needs lua scripting, fakeredis[lua]
+    fakeredis = None
+
+from watcher.dedup import claim_event, release_event, event_claim_owner, event_claim
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with lua")
+class TestEventClaims(unittest.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+        patcher = mock.patch('watcher.dedup.redis_connection', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_claim_wins(self):
+        self.assertTrue(claim_event(self.connection, 'video', 'ev1', 'job-a', ttl=60))
+        self.assertFalse(claim_event(self.connection, 'video', 'ev1', 'job-b', ttl=60))
+        self.assertTrue(claim_event(self.connection, 'video', 'ev1', 'job-a', ttl=60))
+        self.assertTrue(claim_event(self.connection, 'prediction', 'ev1', 'job-b', ttl=60))
+        self.assertEqual(event_claim_owner(self.connection, 'video', 'ev1'), 'job-a')
+        self.assertLessEqual(self.connection.ttl('claim:video:ev1'), 60)
+
+    def test_release_only_own_claim(self):
+        claim_event(self.connection, 'video', 'ev1', 'job-a')
+        self.assertFalse(release_event(self.connection, 'video', 'ev1', 'job-b'))
+        self.assertTrue(release_event(self.connection, 'video', 'ev1', 'job-a'))
+        self.assertTrue(claim_event(self.connection, 'video', 'ev1', 'job-b'))
+
+    def test_duplicate_job_records_reason(self):
+        claim_event(self.connection, 'video', 'ev1', 'job-a')
+        job = mock.MagicMock(id='job-b', meta={})
+
+        with mock.patch('watcher.dedup.get_current_job', return_value=job):
+            with event_claim('video', 'ev1') as claimed:
+                self.assertFalse(claimed)
+
+        self.assertEqual(job.meta['duplicate'], {'stage': 'video', 'event_name': 'ev1', 'claimed_by': 'job-a'})
+        job.save_meta.assert_called_once()
+
+    def test_failure_releases_claim(self):
+        with mock.patch('watcher.dedup.get_current_job', return_value=mock.MagicMock(id='job-a')):
+            with self.assertRaises(RuntimeError):
+                with event_claim('prediction', 'ev1') as claimed:
+                    self.assertTrue(claimed)
+                    raise RuntimeError("model failed")
+            self.assertIsNone(event_claim_owner(self.connection, 'prediction', 'ev1'))
+
+            with event_claim('prediction', 'ev1') as claimed:
+                self.assertTrue(claimed)
+            self.assertEqual(event_claim_owner(self.connection, 'prediction', 'ev1'), 'job-a')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from watcher.frame_handoff import put_frames, get_frames, handoff_image
+from watcher.predict_still import prediction_inputs
+
+class TestHandoffImage(unittest.TestCase):
+    def test_downsized_to_classifier_input(self):
+        self.assertEqual(handoff_image(Image.new('RGB', (1920, 1080))).size, (818, 460))
+        self.assertEqual(handoff_image(Image.new('RGB', (300, 300))).size, (300, 300))
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis")
+class TestFrameHandoff(unittest.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+        self.frame = Image.fromarray(np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8))
+        self.crop = self.frame.crop((100, 100, 340, 340))
+
+    def test_round_trip(self):
+        keys = put_frames(self.connection, 'event1', [self.frame, self.crop], ttl=60)
+        self.assertEqual(keys, ['frame_handoff:event1:0', 'frame_handoff:event1:1'])
+        self.assertLessEqual(self.connection.ttl(keys[0]), 60)
+
+        frame, crop = get_frames(self.connection, keys)
+        self.assertEqual(frame.size, (613, 460))
+        np.testing.assert_array_equal(np.asarray(crop), np.asarray(self.crop))
+
+    def test_expired(self):
+        keys = put_frames(self.connection, 'event1', [self.frame, self.crop])
+        self.connection.delete(keys[1])
+        self.assertIsNone(get_frames(self.connection, keys))
+
+    @mock.patch('watcher.predict_still.application_flag', return_value=True)
+    def test_prediction_inputs(self, _):
+        keys = put_frames(self.connection, 'event1', [self.frame, self.crop])
+        with mock.patch('watcher.predict_still.redis_connection', return_value=self.connection):
+            inputs = prediction_inputs('missing.jpg', ['missing_c0.jpg'], keys)
+            self.assertEqual([img.size for img in inputs], [(240, 240)])
+
+            self.connection.delete(*keys)
+            with self.assertRaises(FileNotFoundError):
+                prediction_inputs('missing.jpg', ['missing_c0.jpg'], keys)
+
+if __name__ == '__main__':
+    unittest.main()
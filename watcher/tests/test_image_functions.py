@@ -0,0 +1,116 @@
+import io
+import unittest
+
+import numpy as np
+
+from watcher.image_functions import (read_frame_chunks, motion_scores, rescale, threshold_video, MotionMaskEngine, MotionScan,
+                                     top_peaks, encode_scores, decode_scores)
+
+def synthetic_video(num_frames=20, height=48, width=64, moving_frame=13):
+    rng = np.random.default_rng(0)
+    video = np.full((num_frames, height, width, 3), 100, dtype=np.uint8)
+    video += rng.integers(0, 3, size=video.shape, dtype=np.uint8)
+
+    # a small object wanders through the scene, and something big shows up once
+    for i in range(num_frames):
+        video[i, 40:44, 2*i:2*i+4, :] = 250
+    if moving_frame < num_frames:
+        video[moving_frame, 10:30, 20:45, :] = 250
+    return video
+
+class TestImageFunctions(unittest.TestCase):
+    def test_read_frame_chunks(self):
+        video = synthetic_video(num_frames=7)
+        stream = io.BytesIO(video.tobytes())
+
+        chunks = list(read_frame_chunks(stream, 64, 48, 3, chunk_size=3))
+        self.assertEqual([len(c) for c in chunks], [3, 3, 1])
+        np.testing.assert_array_equal(np.concatenate(chunks), video)
+
+    def test_read_grey_frame_chunks(self):
+        video = synthetic_video(num_frames=4)[:,:,:,0].copy()
+        chunks = list(read_frame_chunks(io.BytesIO(video.tobytes()), 64, 48, 1, chunk_size=10))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].shape, (4, 48, 64))
+
+    def test_motion_scores(self):
+        video = synthetic_video()
+        background = np.mean(video[0:5], axis=0, dtype=np.float32)
+
+        scores = motion_scores(video, background)
+        self.assertEqual(scores.shape, (20,))
+        self.assertEqual(np.argmax(scores), 13)
+
+    def test_grey_motion_scores(self):
+        video = synthetic_video()[:,:,:,1].copy()
+        background = np.mean(video[0:5], axis=0, dtype=np.float32)
+
+        scores = motion_scores(video, background)
+        self.assertEqual(scores.shape, (20,))
+        self.assertEqual(np.argmax(scores), 13)
+
+    def test_mask_engine_matches_threshold_video(self):
+        rng = np.random.default_rng(1)
+        engine = MotionMaskEngine()
+
+        for shape in [(6, 48, 64), (3, 31, 17), (6, 48, 64), (1, 20, 20)]:
+            norms = (rng.random(shape) ** 3 * 400).astype(np.float32)
+            expected = threshold_video(rescale(norms))
+
+            np.testing.assert_array_equal(engine.mask(norms), expected)
+            np.testing.assert_array_equal(engine.sums(shape[0]), np.sum(expected, axis=(1,2)))
+
+    def test_mask_engine_flat_chunk(self):
+        engine = MotionMaskEngine()
+        mask = engine.mask(np.full((3, 10, 10), 7, dtype=np.float32))
+        self.assertEqual(np.count_nonzero(mask), 0)
+
+    def test_scan_keeps_best_frame(self):
+        video = synthetic_video(num_frames=23, moving_frame=17)
+        chunks = (video[i:i+5] for i in range(0, len(video), 5))
+
+        scan = MotionScan().scan(chunks)
+        self.assertEqual(scan.num_frames, 23)
+        self.assertEqual(scan.best_index, 17)
+        np.testing.assert_array_equal(scan.best_frame, video[17])
+    def test_merge_segment_scans(self):
+        video = synthetic_video(num_frames=30, moving_frame=22)
+        background = np.mean(video[0:5], axis=0, dtype=np.float32)
+
+        scans = []
+        for start in range(0, 30, 10):
+            segment = video[start:start+10]
+            scan = MotionScan(background=background, start_index=start)
+            scans.append(scan.scan([segment[0:5], segment[5:10]]))
+
+        merged = MotionScan.merge(scans)
+        self.assertEqual(merged.num_frames, 30)
+        self.assertEqual(merged.best_index, 22)
+        np.testing.assert_array_equal(merged.best_frame, video[22])
+
+        self.assertEqual(merged.frame_scores.shape, (30,))
+        self.assertEqual(np.argmax(merged.frame_scores), 22)
+
+    def test_frame_scores(self):
+        video = synthetic_video()
+        scan = MotionScan().scan([video[0:8], video[8:16], video[16:20]])
+
+        scores = scan.frame_scores
+        self.assertEqual(scores.shape, (20,))
+        self.assertTrue(((scores >= 0) & (scores <= 1)).all())
+        self.assertEqual(np.argmax(scores), 13)
+
+    def test_top_peaks(self):
+        scores = np.array([0, .1, .5, .6, .55, 0, 0, .3, .2, 0, .4, 0])
+        self.assertEqual(top_peaks(scores, k=3, min_separation=3), [3, 10, 7])
+        self.assertEqual(top_peaks(scores, k=2, min_separation=1), [3, 4])
+        self.assertEqual(top_peaks(np.zeros(5), k=3), [])
+
+    def test_encode_scores(self):
+        scores = np.array([0, 0.001, 0.25, 1.0], np.float32)
+        encoded = encode_scores(scores)
+        self.assertIsInstance(encoded, str)
+        np.testing.assert_allclose(decode_scores(encoded), scores, rtol=1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
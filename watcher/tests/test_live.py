@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from watcher.live import FrameRing, BackgroundRing, LiveMotionEngine, RECONNECT_SECONDS, DEFAULT_FRAME_RATE
+
+class TestLive(unittest.TestCase):
+    def test_frame_ring(self):
+        ring = FrameRing(3, (2,))
+        for i in range(5):
+            ring.push([i, i])
+        self.assertEqual(len(ring), 3)
+        self.assertEqual([int(f[0]) for f in ring.ordered()], [2, 3, 4])
+
+    def test_background_ring_mean(self):
+        ring = BackgroundRing(3, (2, 2))
+        for value in [10, 20, 30, 40, 50]:
+            ring.push(np.full((2, 2), value, np.uint8))
+        np.testing.assert_array_equal(ring.image, np.full((2, 2), 40))
+        np.testing.assert_array_equal(ring.total, np.full((2, 2), 120))
+
+    def test_defaults_without_live_section(self):
+        def no_live_section(section, key):
+            raise KeyError(section)
+
+        with mock.patch('watcher.live.application_config', side_effect=no_live_section):
+            engine = LiveMotionEngine('rtsp://camera', 'yard')
+        self.assertEqual(engine.frame_rate, DEFAULT_FRAME_RATE)
+
+    def test_waits_after_failed_read(self):
+        engine = LiveMotionEngine('rtsp://camera', 'yard')
+        capture = mock.MagicMock()
+        capture.isOpened.return_value = True
+        capture.read.return_value = (False, None)
+        engine.stopped = mock.MagicMock()
+        engine.stopped.is_set.side_effect = [False, True]
+
+        with mock.patch('watcher.live.cv.VideoCapture', return_value=capture):
+            engine.read_frames()
+        engine.stopped.wait.assert_called_once_with(RECONNECT_SECONDS)
+        self.assertEqual(engine.frames_read, 0)
+
+    @mock.patch('watcher.live.live_config', return_value='')
+    def test_event_start_and_end(self, _):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        os.environ['WATCHER_SYSTEM_LOCAL_DATA_DIR'] = data_dir.name
+        self.addCleanup(os.environ.pop, 'WATCHER_SYSTEM_LOCAL_DATA_DIR')
+
+        engine = LiveMotionEngine('rtsp://camera', 'yard')
+        engine.open_clip = mock.MagicMock()
+        engine.publish_event_start = mock.MagicMock()
+        engine.publish_event_end = mock.MagicMock()
+
+        frame = np.full((240, 320, 3), 60, np.uint8)
+        moving = frame.copy()
+        moving[100:180, 100:200] = 250
+
+        t = 1700000000.0
+        for i in range(10):
+            engine.process(frame, t + i / 15)
+        for i in range(10, 20):
+            engine.process(moving, t + i / 15)
+        self.assertEqual(engine.publish_event_start.call_count, 1)
+
+        event = engine.publish_event_start.call_args.args[0]
+        self.assertTrue(event['event_name'].endswith('_yard_1'))
+        self.assertTrue(event['video_fullpath'].endswith(f"{event['event_name']}.mp4"))
+
+        writer = engine.open_clip.return_value
+        # the pre-capture frames are written along with the one that started the event
+        self.assertEqual(writer.write.call_count, engine.pre_capture + 1 + 7)
+
+        for i in range(20, 200):
+            engine.process(frame, t + i / 15)
+        engine.publish_event_end.assert_called_once_with(event['event_name'])
+        writer.release.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import time
+import unittest
+
+from unittest import mock
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from watcher.metrics import (TaskMetrics, instrumented, set_outcome, count_bytes, timed_decode,
+                             record_metrics, read_totals, read_window, prometheus_text, SLOT_SECONDS)
+
+def finished(task, run, outcome='ok', queue_wait=None, decode=0.0, count=0):
+    m = TaskMetrics(task)
+    m.run, m.outcome, m.queue_wait, m.decode, m.bytes = run, outcome, queue_wait, decode, count
+    return m
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis")
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+
+    def test_window_sums_minutes(self):
+        now = 1_000_000 * SLOT_SECONDS
+        record_metrics(self.connection, [finished('task_write_image', 0.02)], at=now - 5 * SLOT_SECONDS)
+        record_metrics(self.connection, [finished('task_write_image', 0.3, count=2048)], at=now)
+        record_metrics(self.connection, [finished('task_write_image', 7.0)], at=now - 20 * SLOT_SECONDS)
+
+        totals = read_window(self.connection, window=10 * SLOT_SECONDS, at=now)
+        self.assertEqual(totals['task_write_image|outcome|ok'], 2)
+        self.assertAlmostEqual(totals['task_write_image|run_seconds|sum'], 0.32)
+        self.assertEqual(totals['task_write_image|bytes|sum'], 2048)
+
+    def test_totals_outlast_the_window(self):
+        record_metrics(self.connection, [finished('task_write_image', 0.02)])
+        record_metrics(self.connection, [finished('task_write_image', 7.0, count=2048)])
+        for key in self.connection.keys('metrics:*'):
+            if key != b'metrics:total':
+                self.connection.delete(key)
+
+        self.assertEqual(read_window(self.connection), {})
+        totals = read_totals(self.connection)
+        self.assertEqual(totals['task_write_image|outcome|ok'], 2)
+        self.assertAlmostEqual(totals['task_write_image|run_seconds|sum'], 7.02)
+        self.assertEqual(totals['task_write_image|bytes|sum'], 2048)
+
+    def test_prometheus_text(self):
+        record_metrics(self.connection, [
+            finished('task_predict_still', 0.02, queue_wait=3.0, decode=0.004),
+            finished('task_predict_still', 0.3, outcome='duplicate'),
+            finished('task_record_event', 0.001, count=900),
+        ])
+        record_metrics(self.connection, [finished('task_predict_still', 2.0)], at=time.time() - 7200)
+        text = prometheus_text(read_totals(self.connection), read_window(self.connection, window=3600), window=3600)
+
+        self.assertIn("# TYPE watcher_task_run_seconds histogram", text)
+        self.assertIn('watcher_task_run_seconds_bucket{task="task_predict_still",le="0.01"} 0', text)
+        self.assertIn('watcher_task_run_seconds_bucket{task="task_predict_still",le="0.025"} 1', text)
+        self.assertIn('watcher_task_run_seconds_bucket{task="task_predict_still",le="0.5"} 2', text)
+        self.assertIn('watcher_task_run_seconds_bucket{task="task_predict_still",le="+Inf"} 3', text)
+        self.assertIn('watcher_task_run_seconds_count{task="task_predict_still"} 3', text)
+        self.assertIn('watcher_task_queue_wait_seconds_count{task="task_predict_still"} 1', text)
+        self.assertIn('watcher_task_bytes_bucket{task="task_record_event",le="1000"} 1', text)
+        self.assertIn('watcher_task_bytes_sum{task="task_record_event"} 900', text)
+        self.assertNotIn('watcher_task_bytes_count{task="task_predict_still"}', text)
+        self.assertIn("# TYPE watcher_task_outcomes_total counter", text)
+        self.assertIn('watcher_task_outcomes_total{task="task_predict_still",outcome="duplicate"} 1', text)
+        self.assertIn('watcher_task_outcomes_total{task="task_predict_still",outcome="ok"} 2', text)
+
+        # the window leaves out the run two hours ago, and isn't typed as a histogram
+        self.assertIn("# TYPE watcher_task_run_seconds_recent gauge", text)
+        self.assertIn('watcher_task_run_seconds_recent{task="task_predict_still",le="+Inf"} 2', text)
+        self.assertIn('watcher_task_run_seconds_recent_sum{task="task_predict_still"} 0.32', text)
+        self.assertIn('watcher_task_outcomes_recent{task="task_predict_still",outcome="ok"} 1', text)
+        self.assertNotIn('watcher_task_run_seconds_recent_bucket', text)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_instrumented_task(self):
+        @instrumented('task_example')
+        def task_example(chunks, skip=False):
+            count_bytes(100)
+            for _ in timed_decode(chunks):
+                pass
+            if skip:
+                set_outcome('duplicate')
+
+        def slow_chunks():
+            for i in range(2):
+                time.sleep(0.01)
+                yield i
+
+        @instrumented('task_failing')
+        def task_failing():
+            raise ValueError("broken")
+
+        with mock.patch('watcher.metrics.redis_connection', return_value=self.connection):
+            task_example(slow_chunks())
+            task_example([], skip=True)
+            with self.assertRaises(ValueError):
+                task_failing()
+
+        totals = read_window(self.connection)
+        self.assertEqual(totals['task_example|outcome|ok'], 1)
+        self.assertEqual(totals['task_example|outcome|duplicate'], 1)
+        self.assertEqual(totals['task_failing|outcome|error'], 1)
+        self.assertEqual(totals['task_example|bytes|sum'], 200)
+        self.assertGreaterEqual(totals['task_example|decode_seconds|sum'], 0.02)
@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+
+from watcher.noise import noise_features, noise_confidence, EVIDENCE_WEIGHTS
+from watcher.video import DEFAULT_NOISE_CONFIDENCE
+
+def track(start, end, peak_area=400):
+    return {'path': [[0] + list(start), [10] + list(end)], 'peak_area': peak_area}
+
+class TestNoise(unittest.TestCase):
+    def setUp(self):
+        self.scores = np.zeros(60, np.float32)
+        self.scores[20:40] = np.hanning(20) * 0.05
+
+    def test_animal_is_not_noise(self):
+        features = noise_features(self.scores, [[100, 100, 60, 40]], (640, 480), [track((100, 100), (300, 120))], 20)
+        self.assertLess(noise_confidence(features), 0.2)
+
+    def test_no_single_feature_is_enough(self):
+        for name in EVIDENCE_WEIGHTS:
+            features = {other: 1.0 if other == name else 0.0 for other in EVIDENCE_WEIGHTS}
+            self.assertLess(noise_confidence(features), DEFAULT_NOISE_CONFIDENCE - 0.05, name)
+
+    def test_close_up_animal_is_not_noise(self):
+        # one large peak, as an animal walking right past the camera covers half the frame
+        scores = np.zeros(60, np.float32)
+        scores[15:45] = np.hanning(30) * 0.55
+        features = noise_features(scores, [[50, 40, 500, 380]], (640, 480), [track((100, 100), (300, 120))], 40)
+        self.assertEqual(features['global_change'], 1)
+        self.assertLess(noise_confidence(features), DEFAULT_NOISE_CONFIDENCE)
+
+    def test_steady_animal_is_not_noise(self):
+        # an animal crossing at a steady size keeps the motion level flat all through the clip
+        scores = np.full(60, 0.04, np.float32)
+        features = noise_features(scores, [[100, 100, 60, 40]], (640, 480), [track((50, 100), (500, 120))], 40)
+        self.assertEqual(features['persistent'], 1)
+        self.assertLess(noise_confidence(features), DEFAULT_NOISE_CONFIDENCE)
+
+    def test_animal_sitting_still_is_not_noise(self):
+        # close up and hardly moving: persistent and much of the frame, with some sensor noise, but
+        # what was tracked is large, not a flicker
+        scores = np.full(60, 0.5, np.float32)
+        features = noise_features(scores, [[50, 40, 500, 380]], (640, 480), [track((100, 100), (102, 100), 500 * 380)], 40)
+        self.assertEqual((features['persistent'], features['stationary'], features['global_change']), (1, 0, 1))
+        self.assertLess(noise_confidence(features), DEFAULT_NOISE_CONFIDENCE - 0.1)
+
+    def test_small_animal_sitting_still_is_not_noise(self):
+        # persistent and stationary, a small animal grooming in place, well short of noise
+        scores = np.full(60, 0.03, np.float32)
+        features = noise_features(scores, [[300, 200, 60, 40]], (640, 480), [track((330, 220), (333, 221), 60 * 40)], 40)
+        self.assertEqual((features['persistent'], features['stationary']), (1, 1))
+        self.assertLess(noise_confidence(features), DEFAULT_NOISE_CONFIDENCE - 0.1)
+
+    def test_lights_switching(self):
+        scores = np.zeros(60, np.float32)
+        scores[30] = 0.8
+        features = noise_features(scores, [[0, 20, 640, 460]], (640, 480), [])
+        self.assertEqual(features['global_change'], 1)
+        self.assertGreater(noise_confidence(features), 0.7)
+
+    def test_rain(self):
+        rng = np.random.default_rng(0)
+        scores = 0.02 + rng.random(60).astype(np.float32) * 0.005
+        boxes = [[x, y, 6, 6] for x, y in rng.integers(0, 400, size=(10, 2))]
+        tracks = [track((x, y), (x + 2, y + 1)) for x, y, _, _ in boxes[:3]]
+
+        features = noise_features(scores, boxes, (640, 480), tracks, 48)
+        self.assertGreater(features['persistent'], 0.9)
+        self.assertGreater(features['scattered'], 0.5)
+        self.assertGreaterEqual(noise_confidence(features), 0.9)
+
+    def test_nothing_found(self):
+        features = noise_features(np.zeros(60), [], (640, 480), [])
+        self.assertEqual(features['no_motion'], 1)
+        self.assertEqual(features['stationary'], 0)
+        self.assertAlmostEqual(noise_confidence(features), EVIDENCE_WEIGHTS['no_motion'])
+
+if __name__ == '__main__':
+    unittest.main()
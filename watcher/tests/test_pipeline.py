@@ -0,0 +1,38 @@
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+from watcher.video import EventFrames
+from watcher.pipeline import task_process_event, prediction_groups
+
+def event_frames():
+    found = EventFrames()
+    found.img = Image.new('RGB', (64, 48))
+    found.img_relpath = Path('scene/ev_f10.jpg')
+    crop = found.img.crop((0, 0, 24, 24))
+    found.crops = [(Path('scene/ev_f10_c0.jpg'), crop, [0, 0, 24, 24])]
+    other = Image.new('RGB', (64, 48), (255, 0, 0))
+    found.ensemble = [(20, Path('scene/ev_f20.jpg'), other, [])]
+    return found, crop, other
+
+class TestFusedPipeline(unittest.TestCase):
+    def test_prediction_groups(self):
+        found, crop, other = event_frames()
+        self.assertEqual(prediction_groups(found), [[crop], [other]])
+        self.assertEqual(prediction_groups(found, use_crops=False), [[found.img], [other]])
+
+    def test_images(self):
+        found, crop, other = event_frames()
+        self.assertEqual([str(f) for f, _ in found.images()], ['scene/ev_f10.jpg', 'scene/ev_f10_c0.jpg', 'scene/ev_f20.jpg'])
+
+    @mock.patch('watcher.pipeline.queue_event_stages')
+    @mock.patch('watcher.pipeline.lazy_load_model', side_effect=ImportError("No module named 'onnxruntime'"))
+    def test_falls_back_to_queues(self, _, queue_event_stages):
+        task_process_event('ev')
+        queue_event_stages.assert_called_once_with('ev', None)
+
+if __name__ == '__main__':
+    unittest.main()
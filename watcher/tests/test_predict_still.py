@@ -0,0 +1,64 @@
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from watcher.predict_still import predict_ensembles, ensemble_result
+
+class FixedModel(object):
+    name = 'fixed.onnx'
+    vocab = ['cat', 'person']
+    thresh = 0.5
+
+    def __init__(self, probabilities):
+        self.table = probabilities
+        self.calls = 0
+
+    def probabilities(self, img_files):
+        self.calls += 1
+        return np.array([self.table[f] for f in img_files], dtype=np.float32)
+
+class TestEnsemblePrediction(unittest.TestCase):
+    def setUp(self):
+        self.model = FixedModel({
+            'f1_c0.jpg': [0.2, 0.1],
+            'f1_c1.jpg': [0.4, 0.3],
+            'f2.jpg': [0.9, 0.0],
+            'f3.jpg': [0.6, 0.2],
+        })
+        patches = [
+            mock.patch('watcher.predict_still.lazy_load_model', return_value=(self.model, self.model.name)),
+            mock.patch('watcher.predict_still.cached_probabilities', side_effect=lambda m, files: m.probabilities(files)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_combine_in_one_pass(self):
+        ensembles = [[['f1_c0.jpg', 'f1_c1.jpg'], ['f2.jpg']], [['f3.jpg']]]
+
+        (lbl, frame_probs), (single, _) = predict_ensembles(ensembles, 'max')
+        self.assertEqual(self.model.calls, 1)
+        np.testing.assert_allclose(frame_probs, [[0.4, 0.3], [0.9, 0.0]])
+        np.testing.assert_allclose(lbl.probabilities, [0.9, 0.3])
+        self.assertEqual(lbl.labels, ['cat'])
+        self.assertEqual(single.labels, ['cat'])
+
+        [(mean, _)] = predict_ensembles(ensembles[0:1], 'mean')
+        np.testing.assert_allclose(mean.probabilities, [0.65, 0.15])
+
+        with self.assertRaises(ValueError):
+            predict_ensembles(ensembles, 'median')
+
+    def test_contributions(self):
+        [(_, frame_probs)] = predict_ensembles([[['f3.jpg'], ['f2.jpg']]])
+        ir = ensemble_result('f3.jpg', [{'frame': 12, 'file': 'f2.jpg', 'crops': []}], 'max', frame_probs)
+
+        self.assertEqual(ir.step, 'task_predict_still')
+        self.assertEqual([f['file'] for f in ir.info['frames']], ['f3.jpg', 'f2.jpg'])
+        self.assertEqual(ir.info['frames'][1]['frame'], 12)
+        self.assertEqual(ir.info['frames'][1]['probabilities'], [0.9, 0.0])
+
+if __name__ == '__main__':
+    unittest.main()
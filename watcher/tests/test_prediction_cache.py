@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from watcher import prediction_cache
+from watcher.prediction_cache import PredictionCache, content_digest, cache_name, cached_probabilities
+
+class CountingModel(object):
+    name = 'counting.onnx'
+
+    def __init__(self, digest=None):
+        self.digest = digest
+        self.seen = []
+
+    def probabilities(self, img_files):
+        self.seen.extend(img_files)
+        return np.array([[len(Path(f).read_bytes()) / 10, 0.5] for f in img_files], dtype=np.float32)
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis")
+class TestPredictionCache(unittest.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+        prediction_cache._current.clear()
+
+    def still(self, name, content):
+        path = Path(self.dir.name) / name
+        path.write_bytes(content)
+        return path
+
+    def test_digest_is_by_content(self):
+        self.assertEqual(content_digest(self.still('a.jpg', b'same')), content_digest(self.still('b.jpg', b'same')))
+        self.assertNotEqual(content_digest(self.still('a.jpg', b'same')), content_digest(self.still('c.jpg', b'other')))
+
+    def test_hits_and_misses(self):
+        cache = PredictionCache(self.connection, 'model')
+        self.assertEqual(cache.get_many(['a', 'b']), {})
+
+        cache.put_many({'a': np.array([0.25, 0.75])})
+        found = cache.get_many(['a', 'b'])
+        np.testing.assert_array_equal(found['a'], [0.25, 0.75])
+        self.assertNotIn('b', found)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 3, 1))
+        self.assertEqual(PredictionCache(self.connection, 'other model').get_many(['a']), {})
+
+    def test_evicts_least_recently_used(self):
+        cache = PredictionCache(self.connection, 'model', max_entries=2)
+        with mock.patch('watcher.prediction_cache.time') as clock:
+            clock.time.side_effect = [1, 2, 3, 4]
+            cache.put_many({'a': [0.1]})
+            cache.put_many({'b': [0.2]})
+            cache.get_many(['a'])
+            cache.put_many({'c': [0.3]})
+
+        self.assertEqual(set(cache.get_many(['a', 'b', 'c'])), {'a', 'c'})
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_cached_probabilities(self):
+        model = CountingModel()
+        files = [self.still('a.jpg', b'12345'), self.still('b.jpg', b'123')]
+
+        with mock.patch('watcher.prediction_cache.redis_connection', return_value=self.connection):
+            first = cached_probabilities(model, files)
+            again = cached_probabilities(model, [self.still('rerun.jpg', b'123')] + files)
+
+        np.testing.assert_allclose(first, [[0.5, 0.5], [0.3, 0.5]])
+        np.testing.assert_allclose(again, [[0.3, 0.5], [0.5, 0.5], [0.3, 0.5]])
+        self.assertEqual(model.seen, files)
+
+    def test_new_model_under_same_name_starts_a_new_cache(self):
+        old, new = CountingModel('a' * 64), CountingModel('b' * 64)
+        self.assertNotEqual(cache_name(old), cache_name(new))
+        files = [self.still('a.jpg', b'12345')]
+
+        with mock.patch('watcher.prediction_cache.redis_connection', return_value=self.connection):
+            cached_probabilities(old, files)
+            self.assertEqual(PredictionCache(self.connection, cache_name(old)).stats()['entries'], 1)
+
+            prediction_cache._current.clear()  # as in a worker restarted with the new model
+            cached_probabilities(new, files)
+
+        self.assertEqual(new.seen, files)
+        self.assertEqual(PredictionCache(self.connection, cache_name(old)).stats()['entries'], 0)
+        self.assertEqual(PredictionCache(self.connection, cache_name(new)).stats()['entries'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
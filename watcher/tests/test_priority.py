@@ -0,0 +1,76 @@
+import unittest
+
+from unittest import mock
+
+from rq import Queue, Retry
+from rq.job import Job
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from watcher.priority import queue_for, queues_by_priority, reroute_job
+
+class TestPriorityQueues(unittest.TestCase):
+    def test_tiers(self):
+        self.assertEqual(queue_for('prediction', 'daylight'), 'prediction')
+        self.assertEqual(queue_for('prediction', 'twilight'), 'prediction')
+        self.assertEqual(queue_for('prediction', None), 'prediction')
+        self.assertEqual(queue_for('prediction', 'night'), 'prediction_low')
+
+    def test_worker_order(self):
+        self.assertEqual(queues_by_priority('event_video'), ['event_video', 'event_video_low'])
+        self.assertEqual(queues_by_priority('a', 'b'), ['a', 'b', 'a_low', 'b_low'])
+
+    @mock.patch('watcher.priority.application_flag', return_value=False)
+    def test_disabled(self, _):
+        self.assertEqual(queue_for('prediction', 'night'), 'prediction')
+        self.assertEqual(queues_by_priority('event_video'), ['event_video'])
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis")
+class TestReroute(unittest.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+        self.queue = Queue('event_video', connection=self.connection)
+
+    def test_night_job_moves_down(self):
+        job = self.queue.enqueue('watcher.video.task_save_significant_frame', 'ev1', retry=Retry(max=3, interval=10))
+
+        self.assertTrue(reroute_job(job, self.connection, lambda: 'night'))
+
+        low = Queue('event_video_low', connection=self.connection)
+        [moved] = low.jobs
+        self.assertEqual((moved.func_name, moved.args), ('watcher.video.task_save_significant_frame', ('ev1',)))
+        self.assertEqual(moved.retries_left, 3)
+        self.assertEqual(job.meta['rerouted']['queue'], 'event_video_low')
+
+    def test_job_options_move_with_it(self):
+        first = self.queue.enqueue('os.path.basename', 'a/b')
+        job = self.queue.enqueue('watcher.video.task_save_significant_frame', 'ev1', depends_on=first,
+                                 job_timeout=900, result_ttl=60, retry=Retry(max=2, interval=[5, 30]))
+
+        self.assertTrue(reroute_job(job, self.connection, lambda: 'night'))
+
+        moved = Job.fetch(job.meta['rerouted']['job_id'], connection=self.connection)
+        self.assertEqual(moved.origin, 'event_video_low')
+        self.assertEqual(moved.dependency_ids, [first.id])
+        self.assertEqual(moved.get_status(), 'deferred')
+        self.assertEqual((moved.timeout, moved.result_ttl), (900, 60))
+        self.assertEqual((moved.retries_left, moved.retry_intervals), (2, [5, 30]))
+
+    def test_day_job_stays(self):
+        job = self.queue.enqueue('watcher.video.task_save_significant_frame', 'ev1')
+        self.assertFalse(reroute_job(job, self.connection, lambda: 'daylight'))
+        self.assertEqual(Queue('event_video_low', connection=self.connection).count, 0)
+
+    def test_low_job_not_looked_up(self):
+        job = Queue('event_video_low', connection=self.connection).enqueue('watcher.video.task_save_significant_frame', 'ev1')
+        lighting_of = mock.MagicMock(return_value='night')
+
+        self.assertFalse(reroute_job(job, self.connection, lighting_of))
+        self.assertFalse(reroute_job(None, self.connection, lighting_of))
+        lighting_of.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
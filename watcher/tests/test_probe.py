@@ -0,0 +1,76 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from fractions import Fraction
+from unittest import mock
+
+from watcher.probe import parse_mp4, probe_video, VideoInfo
+
+def box(kind, *children):
+    payload = b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+def full_box(kind, body, version=0):
+    return box(kind, struct.pack('>I', version << 24), body)
+
+def track(handler, width=0, height=0, timescale=15360, duration=153600, samples=150, mdhd_version=0):
+    if mdhd_version == 1:
+        mdhd = full_box(b'mdhd', struct.pack('>QQIQ', 0, 0, timescale, duration) + bytes(4), 1)
+    else:
+        mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, duration) + bytes(4))
+    entry = box(b'avc1', bytes(24), struct.pack('>HH', width, height), bytes(50))
+    stbl = box(b'stbl',
+               full_box(b'stsd', struct.pack('>I', 1) + entry),
+               full_box(b'stsz', struct.pack('>II', 0, samples)))
+    return box(b'trak',
+               full_box(b'tkhd', bytes(80)),
+               box(b'mdia', mdhd,
+                   full_box(b'hdlr', struct.pack('>I4s', 0, handler) + bytes(12)),
+                   box(b'minf', stbl)))
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, *boxes):
+        path = os.path.join(self.dir.name, 'clip.mp4')
+        with open(path, 'wb') as f:
+            f.write(b''.join(boxes))
+        return path
+
+    def test_parse_mp4(self):
+        # motion writes moov after mdat; the audio track comes first to check handler filtering
+        path = self.write(box(b'ftyp', b'isom'), box(b'mdat', bytes(1000)),
+                          box(b'moov', track(b'soun'), track(b'vide', 320, 240)))
+
+        info = parse_mp4(path)
+        self.assertEqual(info, VideoInfo(320, 240, 150, 10.0, Fraction(15)))
+
+    def test_parse_mp4_version_1(self):
+        path = self.write(box(b'moov', track(b'vide', 64, 48, 1000, 2000, 30, mdhd_version=1)))
+        self.assertEqual(parse_mp4(path).frame_rate, Fraction(15))
+
+    def test_parse_mp4_unfinished(self):
+        path = self.write(box(b'ftyp', b'isom'), box(b'mdat', bytes(1000)))
+        with self.assertRaises(ValueError):
+            parse_mp4(path)
+
+    @mock.patch('watcher.probe.application_flag', return_value=False)
+    @mock.patch('watcher.probe.ffprobe_video')
+    def test_probe_once_per_file_version(self, ffprobe_video, _):
+        path = self.write(box(b'moov', track(b'vide', 320, 240)))
+        ffprobe_video.return_value = VideoInfo(320, 240, 150, 10.0, Fraction(15))
+
+        self.assertEqual(probe_video(path).width, 320)
+        self.assertEqual(probe_video(path).num_frames, 150)
+        self.assertEqual(ffprobe_video.call_count, 1)
+
+        with open(path, 'ab') as f:
+            f.write(box(b'free'))
+        probe_video(path)
+        self.assertEqual(ffprobe_video.call_count, 2)
@@ -0,0 +1,99 @@
+import json
+import tempfile
+import unittest
+
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+try:
+    import onnx
+    import onnxruntime
+    from onnx import helper, numpy_helper, TensorProto
+except ImportError:
+    onnx = None
+
+from watcher.still_model import OnnxStillModel, quantize_onnx, quantized_file, read_vocab, accuracy_report
+
+def write_toy_model(directory):
+    """A stand-in classifier: the mean of each colour channel, weighted into two labels."""
+    weights = numpy_helper.from_array(np.array([[0.02, -0.02], [0, 0.01], [-0.01, 0]], np.float32), 'W')
+    axes = numpy_helper.from_array(np.array([2, 3], np.int64), 'axes')
+    graph = helper.make_graph([
+            helper.make_node('ReduceMean', ['image', 'axes'], ['mean'], keepdims=0),
+            helper.make_node('MatMul', ['mean', 'W'], ['logits']),
+            helper.make_node('Sigmoid', ['logits'], ['probabilities'])],
+        'toy',
+        [helper.make_tensor_value_info('image', TensorProto.FLOAT, ['batch', 3, 460, 460])],
+        [helper.make_tensor_value_info('probabilities', TensorProto.FLOAT, ['batch', 2])],
+        [weights, axes])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 18)])
+    model.ir_version = 9
+
+    model_file = Path(directory) / 'toy.onnx'
+    onnx.save(model, model_file)
+    with open(model_file.with_suffix('.json'), 'w') as f:
+        json.dump({'vocab': ['red', 'blue'], 'thresh': 0.5, 'resize': 460}, f)
+    return model_file
+
+@unittest.skipIf(onnx is None, "needs onnx and onnxruntime")
+class TestOnnxStillModel(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.model = OnnxStillModel(write_toy_model(self.dir.name))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_centre_crop(self):
+        img = Image.new('RGB', (640, 480), (0, 0, 0))
+        img.paste((255, 255, 255), (80, 0, 560, 480))
+        img.save(Path(self.dir.name) / 'wide.png')
+
+        pixels = self.model.preprocess(Path(self.dir.name) / 'wide.png')
+        self.assertEqual(pixels.shape, (3, 460, 460))
+        # only the crop's own edges blend with the black outside it
+        self.assertEqual(pixels[:, :, 2:-2].min(), 255)
+
+    def stills(self):
+        files = []
+        for name, colour in [('red', (250, 10, 10)), ('blue', (10, 10, 250))]:
+            files.append(Path(self.dir.name) / f"{name}.png")
+            Image.new('RGB', (320, 240), colour).save(files[-1])
+        return files
+
+    def test_probabilities(self):
+        files = self.stills()
+        probs = self.model.probabilities(files)
+        self.assertEqual(probs.shape, (2, 2))
+        np.testing.assert_array_equal(probs > self.model.thresh, [[True, False], [False, False]])
+
+    def test_read_vocab(self):
+        self.assertEqual(read_vocab(Path(self.dir.name) / 'toy.onnx'), self.model.vocab)
+        self.assertIsNone(read_vocab(Path(self.dir.name) / 'missing.onnx'))
+
+    def test_quantize(self):
+        files = self.stills()
+        onnx_file = Path(self.dir.name) / 'toy.onnx'
+
+        for mode in ['dynamic', 'static']:
+            out_file = quantize_onnx(onnx_file, mode, calibration_files=files)
+            self.assertEqual(out_file, quantized_file(onnx_file, mode))
+            self.assertEqual(out_file.name, f"toy.int8-{mode}.onnx")
+
+            quantized = OnnxStillModel(out_file)
+            self.assertEqual(quantized.sidecar['quantization'], mode)
+            np.testing.assert_allclose(quantized.probabilities(files), self.model.probabilities(files), atol=0.05)
+
+    def test_accuracy_report(self):
+        files = self.stills()
+        report = accuracy_report({'float32': self.model}, [(files[0], 'red'), (files[1], 'red & blue')])
+
+        self.assertEqual(report['float32']['images'], 2)
+        self.assertEqual(report['float32']['exact_match'], 0.5)
+        self.assertEqual(report['float32']['agreement'], 1.0)
+        self.assertEqual(report['float32']['labels']['red'], {'precision': 1.0, 'recall': 0.5, 'support': 2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from watcher.tracking import Tracker, Track, box_iou
+
+class TestTracking(unittest.TestCase):
+    def test_box_iou(self):
+        iou = box_iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 10, 10], [20, 20, 5, 5]])
+        np.testing.assert_allclose(iou, [[1, 50 / 150, 0]])
+
+    def test_crossing_objects(self):
+        boxes, frames = [], []
+        for f in range(60):
+            boxes.append([f * 3, 50, 20, 20])
+            frames.append(f)
+            if 10 <= f < 40:
+                boxes.append([200 - f * 2, 100, 30, 30])
+                frames.append(f)
+        # a single flicker shouldn't become a track
+        boxes.append([0, 200, 20, 20])
+        frames.append(30)
+
+        tracks = Tracker().track(boxes, frames).tracks()
+        self.assertEqual([(t.start_frame, t.end_frame, t.num_frames) for t in tracks], [(0, 59, 60), (10, 39, 30)])
+        self.assertEqual(tracks[1].peak_area, 900)
+
+        path = tracks[0].as_dict()['path']
+        self.assertEqual(path[0], [0, 10, 60])
+        self.assertEqual(path[-1], [59, 187, 60])
+
+    def test_join_segments(self):
+        boxes, frames = [], []
+        for f in range(60):
+            boxes.append([f * 3, 50, 20, 20])
+            frames.append(f)
+            if 10 <= f < 40:
+                boxes.append([200 - f * 2, 100, 30, 30])
+                frames.append(f)
+        boxes.append([300, 200, 20, 20])
+        frames.append(45)
+        boxes, frames = np.array(boxes), np.array(frames)
+
+        whole = Tracker().track(boxes, frames).tracks(min_frames=1)
+        segments = [Tracker().track(boxes[(frames >= s) & (frames < s + 25)], frames[(frames >= s) & (frames < s + 25)])
+                    for s in [0, 25, 50]]
+        joined = Tracker.merge(segments).tracks(min_frames=1)
+
+        self.assertEqual([(t.track_id, t.start_frame, t.end_frame, t.num_frames, t.peak_area) for t in joined],
+                         [(t.track_id, t.start_frame, t.end_frame, t.num_frames, t.peak_area) for t in whole])
+        self.assertEqual(joined[0].as_dict()['path'][-1], [59, 187, 60])
+
+    def test_gap_closes_track(self):
+        tracker = Tracker(max_gap=3)
+        tracker.track([[10, 10, 20, 20]] * 6, [0, 1, 2, 3, 10, 11])
+        self.assertEqual([(t.start_frame, t.end_frame) for t in tracker.tracks(min_frames=1)], [(0, 3), (10, 11)])
+
+    def test_path_is_bounded(self):
+        track = Track(0, 0, [0, 0, 10, 10], max_path_points=8)
+        for f in range(1, 1000):
+            track.add(f, [f, 0, 10, 10])
+
+        path = track.as_dict()['path']
+        self.assertLessEqual(len(path), 9)
+        self.assertEqual(path[0][0], 0)
+        self.assertEqual(path[-1][0], 999)
+        self.assertEqual([p[0] for p in path], sorted(p[0] for p in path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+
+from watcher.video import EventVideo, EventFrames
+from watcher.noise import NOISE_LABEL
+
+def event_video_with_frames(num_frames=60, peak=33):
+    video = np.full((num_frames, 48, 64, 3), 100, dtype=np.uint8)
+    for i in range(num_frames):
+        video[i, 40:44, i:i+4, :] = 250
+
+    # something big comes and goes, largest at peak
+    for i in range(peak - 6, peak + 7):
+        size = 14 - abs(i - peak) * 2
+        video[i, 5:5+size, 20:20+2*size, :] = 250
+
+    vid = EventVideo.from_file('synthetic.mp4')
+    vid.frames = video
+    vid.num_frames = num_frames
+    vid.height, vid.width = video.shape[1:3]
+    return vid
+
+class TestEventVideo(unittest.TestCase):
+    def test_exhaustive(self):
+        vid = event_video_with_frames()
+        vid.search = 'exhaustive'
+
+        self.assertEqual(vid.most_significant_frame(), 33)
+        self.assertEqual(vid.num_frames, 60)
+        self.assertEqual(len(vid.frame_scores), 60)
+        self.assertEqual(vid.top_frames[0], 33)
+
+    def test_coarse_to_fine(self):
+        vid = event_video_with_frames()
+        vid.search = 'coarse'
+        vid.coarse_step = 5
+
+        self.assertEqual(vid.most_significant_frame(), 33)
+        self.assertEqual(vid.frame_score_step, 5)
+        self.assertEqual(len(vid.frame_scores), 12)
+
+    def test_ensemble_frames(self):
+        vid = event_video_with_frames()
+        vid.most_significant_frame()
+
+        frames = vid.frames_at([40, 33])
+        self.assertEqual(frames.shape, (2, 48, 64, 3))
+        np.testing.assert_array_equal(frames[1], vid.significant_frame)
+
+        vid.frame_boxes = (np.array([[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12]]), np.array([33, 40, 33]))
+        np.testing.assert_array_equal(vid.boxes_at(33), [[1, 2, 3, 4], [9, 10, 11, 12]])
+        self.assertEqual(len(vid.boxes_at(1000)), 0)
+        self.assertEqual(vid.top_frames[0], 33)
+
+    def test_noise_labeling_is_shaped_by_vocab(self):
+        frames = EventFrames()
+        frames.vid, frames.noise, frames.vocab = EventVideo.from_file('synthetic.mp4'), 0.95, ['cat', 'person', 'raccoon']
+
+        lbl = frames.noise_labeling()
+        self.assertEqual(lbl.labels, [NOISE_LABEL])
+        self.assertEqual(lbl.mask, [False] * 3)
+        self.assertEqual(lbl.probabilities, [0.0] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
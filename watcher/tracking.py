@@ -0,0 +1,234 @@
+import numpy as np
+
+__all__ = ['Track', 'Tracker', 'box_iou']
+
+DEFAULT_MIN_IOU = 0.2
+# without overlap, a box still continues a track if its centre is within this many track diagonals
+DEFAULT_MAX_CENTRE_DISTANCE = 0.75
+DEFAULT_MAX_GAP = 5
+DEFAULT_MAX_PATH_POINTS = 32
+DEFAULT_MIN_TRACK_FRAMES = 3
+
+def box_iou(a, b):
+    """Intersection over union of every (x, y, w, h) box in a with every one in b."""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+
+    x0 = np.maximum(a[:, np.newaxis, 0], b[:, 0])
+    y0 = np.maximum(a[:, np.newaxis, 1], b[:, 1])
+    x1 = np.minimum(a[:, np.newaxis, 0] + a[:, np.newaxis, 2], b[:, 0] + b[:, 2])
+    y1 = np.minimum(a[:, np.newaxis, 1] + a[:, np.newaxis, 3], b[:, 1] + b[:, 3])
+
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, np.newaxis] + b[:, 2] * b[:, 3] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+class Track(object):
+    """One moving object, followed from frame to frame.
+
+    The path holds the centre of the box at most max_path_points times. When it fills up,
+    every other point is dropped and later points are taken half as often, so a track takes 
+    the same memory however long it runs.
+    """
+    track_id = None
+    start_frame = None
+    end_frame = None
+    first_box = None
+    box = None
+    num_frames = 0
+
+    peak_area = 0
+    peak_frame = None
+    peak_box = None
+
+    def __init__(self, track_id, frame, box, max_path_points=DEFAULT_MAX_PATH_POINTS):
+        self.track_id = track_id
+        self.start_frame = frame
+        self.max_path_points = max_path_points
+        self.path = []
+        self.path_stride = 1
+        self.first_box = box
+        self.add(frame, box)
+
+    def __repr__(self):
+        return f"<Track {self.track_id} frames {self.start_frame}-{self.end_frame} peak {self.peak_area}>"
+
+    @staticmethod
+    def centre(box):
+        return [int(box[0] + box[2] // 2), int(box[1] + box[3] // 2)]
+
+    def add(self, frame, box):
+        self.end_frame = frame
+        self.box = box
+        self.num_frames += 1
+
+        area = int(box[2] * box[3])
+        if area > self.peak_area:
+            self.peak_area, self.peak_frame, self.peak_box = area, frame, [int(v) for v in box]
+
+        if (frame - self.start_frame) % self.path_stride == 0:
+            self.path.append([frame] + self.centre(box))
+            self.thin_path()
+
+    def thin_path(self):
+        while len(self.path) >= self.max_path_points:
+            self.path = self.path[::2]
+            self.path_stride *= 2
+
+    def extend(self, other):
+        """Continue with other, a track of the same object that starts after this one ends."""
+        self.end_frame = other.end_frame
+        self.box = other.box
+        self.num_frames += other.num_frames
+        if other.peak_area > self.peak_area:
+            self.peak_area, self.peak_frame, self.peak_box = other.peak_area, other.peak_frame, other.peak_box
+
+        self.path += other.as_dict()['path']
+        self.thin_path()
+
+    def as_dict(self):
+        path = self.path
+        if path[-1][0] != self.end_frame:
+            path = path + [[self.end_frame] + self.centre(self.box)]
+
+        return {
+            'id': self.track_id,
+            'start_frame': self.start_frame,
+            'end_frame': self.end_frame,
+            'num_frames': self.num_frames,
+            'peak_frame': self.peak_frame,
+            'peak_area': self.peak_area,
+            'peak_box': self.peak_box,
+            'path': path,
+        }
+
+class Tracker(object):
+    """Links motion boxes into tracks, one frame at a time, in a single pass.
+
+    Each box continues the active track it overlaps most, or failing that the nearest one 
+    close enough. Tracks not continued for more than max_gap frames are closed.
+    """
+    min_iou = DEFAULT_MIN_IOU
+    max_centre_distance = DEFAULT_MAX_CENTRE_DISTANCE
+    max_gap = DEFAULT_MAX_GAP
+
+    def __init__(self, min_iou=DEFAULT_MIN_IOU, max_centre_distance=DEFAULT_MAX_CENTRE_DISTANCE, 
+                 max_gap=DEFAULT_MAX_GAP, max_path_points=DEFAULT_MAX_PATH_POINTS):
+        self.min_iou = min_iou
+        self.max_centre_distance = max_centre_distance
+        self.max_gap = max_gap
+        self.max_path_points = max_path_points
+
+        self.active = []
+        self.finished = []
+        self.next_id = 0
+        self.first_frame = None
+
+    def affinity(self, boxes, tracks=None):
+        """How well each box continues each of tracks, the active ones by default; zero where it doesn't."""
+        track_boxes = np.array([t.box for t in (self.active if tracks is None else tracks)], dtype=np.float64).reshape(-1, 4)
+        iou = box_iou(track_boxes, boxes)
+
+        track_centres = track_boxes[:, :2] + track_boxes[:, 2:] / 2
+        centres = boxes[:, :2] + boxes[:, 2:] / 2
+        distance = np.linalg.norm(track_centres[:, np.newaxis] - centres, axis=2)
+        reach = self.max_centre_distance * np.hypot(track_boxes[:, 2], track_boxes[:, 3])[:, np.newaxis]
+
+        # overlapping matches always rank above matches by distance alone
+        near = np.where(distance < reach, 1 - distance / np.maximum(reach, 1), 0) * self.min_iou
+        return np.where(iou >= self.min_iou, 1 + iou, near)
+
+    @staticmethod
+    def matches(scores):
+        """(track, box) pairs, best first, each track and box used once."""
+        scores = scores.copy()
+        while scores.size:
+            t, b = np.unravel_index(np.argmax(scores), scores.shape)
+            if scores[t, b] <= 0:
+                return
+            yield t, b
+            scores[t, :] = 0
+            scores[:, b] = 0
+
+    def update(self, frame, boxes):
+        """Add the boxes seen in frame. Frames must come in ascending order."""
+        if self.first_frame is None:
+            self.first_frame = frame
+        self.close_before(frame - self.max_gap)
+
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        unmatched = set(range(len(boxes)))
+        if self.active and len(boxes):
+            for t, b in self.matches(self.affinity(boxes)):
+                self.active[t].add(frame, boxes[b].astype(int).tolist())
+                unmatched.discard(b)
+
+        for b in sorted(unmatched):
+            self.active.append(Track(self.next_id, frame, boxes[b].astype(int).tolist(), self.max_path_points))
+            self.next_id += 1
+
+    def close_before(self, frame):
+        still_active = []
+        for track in self.active:
+            (still_active if track.end_frame >= frame else self.finished).append(track)
+        self.active = still_active
+
+    def track(self, boxes, frames):
+        """Feed a whole sequence of boxes, with the frame of each."""
+        order = np.argsort(frames, kind='stable')
+        boxes = np.asarray(boxes).reshape(-1, 4)[order]
+        frames = np.asarray(frames)[order]
+        frame_ids, starts = np.unique(frames, return_index=True)
+        for frame, frame_boxes in zip(frame_ids, np.split(boxes, starts[1:])):
+            self.update(int(frame), frame_boxes)
+        return self
+
+    def join(self, later):
+        """Take on the tracks of later, a tracker of the next segment of the same clip.
+
+        Tracks of later that start within max_gap of its first frame continue the tracks still
+        open here, when their first box matches as a box in update would. The others are added
+        with new ids.
+        """
+        if later.first_frame is None:
+            return self
+        if self.first_frame is None:
+            self.first_frame = later.first_frame
+
+        open_tracks = [t for t in self.active if t.end_frame >= later.first_frame - self.max_gap]
+        starting = [t for t in later.finished + later.active if t.start_frame <= later.first_frame + self.max_gap]
+        continued = {}
+        if open_tracks and starting:
+            first_boxes = np.array([t.first_box for t in starting], dtype=np.float64)
+            for t, b in self.matches(self.affinity(first_boxes, open_tracks)):
+                continued[id(starting[b])] = open_tracks[t]
+
+        self.finished += [t for t in self.active if t not in continued.values()]
+        self.active = []
+        for track in sorted(later.finished + later.active, key=lambda t: t.track_id):
+            ongoing = track in later.active
+            if id(track) in continued:
+                earlier = continued[id(track)]
+                earlier.extend(track)
+                track = earlier
+            else:
+                track.track_id = self.next_id
+                self.next_id += 1
+            (self.active if ongoing else self.finished).append(track)
+        return self
+
+    @classmethod
+    def merge(cls, trackers):
+        """Join the trackers of consecutive segments of one clip, in order."""
+        merged = cls()
+        for tracker in trackers:
+            if merged.first_frame is None:
+                merged = tracker
+            else:
+                merged.join(tracker)
+        return merged
+
+    def tracks(self, min_frames=DEFAULT_MIN_TRACK_FRAMES):
+        """Every track so far, in order of first appearance, leaving out ones seen in fewer than min_frames."""
+        tracks = sorted(self.finished + self.active, key=lambda t: t.track_id)
+        return [t for t in tracks if t.num_frames >= min_frames]
@@ -1,10 +1,11 @@
 from datetime import datetime
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
 import os
-import time
 import math
 
 from pathlib import Path
-from rq import Queue, Retry, Worker
+from rq import Queue, Retry, Worker, get_current_job
 
 import cv2 as cv
 import numpy as np
@@ -14,17 +15,46 @@ import ffmpeg
 import sqlalchemy
 from sqlalchemy import select
 
-from .connection import TunneledConnection, redis_connection, application_config
-from .model import EventObservation, IntermediateResult
+from .connection import TunneledConnection, redis_connection, application_config, application_flag
+from .model import EventObservation, IntermediateResult, Labeling
+from .background import SceneBackground
+from .probe import probe_video, FFMPEGError
+from .bounding_box import crop_regions
+from .frame_handoff import put_frames, DEFAULT_HANDOFF_TTL
+from .dedup import event_claim
+from .priority import queue_for, queues_by_priority, reroute_job, is_low_priority
+from .backpressure import Admission, admit_event
+from .metrics import instrumented, set_outcome, count_bytes, decoding, timed_decode
+from .noise import noise_features, noise_confidence, NOISE_LABEL, NOISE_DECIDER
+from .predict_still import still_model_vocab
 
 from .image_functions import *
 from .lite_tasks import *
 
-__all__ = ['EventVideo','task_save_significant_frame', 'run_video_queue']
+__all__ = ['EventVideo', 'EventFrames', 'analyse_event', 'task_save_significant_frame', 'queue_event_stages', 'run_video_queue']
 
 NUM_INITAL_FRAMES_TO_AVERAGE = 5
 DEFAULT_MAX_FRAMES_PER_CHUNK = 50
 
+# 'full' scores every pixel in colour. 'luma' scores a downscaled grey stream, 
+# then decodes only the chosen frame at full resolution.
+ANALYSIS_PIXEL_FORMATS = {'full': 'rgb24', 'luma': 'gray'}
+DEFAULT_ANALYSIS_PROFILE = 'full'
+DEFAULT_ANALYSIS_DOWNSCALE = 4
+DEFAULT_SCAN_WORKERS = 1
+DEFAULT_TOP_FRAMES = 3
+DEFAULT_TOP_FRAME_SEPARATION = 15
+DEFAULT_MAX_CROPS = 2
+DEFAULT_NOISE_CONFIDENCE = 0.9
+DEFAULT_ENSEMBLE_FRAMES = 1
+
+# 'exhaustive' scores every frame. 'coarse' scores every COARSE_STEP-th frame, 
+# then every frame near the best COARSE_CANDIDATES of those.
+SEARCH_MODES = ['exhaustive', 'coarse']
+DEFAULT_SEARCH = 'exhaustive'
+DEFAULT_COARSE_STEP = 5
+DEFAULT_COARSE_CANDIDATES = 2
+
 from . import setup_logging
 logger = setup_logging()
 
@@ -36,9 +66,6 @@ def get_shared_tunnel():
         shared_tunnel = TunneledConnection().connect()
     return shared_tunnel
 
-class FFMPEGError(Exception):
-    pass 
-
 class EventVideo(object):
     tunnel = None
     session = None
@@ -49,10 +76,32 @@ class EventVideo(object):
 
     frames = None
     most_significant_frame_idx = None
+    significant_frame = None
+    frame_scores = None
+    frame_score_step = 1
+    top_frames = None
     num_frames = 0
     width = 0
     height = 0
     duration = None
+    frame_rate = None
+
+    analysis_profile = DEFAULT_ANALYSIS_PROFILE
+    analysis_downscale = 1
+
+    use_scene_background = False
+    scene_background = None
+
+    search = DEFAULT_SEARCH
+    coarse_step = DEFAULT_COARSE_STEP
+    coarse_candidates = DEFAULT_COARSE_CANDIDATES
+
+    find_motion_boxes = True
+    motion_boxes = None
+    frame_boxes = None
+
+    track_objects = True
+    tracks = None
 
     def get_tunnel(self):
         if not self.tunnel:
@@ -82,66 +131,264 @@ class EventVideo(object):
             raise Exception(msg)
 
         self.file = vidfile
+        self.configure()
+
+    @classmethod
+    def from_file(cls, vidfile):
+        """An EventVideo for a file with no database event, for experiments and benchmarks."""
+        vid = cls.__new__(cls)
+        vid.name = Path(vidfile).stem
+        vid.file = str(vidfile)
+        vid.configure()
+        vid.use_scene_background = False
+        return vid
+
+    def configure(self):
+        self.analysis_profile = application_config('video', 'ANALYSIS_PROFILE') or DEFAULT_ANALYSIS_PROFILE
+        if self.analysis_profile not in ANALYSIS_PIXEL_FORMATS:
+            raise ValueError(f"unknown analysis profile {self.analysis_profile}")
+        if self.analysis_profile == 'luma':
+            self.analysis_downscale = int(application_config('video', 'ANALYSIS_DOWNSCALE') or DEFAULT_ANALYSIS_DOWNSCALE)
+
+        self.use_scene_background = application_flag('video', 'SCENE_BACKGROUND')
+
+        self.search = application_config('video', 'SEARCH') or DEFAULT_SEARCH
+        if self.search not in SEARCH_MODES:
+            raise ValueError(f"unknown search mode {self.search}")
+        self.coarse_step = int(application_config('video', 'COARSE_STEP') or DEFAULT_COARSE_STEP)
+        self.coarse_candidates = int(application_config('video', 'COARSE_CANDIDATES') or DEFAULT_COARSE_CANDIDATES)
+
+        self.find_motion_boxes = application_flag('video', 'MOTION_BOXES', default=True)
+        self.track_objects = self.find_motion_boxes and application_flag('video', 'TRACKS', default=True)
+
+    @property
+    def analysis_size(self):
+        return self.width // self.analysis_downscale, self.height // self.analysis_downscale
+
+    @property
+    def box_scale(self):
+        """Factor from analysed frames to full resolution, or None when motion boxes are off."""
+        if not self.find_motion_boxes:
+            return None
+        return 1 if self.frames is not None else self.analysis_downscale
 
 
     def probe_file(self):
         try:
-            info = ffmpeg.probe(self.event.file_path)
-
-            tries_remaining = 3
-            while not 'streams' in info and tries_remaining > 0:
-                time.sleep(1)
-                info = ffmpeg.probe(self.file)
-                tries_remaining -= 1
-
-            video_info = next(stream for stream in info['streams'] if stream['codec_type'] == 'video')
-            self.width = int(video_info['width'])
-            self.height = int (video_info['height'])
-            self.num_frames = int(video_info['nb_frames'])
-            self.duration = float(video_info['duration'])
-
-        except KeyError as ke:
-            logger.error(str(ke))
-            raise ke
-
-        except Exception as e:
+            info = probe_video(self.file)
+        except FFMPEGError:
+            raise
+        except ffmpeg.Error as e:
             logger.error(f"{str(e)} exception from ffmpeg:\nSTDERR: {e.stderr}\nSTDOUT: {e.stdout}")
-            if e.stderr.endswith(b'Invalid data found when processing input\n'):
-                raise FFMPEGError(f'Invalid data when probing {self.file}') from e
-            else:
-                raise e
+            raise e
+        except (KeyError, StopIteration) as e:
+            logger.error(f"no usable video stream in {self.file}: {e!r}")
+            raise e
+
+        self.width = info.width
+        self.height = info.height
+        self.num_frames = info.num_frames
+        self.duration = info.duration
+        self.frame_rate = info.frame_rate
 
     def load_frames(self):
-        if not self.frames:
+        if self.frames is None:
             self.probe_file() 
-            self.frames = fetch_video_from_file(self.file)
+            with decoding():
+                self.frames = fetch_video_from_file(self.file)
+
+    def frame_chunks(self, chunk_size, start_frame=0, num_frames=None, step=1):
+        if self.frames is not None:
+            end = self.num_frames if num_frames is None else start_frame + num_frames
+            for begin in range(start_frame, end, chunk_size * step):
+                yield self.frames[begin:min(begin + chunk_size * step, end):step]
+        else:
+            if not self.width:
+                self.probe_file()
+
+            # seek half a frame early, so rounding can't skip the first frame of the window
+            start = float((start_frame - Fraction(1, 2)) / self.frame_rate) if start_frame else None
+
+            width, height = self.analysis_size
+            filters = [f"scale={width}:{height}"] if self.analysis_downscale > 1 else None
+            yield from timed_decode(stream_video_from_file(self.file, width, height, chunk_size,
+                                                           pix_fmt=ANALYSIS_PIXEL_FORMATS[self.analysis_profile],
+                                                           filters=filters, start=start, frames=num_frames, step=step))
+
+    def initial_background(self):
+        first = np.concatenate(list(self.frame_chunks(NUM_INITAL_FRAMES_TO_AVERAGE, 0, NUM_INITAL_FRAMES_TO_AVERAGE)))
+        return np.mean(first, axis=0, dtype=np.float32)
+
+    def load_scene_background(self):
+        """The stored background for this scene, if there is a recent one matching the analysis profile."""
+        if not self.width:
+            self.probe_file()
+
+        width, height = self.analysis_size
+        self.scene_background = SceneBackground.load(self.event.scene_name, width, height,
+                                                     ANALYSIS_PIXEL_FORMATS[self.analysis_profile])
+        if not self.scene_background or self.scene_background.is_stale:
+            return None
+
+        logger.debug(f"using {self.scene_background} for {self.name}")
+        return self.scene_background.image
+
+    def save_scene_background(self, scan):
+        observed, seen = scan.quiet_image()
+        if observed is None:
+            return
+
+        if not self.scene_background:
+            self.scene_background = SceneBackground(self.event.scene_name, scan.background, 
+                                                    ANALYSIS_PIXEL_FORMATS[self.analysis_profile])
+        try:
+            self.scene_background.update(observed, seen).save()
+        except OSError as e:
+            logger.warning(f"could not save background for {self.event.scene_name}: {e}")
+
+    def scan_segments(self, chunk_size, workers, background=None):
+        """Score the clip as up to `workers` segments in parallel, each decoding its own window."""
+        if not self.width:
+            self.probe_file()
+
+        segment_size = max(math.ceil(self.num_frames / workers), chunk_size)
+        starts = range(0, self.num_frames, segment_size)
+
+        if background is None:
+            background = self.initial_background()
+
+        def scan_segment(start_frame):
+            scan = MotionScan(background=background, start_index=start_frame, collect_quiet=self.use_scene_background,
+                              box_scale=self.box_scale, keep_boxes=self.boxes_to_keep(), track=self.track_objects)
+            return scan.scan(self.frame_chunks(chunk_size, start_frame, segment_size))
+
+        with ThreadPoolExecutor(max_workers=len(starts)) as pool:
+            scans = list(pool.map(scan_segment, starts))
+
+        logger.debug(f"scanned {self.name} as {len(scans)} segments of {segment_size} frames")
+        return MotionScan.merge(scans)
+
+    def search_coarse_to_fine(self, chunk_size, background=None):
+        """Score every coarse_step-th frame, then every frame around the best few of those.
+
+        Returns the coarse scan, whose timeline has one score per coarse_step frames, and 
+        the fine scan that holds the chosen frame.
+        """
+        if not self.width:
+            self.probe_file()
+        if background is None:
+            background = self.initial_background()
+
+        step = self.coarse_step
+        coarse = MotionScan(background=background, collect_quiet=self.use_scene_background)
+        coarse.scan(self.frame_chunks(chunk_size, step=step))
+
+        fine = []
+        for peak in top_peaks(coarse.frame_scores, self.coarse_candidates, 2) or [coarse.best_index or 0]:
+            start_frame = max(peak * step - step + 1, 0)
+            count = max(min(peak * step + step, self.num_frames) - start_frame, 1)
+
+            # the windows are short, so every frame of them keeps its boxes
+            scan = MotionScan(background=background, start_index=start_frame, box_scale=self.box_scale,
+                              track=self.track_objects)
+            fine.append(scan.scan(self.frame_chunks(chunk_size, start_frame, count)))
+
+        logger.debug(f"coarse search of {self.name} refined {len(fine)} windows around every {step}th frame")
+        return coarse, MotionScan.merge(sorted(fine, key=lambda scan: scan.start_index))
+
+    def top_frame_settings(self):
+        k = int(application_config('video', 'TOP_FRAMES') or DEFAULT_TOP_FRAMES)
+        separation = int(application_config('video', 'TOP_FRAME_SEPARATION') or DEFAULT_TOP_FRAME_SEPARATION)
+        return k, separation
+
+    def boxes_to_keep(self):
+        """How many of the highest scoring frames a scan of every frame keeps the boxes of, enough
+        for any of the top frames: each ranks below at most the frames within the separation of
+        the ones picked before it.
+        """
+        k, separation = self.top_frame_settings()
+        return k * max(2 * separation - 1, 1)
+
+    def pick_top_frames(self):
+        """The chosen frame, followed by the other distinct peaks of the score timeline."""
+        k, separation = self.top_frame_settings()
+
+        step = self.frame_score_step
+        best = self.most_significant_frame_idx
+        peaks = top_peaks(self.frame_scores, k, math.ceil(separation / step))
+
+        others = [p * step for p in peaks if abs(p * step - best) >= separation]
+        return [best] + others[:k - 1]
 
     def most_significant_frame(self):
-        if not self.frames:
-            self.load_frames()
-
-        self.num_frames = np.shape(self.frames)[0]
-
-        if not self.most_significant_frame_idx:
-            thresh_sums = np.zeros(self.num_frames)
+        if self.frames is not None:
+            self.num_frames = np.shape(self.frames)[0]
 
+        if self.most_significant_frame_idx is None:
             chunk_size = int(application_config('video', 'MAX_FRAMES_PER_CHUNK') or DEFAULT_MAX_FRAMES_PER_CHUNK)
-            avg = (np.mean(self.frames[0:NUM_INITAL_FRAMES_TO_AVERAGE,:,:,:], axis=0, dtype=np.float32))
-
-            for i in range(0, math.ceil(self.num_frames/chunk_size)):
-                begin = i * chunk_size
-                end = min((i+1) * chunk_size -1, self.num_frames)
-
-                L1_dist = abs(self.frames[begin:end,:,:,:] - avg)
-                norms = rescale(np.linalg.norm(L1_dist, axis=-1))
-                thresh = threshold_video(norms)
+            workers = int(application_config('video', 'SCAN_WORKERS') or DEFAULT_SCAN_WORKERS)
 
-                thresh_sums[begin:end] = np.sum(thresh, axis=(1,2))
+            use_scene_background = self.use_scene_background and self.frames is None
+            background = self.load_scene_background() if use_scene_background else None
 
-            self.most_significant_frame_idx = np.argmax(thresh_sums)
+            if self.search == 'coarse':
+                coarse, scan = self.search_coarse_to_fine(chunk_size, background)
+                timeline = coarse
+                self.frame_score_step = self.coarse_step
+            elif workers > 1 and self.frames is None:
+                scan = timeline = self.scan_segments(chunk_size, workers, background)
+            else:
+                scan = timeline = MotionScan(background=background, window_size=NUM_INITAL_FRAMES_TO_AVERAGE, 
+                                             collect_quiet=use_scene_background, box_scale=self.box_scale,
+                                             keep_boxes=self.boxes_to_keep(), track=self.track_objects)
+                scan.scan(self.frame_chunks(chunk_size))
+
+            if use_scene_background:
+                self.save_scene_background(timeline)
+
+            if self.search != 'coarse':
+                self.num_frames = scan.num_frames
+            self.most_significant_frame_idx = scan.best_index
+            self.significant_frame = scan.best_frame
+            if self.find_motion_boxes:
+                self.frame_boxes = scan.motion_boxes
+                self.motion_boxes = scan.boxes_in_frame(self.most_significant_frame_idx)
+            if self.track_objects and scan.tracker is not None:
+                self.tracks = [t.as_dict() for t in scan.tracker.tracks()]
+
+            self.frame_scores = timeline.frame_scores
+            self.top_frames = self.pick_top_frames()
+
+            if self.frames is None and self.analysis_profile != 'full':
+                with decoding():
+                    self.significant_frame = fetch_frame_from_file(self.file, self.most_significant_frame_idx, 
+                                                                   self.width, self.height)
 
         return int(self.most_significant_frame_idx)
 
+    def boxes_at(self, index):
+        """Motion boxes found in the frame at index, if boxes were looked for. Only those of the
+        top frames are sure to be kept.
+        """
+        if self.frame_boxes is None:
+            return None
+        boxes, frames = self.frame_boxes
+        return boxes[frames == index]
+
+    def frames_at(self, indices):
+        """Full size RGB frames at indices, decoded together."""
+        if self.frames is not None:
+            return self.frames[list(indices)]
+        with decoding():
+            return fetch_frames_from_file(self.file, indices, self.width, self.height)
+
+    def noise_estimate(self):
+        """Confidence that the event is only noise, and the evidence for it."""
+        noise_level = self.event.noise_level if self.event is not None else None
+        features = noise_features(self.frame_scores, self.motion_boxes if self.motion_boxes is not None else [], 
+                                  (self.width, self.height), self.tracks, noise_level)
+        return noise_confidence(features), features
+
 kern = np.ones((7,7))
 
 def find_background(cap, num_frames = NUM_INITAL_FRAMES_TO_AVERAGE):
@@ -189,59 +436,220 @@ def find_background(cap, num_frames = NUM_INITAL_FRAMES_TO_AVERAGE):
 
 
 
-def task_save_significant_frame(name):
-    if isinstance(name, list):
-        name = name[0]
-    
-    with TunneledConnection() as tc:
+def frame_crops(boxes, img, img_relpath, max_crops):
+    """(file, image, box) for square crops of img around its motion boxes, named after img_relpath."""
+    if boxes is None or max_crops <= 0:
+        return []
+    return [(img_relpath.with_name(f"{img_relpath.stem}_c{i}.jpg"), img.crop((x, y, x + w, y + h)), [x, y, w, h])
+            for i, (x, y, w, h) in enumerate(crop_regions(boxes, img.width, img.height, max_crops).tolist())]
 
-        session = sqlalchemy.orm.Session(tc)
+class EventFrames(object):
+    """What the video stage found in an event: the chosen frame, its crops, any other frames for an
+    ensemble, and the result and noise verdict to record. Produced by analyse_event and consumed
+    by either the multi-queue or the fused pipeline.
+    """
+    vid = None
+    name = None
+    result = None
+    img = None
+    img_relpath = None
+    crops = None
+    ensemble = None
+    noise = 0.0
+    is_noise = False
+    vocab = None
+
+    def images(self):
+        """(file, image) for every still to write: the frame, its crops, then the ensemble's."""
+        images = [(self.img_relpath, self.img)] + [(relpath, crop) for relpath, crop, _ in self.crops]
+        for _, relpath, other_img, other_crops in self.ensemble:
+            images += [(relpath, other_img)] + [(c, crop) for c, crop, _ in other_crops]
+        return images
+
+    def intermediate_result(self):
+        return IntermediateResult(
+            computed_at = datetime.now(),
+            step = 'task_save_significant_frame',
+            file = str(self.img_relpath),
+            info = self.result,
+            event_id = self.vid.event.id
+        )
 
-        result = {}
+    def noise_labeling(self):
+        """None of the model's labels, with a mask and probabilities over its vocab like its own
+        labelings. How sure the noise verdict is, and why, is in the intermediate result.
+        """
+        return Labeling(
+            labels = [NOISE_LABEL],
+            decider = NOISE_DECIDER,
+            mask = [False] * len(self.vocab),
+            probabilities = [0.0] * len(self.vocab),
+            event = self.vid.event,
+        )
 
-        vid = EventVideo(name=name, session=session)
+def analyse_event(session, name, search=None):
+    """Scan an event's video for its most significant frame, crops and the rest of its EventFrames.
+    search overrides [video] SEARCH, as for a coarse scan when there is a backlog.
+    """
+    result = {}
+
+    vid = EventVideo(name=name, session=session)
+    count_bytes(os.path.getsize(vid.file))
+    if search:
+        vid.search = search
+
+    logger.info(f"starting video analysis for {name} at {vid.file}")
+
+    #option 1 - frame by frame.
+    #sig_frame, num_frames, frame_img = find_sigificant_frame(str(vid.file))
+
+    #option 2 - stream frames from ffmpeg in chunks, keeping only the best one
+    sig_frame = vid.most_significant_frame()
+    num_frames = vid.num_frames
+    frame_img = vid.significant_frame
+
+    result['most_significant_frame'] = sig_frame
+    result['number_of_frames'] = num_frames
+    result['duration'] = vid.duration
+    result['top_frames'] = vid.top_frames
+    result['frame_scores'] = encode_scores(vid.frame_scores)
+    result['frame_score_step'] = vid.frame_score_step
+    if vid.motion_boxes is not None:
+        result['motion_boxes'] = vid.motion_boxes.tolist()
+    if vid.tracks is not None:
+        result['tracks'] = vid.tracks
+
+    noise, evidence = vid.noise_estimate()
+    result['noise'] = {'confidence': round(noise, 3), 'evidence': {k: round(v, 3) for k, v in evidence.items()}}
+    is_noise = noise >= float(application_config('video', 'NOISE_CONFIDENCE') or DEFAULT_NOISE_CONFIDENCE)
+    vocab = still_model_vocab() if is_noise else None
+    if is_noise and vocab is None:
+        logger.warning(f"{name} looks like noise ({noise:.2f}), but with no vocab to label it by, it is predicted")
+        is_noise = False
+
+    img_relpath = Path(vid.event.video_location) / f"{name}_f{sig_frame}.jpg"
+    img = Image.fromarray(frame_img,mode='RGB')
+
+    # close-ups of where the motion was, so the classifier sees small animals at full detail
+    max_crops = int(application_config('video', 'MAX_CROPS') or DEFAULT_MAX_CROPS) if not is_noise else 0
+    crops = frame_crops(vid.motion_boxes, img, img_relpath, max_crops)
+    if vid.motion_boxes is not None and max_crops > 0:
+        result['crops'] = [{'file': str(relpath), 'box': box} for relpath, _, box in crops]
+
+    # the next best peaks, for the predictor to combine with this frame
+    ensemble = []
+    ensemble_frames = int(application_config('prediction', 'ENSEMBLE_FRAMES') or DEFAULT_ENSEMBLE_FRAMES)
+    others = vid.top_frames[1:ensemble_frames] if not is_noise else []
+    if others:
+        for idx, other in zip(others, vid.frames_at(others)):
+            other_img = Image.fromarray(other, mode='RGB')
+            other_relpath = Path(vid.event.video_location) / f"{name}_f{idx}.jpg"
+            ensemble.append((idx, other_relpath, other_img, frame_crops(vid.boxes_at(idx), other_img, other_relpath, max_crops)))
+        result['ensemble'] = [{'frame': idx, 'file': str(relpath), 'crops': [str(c) for c, _, _ in other_crops]}
+                              for idx, relpath, _, other_crops in ensemble]
+
+    frames = EventFrames()
+    frames.vid, frames.name, frames.result = vid, name, result
+    frames.img, frames.img_relpath, frames.crops, frames.ensemble = img, img_relpath, crops, ensemble
+    frames.noise, frames.is_noise, frames.vocab = noise, is_noise, vocab
+
+    logger.info(f"found frame {sig_frame} for {name}. Will store as {img_relpath} with {len(crops)} crops"
+                + (f" and {len(ensemble)} more frames" if ensemble else ""))
+    return frames
+
+def event_lighting(name):
+    with TunneledConnection() as tc:
+        session = sqlalchemy.orm.Session(tc)
+        return session.scalar(select(EventObservation.lighting_type).where(EventObservation.event_name == name))
 
-        logger.info(f"starting video analysis for {name} at {vid.file}")
+@instrumented('task_save_significant_frame')
+def task_save_significant_frame(name):
+    if isinstance(name, list):
+        name = name[0]
 
-        #option 1 - frame by frame.
-        #sig_frame, num_frames, frame_img = find_sigificant_frame(str(vid.file))
+    # before claiming, so the job it is moved to can have the claim
+    if reroute_job(get_current_job(), redis_connection(), lambda: event_lighting(name)):
+        set_outcome('rerouted')
+        return
+
+    with event_claim('video', name) as claimed:
+        if not claimed:
+            set_outcome('duplicate')
+            return
+
+        # with a backlog, do less for this event and record what was left out
+        admission = admit_event(redis_connection(), lambda: is_low_priority(event_lighting(name)))
+        if admission.defer:
+            set_outcome('deferred')
+            return defer_event(name, admission)
+
+        if application_flag('video', 'FUSED_PIPELINE'):
+            from .pipeline import task_process_event
+            return task_process_event(name, admission)
+        return queue_event_stages(name, admission)
+
+def defer_event(name, admission):
+    """Leave the event for the backfill, only recording that it was deferred."""
+    with TunneledConnection() as tc:
+        session = sqlalchemy.orm.Session(tc)
+        session.add(admission.result(EventObservation.by_name(session, name)))
+        session.commit()
+    logger.info(f"deferred {name} to the backfill")
 
-        #option 2 - read frames with ffmpeg, then work on them
-        sig_frame = vid.most_significant_frame()
-        num_frames = vid.num_frames
-        frame_img = vid.frames[sig_frame,:,:,:]
+def queue_event_stages(name, admission=None):
+    """Analyse the event here, then queue its still writes and prediction for the io and prediction workers."""
+    admission = admission or Admission()
 
-        result['most_significant_frame'] = sig_frame
-        result['number_of_frames'] = num_frames
-        result['duration'] = vid.duration
+    with TunneledConnection() as tc:
 
-        img_relpath = Path(vid.event.video_location) / f"{name}_f{sig_frame}.jpg"
-        img = Image.fromarray(frame_img,mode='RGB')
+        session = sqlalchemy.orm.Session(tc)
 
-        ir = IntermediateResult(
-            computed_at = datetime.now(),
-            step = 'task_save_significant_frame',
-            file = str(img_relpath),
-            info = result,
-            event_id = vid.event.id
-        )
-        session.add(ir)
+        found = analyse_event(session, name, search='coarse' if admission.coarse else None)
+        session.add(found.intermediate_result())
+        if found.is_noise:
+            session.add(found.noise_labeling())
+        if admission:
+            session.add(admission.result(found.vid.event))
         session.commit()
-        
-        io_queue = Queue('write_image', connection=redis_connection())
-        write_job = io_queue.enqueue(task_write_image, args=(img, str(img_relpath)), 
-                            retry=Retry(max=3, interval=5*60))
 
-        logger.info(f"found frame {sig_frame} for {name}. Will store as {img_relpath}")
-
-        predict_queue = Queue('prediction', connection=redis_connection())
+        io_queue = Queue('write_image', connection=redis_connection())
+        write_jobs = [io_queue.enqueue(task_write_image, args=(image, str(relpath)), retry=Retry(max=3, interval=5*60))
+                      for relpath, image in found.images()]
+
+        if found.is_noise:
+            logger.info(f"{name} looks like noise ({found.noise:.2f}), skipping prediction")
+            return
+
+        if admission.skip_prediction:
+            logger.info(f"skipping prediction of {name} until the backfill")
+            return
+
+        predict_kwargs = {'crops': [str(relpath) for relpath, _, _ in found.crops]}
+        if found.ensemble:
+            predict_kwargs['ensemble'] = [dict(member) for member in found.result['ensemble']]
+
+        if application_flag('prediction', 'FRAME_HANDOFF', default=True):
+            # the predictor takes the frames from Redis, running alongside the JPEG writes
+            ttl = int(application_config('prediction', 'HANDOFF_TTL') or DEFAULT_HANDOFF_TTL)
+            predict_kwargs['frames'] = put_frames(redis_connection(), name, [found.img] + [crop for _, crop, _ in found.crops], ttl)
+            for member, (idx, _, other_img, other_crops) in zip(predict_kwargs.get('ensemble', []), found.ensemble):
+                member['frames'] = put_frames(redis_connection(), f"{name}:{idx}", [other_img] + [c for _, c, _ in other_crops], ttl)
+            write_jobs = None
+
+        predict_queue = Queue(queue_for('prediction', found.vid.event.lighting_type), connection=redis_connection())
         job = predict_queue.enqueue('watcher.predict_still.task_predict_still', 
-                                    depends_on=write_job,
-                                    args=(str(img_relpath), name),
+                                    depends_on=write_jobs,
+                                    args=(str(found.img_relpath), name),
+                                    kwargs=predict_kwargs,
                                     retry=Retry(max=1, interval=17*60))
-        logger.debug(f"enqueued prediction for {img_relpath} as {job.id}")
+        logger.debug(f"enqueued prediction for {found.img_relpath} as {job.id}")
+
+def run_video_queue(queues = None):
+    queues = queues or queues_by_priority('event_video')
+    if application_flag('video', 'FUSED_PIPELINE'):
+        from .pipeline import preload_model
+        preload_model()
 
-def run_video_queue(queues = ['event_video']):
     with TunneledConnection():
         worker = Worker(queues, connection=redis_connection())
         worker.work(with_scheduler=True)
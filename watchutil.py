@@ -182,11 +182,34 @@ def batch_sync_to_remote(session):
 
 def enqueue_event(session, event_names):
     from watcher.video import task_save_significant_frame
+    from watcher.dedup import event_claim_owner
+    from watcher.priority import queue_for
 
     for name in event_names: 
-        queue = Queue(connection=redis_connection(),name='event_video')
+        owner = event_claim_owner(redis_connection(), 'video', name)
+        if owner:
+            print(f"not queueing {name}, already claimed by {owner}. release-claims {name} to run it again")
+            continue
+
+        event = EventObservation.by_name(session, name)
+        queue = Queue(connection=redis_connection(),name=queue_for('event_video', event.lighting_type if event else None))
         queue.enqueue(task_save_significant_frame,name)
 
+def backfill(session, limit=None):
+    from watcher.backpressure import backfill_events
+
+    for name, stage in backfill_events(session, redis_connection(), limit):
+        print(f"queued {stage} for {name}")
+
+def release_claims(event_names):
+    from watcher.dedup import event_claim_owner, release_event, STAGES
+
+    for name in event_names:
+        for stage in STAGES:
+            owner = event_claim_owner(redis_connection(), stage, name)
+            if owner and release_event(redis_connection(), stage, name, owner):
+                print(f"released {stage} of {name} from {owner}")
+
 def show_failed(sub_args=None):
     queue = Queue(connection=redis_connection())
     failed = FailedJobRegistry(queue=queue)
@@ -206,6 +229,34 @@ def uncategorized(session, limit=0):
     un = [r.api_response_dict() for r in api.fetch_uncategorized(session, limit=limit)]
     print(json.dumps(un, indent=2))
 
+def show_prediction_cache(sub_args=None):
+    from watcher.predict_still import still_model_file, DEFAULT_BACKEND
+    from watcher.prediction_cache import prediction_cache
+
+    backend = application_config('prediction', 'BACKEND') or DEFAULT_BACKEND
+    cache = prediction_cache(still_model_file(backend).name)
+    if cache is None:
+        print("prediction cache is disabled")
+    elif sub_args and sub_args[0] == 'clear':
+        cache.clear()
+        print(f"cleared cached predictions for {cache.model_name}")
+    else:
+        print(json.dumps(cache.stats(), indent=2))
+
+def quantize_model(session, mode='dynamic', limit=None):
+    from watcher.training import get_labeled_data
+    from watcher.predict_still import onnx_model_file
+    from watcher.still_model import quantize_onnx, OnnxStillModel, accuracy_report
+
+    labeled = get_labeled_data(session)[:limit or None]
+    onnx_file = onnx_model_file()
+
+    quantized = quantize_onnx(onnx_file, mode, calibration_files=[f for f, _ in labeled if Path(f).exists()])
+    print(f"wrote {quantized}")
+
+    report = accuracy_report({'float32': OnnxStillModel(onnx_file), f"int8-{mode}": OnnxStillModel(quantized)}, labeled)
+    print(json.dumps(report, indent=2))
+
 def migrate_truth(session):
     stmt = (
         select(EventObservation)
@@ -257,10 +308,16 @@ def main():
         'update_lighting',
         'syncup',
         'enque',
+        'release-claims',
+        'backfill',
         'failed',
         'ioworker',
         'videoworker',
         'predictionworker',
+        'export-model',
+        'quantize-model',
+        'prediction-cache',
+        'live',
         'singlevideo',
         'uncategorized',
         'requeue-failed',
@@ -291,6 +348,10 @@ def main():
             batch_sync_to_remote(session)
         elif args.action == 'enque':
             enqueue_event(session, args.sub_args)
+        elif args.action == 'release-claims':
+            release_claims(args.sub_args)
+        elif args.action == 'backfill':
+            backfill(session, limit=args.limit)
         elif args.action == 'failed':
             show_failed(args.sub_args)
         elif args.action == 'ioworker':
@@ -302,6 +363,17 @@ def main():
         elif args.action == 'predictionworker':
             import watcher.predict_still
             watcher.predict_still.run_prediction_queue()
+        elif args.action == 'export-model':
+            from watcher.still_model import export_onnx
+            model_file = args.file or Path(__file__).parent / application_config('prediction','STILL_MODEL_FILE')
+            print(f"wrote {export_onnx(model_file)}")
+        elif args.action == 'quantize-model':
+            quantize_model(session, *args.sub_args[0:1], limit=args.limit)
+        elif args.action == 'prediction-cache':
+            show_prediction_cache(args.sub_args)
+        elif args.action == 'live':
+            import watcher.live
+            watcher.live.run_live_camera(*args.sub_args[0:2])
         elif args.action == 'uncategorized':
             uncategorized(session, limit=args.limit)
         elif args.action == 'singlevideo':